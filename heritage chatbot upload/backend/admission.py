@@ -0,0 +1,211 @@
+import asyncio
+import math
+import os
+import time
+from collections import deque
+
+from cache import LRUTTLCache
+from metrics import registry
+
+ADMISSION_REQUESTS = registry.counter(
+    "chat_admission_total",
+    "/chat admission outcomes (admitted, queued, rejected_queue_full, rejected_rate_limit, queue_timeout)",
+    labels=("outcome",)
+)
+
+
+class AdmissionRejected(Exception):
+    """Raised when a request is not accepted; the API answers 429"""
+
+    def __init__(self, reason, message, retry_after=1):
+        super().__init__(message)
+        self.reason = reason
+        self.retry_after = retry_after
+
+
+class TokenBucket:
+    """Classic token bucket: rate tokens per second, up to burst saved up"""
+
+    __slots__ = ("rate", "burst", "tokens", "updated")
+
+    def __init__(self, rate, burst):
+        self.rate = rate
+        self.burst = burst
+        self.tokens = burst
+        self.updated = time.monotonic()
+
+    def take(self):
+        """Take one token. Returns 0 on success, else seconds until one is available."""
+        now = time.monotonic()
+        self.tokens = min(self.burst, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+        if self.tokens >= 1:
+            self.tokens -= 1
+            return 0
+        return (1 - self.tokens) / self.rate
+
+
+class Ticket:
+    """A request's place in the admission controller: active or queued"""
+
+    __slots__ = ("controller", "sequence", "future", "released")
+
+    def __init__(self, controller, sequence, future=None):
+        self.controller = controller
+        self.sequence = sequence
+        self.future = future
+        self.released = False
+
+    @property
+    def admitted(self):
+        return self.future is None or self.future.done()
+
+    def position(self):
+        """1-based place in the wait queue (an upper bound if earlier waiters gave up)"""
+        return self.controller._position(self)
+
+    async def wait(self):
+        """Yield the queue position whenever it changes until a slot is granted.
+
+        Positions are re-checked every position_interval seconds; admission
+        itself wakes the waiter immediately. Raises AdmissionRejected if the
+        request waited longer than the controller's queue timeout.
+        """
+        deadline = time.monotonic() + self.controller.queue_timeout
+        last_position = None
+        while not self.admitted:
+            position = self.position()
+            if position != last_position:
+                last_position = position
+                yield position
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                ADMISSION_REQUESTS.labels("queue_timeout").inc()
+                self.controller.timed_out += 1
+                raise AdmissionRejected("queue_timeout", "Server is busy, please try again shortly")
+            try:
+                # shield: the timeout must not cancel the slot hand-off itself
+                async with asyncio.timeout(min(self.controller.position_interval, remaining)):
+                    await asyncio.shield(self.future)
+            except TimeoutError:
+                pass
+
+    def release(self):
+        """Give the slot back, or leave the queue if it was never granted"""
+        if not self.released:
+            self.released = True
+            self.controller._release(self)
+
+    def __del__(self):
+        # Safety net for responses whose body generator never ran its finally
+        self.release()
+
+
+class AdmissionController:
+    """Admission control in front of LLM generation for /chat.
+
+    At most max_active generations run at once. Further requests wait in a
+    FIFO queue of at most max_queue entries and are told their position;
+    beyond that they are rejected immediately so overload turns into fast
+    429s instead of ever-growing latency for everyone. Each user also has
+    a token bucket of user_rate requests per second with user_burst burst.
+    """
+
+    def __init__(self, max_active=None, max_queue=None, queue_timeout=None,
+                 user_rate_per_minute=None, user_burst=None, enabled=None):
+        self.enabled = enabled if enabled is not None else (
+            os.getenv("ADMISSION_ENABLED", "true").lower() == "true"
+        )
+        self.max_active = max_active or int(os.getenv("ADMISSION_MAX_ACTIVE", "128"))
+        self.max_queue = max_queue if max_queue is not None else int(os.getenv("ADMISSION_MAX_QUEUE", "64"))
+        self.queue_timeout = queue_timeout or float(os.getenv("ADMISSION_QUEUE_TIMEOUT", "30"))
+        self.position_interval = float(os.getenv("ADMISSION_POSITION_INTERVAL", "1"))
+        rate_per_minute = user_rate_per_minute or float(os.getenv("CHAT_RATE_PER_MINUTE", "20"))
+        self.user_rate = rate_per_minute / 60
+        self.user_burst = user_burst or int(os.getenv("CHAT_RATE_BURST", "5"))
+        # Idle buckets refill completely within burst / rate seconds, then can go
+        self._buckets = LRUTTLCache(
+            max_entries=int(os.getenv("CHAT_RATE_MAX_USERS", "100000")),
+            ttl_seconds=self.user_burst / self.user_rate
+        )
+        self.active = 0
+        self._queue = deque()
+        self._sequence = 0
+        self._served = 0
+        self.admitted = 0
+        self.queued = 0
+        self.rejected_queue_full = 0
+        self.rejected_rate_limit = 0
+        self.timed_out = 0
+
+    def check_rate(self, user_id):
+        """Charge one request to user_id's token bucket or raise AdmissionRejected"""
+        if not self.enabled:
+            return
+        bucket = self._buckets.get(user_id)
+        if bucket is None:
+            bucket = TokenBucket(self.user_rate, self.user_burst)
+            self._buckets.set(user_id, bucket)
+        wait = bucket.take()
+        if wait:
+            self.rejected_rate_limit += 1
+            ADMISSION_REQUESTS.labels("rejected_rate_limit").inc()
+            raise AdmissionRejected(
+                "rate_limited", "Too many chat requests, please slow down", retry_after=math.ceil(wait)
+            )
+
+    def enter(self):
+        """Take a generation slot now, join the wait queue, or raise AdmissionRejected"""
+        if not self.enabled:
+            return Ticket(self, 0)
+        if self.active < self.max_active and not self._queue:
+            self.active += 1
+            self.admitted += 1
+            ADMISSION_REQUESTS.labels("admitted").inc()
+            return Ticket(self, 0)
+        if len(self._queue) >= self.max_queue:
+            self.rejected_queue_full += 1
+            ADMISSION_REQUESTS.labels("rejected_queue_full").inc()
+            raise AdmissionRejected("queue_full", "Server is busy, please try again shortly")
+        # Queued tickets are numbered so a position is a subtraction, not a scan
+        self._sequence += 1
+        ticket = Ticket(self, self._sequence, asyncio.get_running_loop().create_future())
+        self._queue.append(ticket)
+        self.queued += 1
+        ADMISSION_REQUESTS.labels("queued").inc()
+        return ticket
+
+    def _position(self, ticket):
+        return max(1, ticket.sequence - self._served)
+
+    def _release(self, ticket):
+        if not self.enabled:
+            return
+        if not ticket.admitted:
+            # Left the queue before getting a slot (timeout or client went away)
+            ticket.future.cancel()
+            self._queue.remove(ticket)
+            return
+        # Hand the slot straight to the next waiter
+        if self._queue:
+            waiter = self._queue.popleft()
+            self._served = waiter.sequence
+            waiter.future.set_result(True)
+            self.admitted += 1
+            ADMISSION_REQUESTS.labels("admitted").inc()
+            return
+        self.active -= 1
+
+    def stats(self):
+        return {
+            "enabled": self.enabled,
+            "max_active": self.max_active,
+            "max_queue": self.max_queue,
+            "active": self.active,
+            "queue_length": len(self._queue),
+            "admitted": self.admitted,
+            "queued": self.queued,
+            "rejected_queue_full": self.rejected_queue_full,
+            "rejected_rate_limit": self.rejected_rate_limit,
+            "queue_timeouts": self.timed_out,
+        }
@@ -0,0 +1,497 @@
+import asyncio
+from pymongo import AsyncMongoClient, ReturnDocument, WriteConcern
+from datetime import datetime
+from bson import ObjectId
+import os
+import time
+from dotenv import load_dotenv
+from pymongo.errors import DuplicateKeyError
+from mongo_database import (
+    CLEARED_COUNTER,
+    EXPORT_SORT,
+    MESSAGE_INDEXES,
+    NEWEST_FIRST,
+    MongoDatabaseBase,
+    build_message_document,
+    build_history_page,
+    count_filter,
+    count_increments,
+    decode_cursor,
+    deletion_started,
+    export_batch_size,
+    failure,
+    history_projection,
+    history_version,
+    history_query,
+    login_success,
+    message_key,
+    new_counter_document,
+    new_user_document,
+    only_duplicate_key_errors,
+    profile_update,
+    public_user,
+    seed_counter,
+    seeded_count,
+    serialize_message,
+    signup_failure,
+    visible_filter,
+    WRITE_BEHIND_RETRIES,
+)
+from write_behind import QueueFullError
+from password_hasher import HasherBusyError
+from deletion_jobs import (
+    BATCH_SORT,
+    CLAIM_SORT,
+    CLEAR_HISTORY,
+    DELETE_ACCOUNT,
+    DELETED_MESSAGES,
+    DELETION_BATCH_SECONDS,
+    JOBS_INDEX,
+    batch_filter,
+    claim_filter,
+    cutoff_key,
+    failed_update,
+    finished_update,
+    lease_update,
+    plan_deletion,
+    progress_update,
+    released_update,
+    serialize_job,
+    tombstone_update,
+    utc_now,
+)
+
+load_dotenv()
+
+class AsyncMongoDatabase(MongoDatabaseBase):
+    """Async counterpart of MongoDatabase.
+
+    Exposes the same methods as MongoDatabase, but every method is a coroutine
+    backed by pymongo's AsyncMongoClient, so no request holds a worker thread
+    while waiting on the database. CPU-bound bcrypt work runs on the shared
+    PasswordHasher process pool. Queries, documents and results come from
+    the helpers in mongo_database, so only the I/O lives here. Messages are
+    stored one document per message, without the archive.
+    """
+
+    def __init__(self, hasher=None):
+        super().__init__(hasher)
+        self._flush_wakeup = asyncio.Event()
+        self._deleter_wakeup = asyncio.Event()
+        self._stopping = asyncio.Event()
+
+    async def connect(self):
+        """Establish the MongoDB connection (indexes are created by ensure_indexes).
+
+        Returns True on success, False on failure; safe to call again after
+        a failure.
+        """
+        import certifi
+
+        mongo_uri = os.getenv("MONGO_URI", "mongodb://localhost:27017/")
+        try:
+            # Force TLS and provide CA bundle from certifi for reliable SSL handshake
+            self.client = AsyncMongoClient(mongo_uri, tls=True, tlsCAFile=certifi.where(), serverSelectionTimeoutMS=5000)
+            # Fails within serverSelectionTimeoutMS if the server is unreachable
+            await self.client.admin.command("ping")
+            self._bind_collections(self.client['heritage_chatbot'])
+            self._connected = True
+            self._start_flusher()
+            self._start_deleter()
+            print("✓ MongoDB (async) connected successfully")
+            return True
+        except Exception as e:
+            print(f"✗ MongoDB (async) connection failed: {e}")
+            if self.client is not None:
+                await self.client.close()
+            self.client = None
+            self._reset_collections()
+            return False
+
+    async def ensure_indexes(self):
+        """Create the indexes once per process, after connect() succeeded"""
+        if self.indexes_ready:
+            return
+        self._ensure_connected()
+        await self.users.create_index("email", unique=True)
+        for index in MESSAGE_INDEXES:
+            await self.messages.create_index(index)
+        await self.deletion_jobs.create_index(JOBS_INDEX)
+        await self.deletion_jobs.create_index("user_id")
+        self.indexes_ready = True
+        print("✓ MongoDB (async) indexes ready")
+
+    async def close(self):
+        """Flush queued messages and close the underlying client"""
+        self._stopping.set()
+        self._deleter_wakeup.set()
+        if self._deleter is not None:
+            await self._deleter
+            self._deleter = None
+        if self.write_buffer is not None:
+            self.write_buffer.close()
+            self._flush_wakeup.set()
+            if self._flusher is not None:
+                await self._flusher
+                self._flusher = None
+        if self.client is not None:
+            await self.client.close()
+
+    # ==================== WRITE-BEHIND ====================
+
+    def _start_flusher(self):
+        if self.write_buffer is None or self._flusher is not None:
+            return
+        self._flusher = asyncio.get_running_loop().create_task(self._flush_loop())
+
+    async def _flush_loop(self):
+        """Write batches until the buffer is closed and drained"""
+        buffer = self.write_buffer
+        while True:
+            batch = buffer.take_batch()
+            if batch:
+                await self._write_batch(batch)
+                continue
+            if buffer.closed and not len(buffer):
+                return
+            self._flush_wakeup.clear()
+            try:
+                await asyncio.wait_for(self._flush_wakeup.wait(), timeout=buffer.next_flush_in() or 0.001)
+            except asyncio.TimeoutError:
+                pass
+
+    async def _write_batch(self, batch):
+        for attempt in range(WRITE_BEHIND_RETRIES):
+            try:
+                await self.messages.insert_many(batch, ordered=False)
+                break
+            except Exception as e:
+                # Documents from an earlier partial attempt come back as duplicates
+                if only_duplicate_key_errors(e):
+                    break
+                print(f"Error flushing {len(batch)} messages (attempt {attempt + 1}): {e}")
+                await asyncio.sleep(0.1 * 2 ** attempt)
+        else:
+            self.write_buffer.mark_failed(batch)
+            return
+        # Bump counters before the batch leaves the pending view so counts never dip
+        await self._increment_counters(batch)
+        discarded = self.write_buffer.mark_flushed(batch)
+        if discarded:
+            # History was cleared while this batch was in flight
+            await self.messages.delete_many({"_id": {"$in": discarded}})
+            await self._increment_counters(
+                [doc for doc in batch if doc["_id"] in set(discarded)], sign=-1
+            )
+
+    async def _increment_counters(self, docs, sign=1):
+        operations = count_increments(docs, sign)
+        if operations:
+            try:
+                await self.message_counters.bulk_write(operations, ordered=False)
+            except Exception as e:
+                print(f"Error updating message counters: {e}")
+
+    # ==================== BACKGROUND DELETION ====================
+
+    def _start_deleter(self):
+        if self._deleter is not None:
+            return
+        self._deleter = asyncio.get_running_loop().create_task(self._deletion_loop())
+
+    async def _deletion_loop(self):
+        """Run claimable deletion jobs one at a time until close()"""
+        config = self.deletion_config
+        while not self._stopping.is_set():
+            self._deleter_wakeup.clear()
+            try:
+                now = utc_now()
+                job = await self.deletion_jobs.find_one_and_update(
+                    claim_filter(now), lease_update(config, now),
+                    sort=CLAIM_SORT, return_document=ReturnDocument.AFTER
+                )
+            except Exception as e:
+                print(f"Error claiming deletion job: {e}")
+                job = None
+            if job is None:
+                try:
+                    await asyncio.wait_for(self._deleter_wakeup.wait(), timeout=config.poll_seconds)
+                except asyncio.TimeoutError:
+                    pass
+                continue
+            try:
+                await self._run_deletion_job(job)
+            except Exception as e:
+                print(f"Deletion job {job['_id']} failed: {e}")
+                try:
+                    await self.deletion_jobs.update_one({"_id": job["_id"]}, failed_update(config, job, e))
+                except Exception as update_error:
+                    print(f"Error recording deletion job failure: {update_error}")
+
+    async def _run_deletion_job(self, job):
+        """Delete the job's messages in bounded batches (see MongoDatabase)"""
+        config = self.deletion_config
+        messages = self.messages.with_options(write_concern=WriteConcern(w="majority"))
+        query = batch_filter(job)
+        while not self._stopping.is_set():
+            started = time.perf_counter()
+            cursor = self.messages.find(query, {"_id": 1}).sort(BATCH_SORT).limit(config.batch_size)
+            ids = [doc["_id"] async for doc in cursor]
+            if not ids:
+                break
+            deleted = (await messages.delete_many({"_id": {"$in": ids}})).deleted_count
+            DELETION_BATCH_SECONDS.observe(time.perf_counter() - started)
+            DELETED_MESSAGES.labels(job["kind"]).inc(deleted)
+            await self.deletion_jobs.update_one({"_id": job["_id"]}, progress_update(config, deleted))
+            try:
+                await asyncio.wait_for(self._stopping.wait(), timeout=config.pause_seconds)
+            except asyncio.TimeoutError:
+                pass
+        if self._stopping.is_set():
+            # Shutting down: hand the job back so the next worker resumes it
+            await self.deletion_jobs.update_one({"_id": job["_id"]}, released_update())
+            return
+        await self.deletion_jobs.update_one({"_id": job["_id"]}, finished_update())
+        # Keep the tombstone if a newer job for this user replaced it
+        await self.history_tombstones.delete_one({"_id": job["user_id"], "job_id": job["_id"]})
+
+    async def _newest_message_key(self, user_id):
+        """(timestamp, _id) of the user's newest stored message, or None"""
+        return message_key(await self.messages.find_one({"user_id": user_id}, {"timestamp": 1}, sort=NEWEST_FIRST))
+
+    async def _start_deletion(self, user_id, kind):
+        """Tombstone the user's current messages and queue a job to delete them"""
+        total = seeded_count(await self.message_counters.find_one({"_id": user_id}))
+        job = plan_deletion(user_id, kind, total, await self._newest_message_key(user_id))
+        await self.deletion_jobs.insert_one(job)
+        if job["status"] == "done":
+            return job
+        if job["cutoff"] is not None:
+            await self.history_tombstones.update_one({"_id": user_id}, tombstone_update(job), upsert=True)
+        self._deleter_wakeup.set()
+        return job
+
+    async def _hidden_before(self, user_id):
+        """Tombstone (timestamp, _id) key for the user's messages, or None"""
+        return cutoff_key(await self.history_tombstones.find_one({"_id": user_id}, {"cutoff": 1, "cutoff_id": 1}))
+
+    async def get_deletion_job(self, user_id, job_id):
+        """Progress of one of the user's deletion jobs, or None"""
+        self._ensure_connected()
+        job = await self.deletion_jobs.find_one({"_id": job_id, "user_id": user_id})
+        return serialize_job(job) if job is not None else None
+
+    async def _enqueue_message(self, doc):
+        """Queue a document, waiting on the flusher while the queue is full"""
+        buffer = self.write_buffer
+        deadline = time.monotonic() + buffer.put_timeout
+        while not buffer.try_offer(doc):
+            self._flush_wakeup.set()
+            if time.monotonic() >= deadline:
+                buffer.record_drop()
+                raise QueueFullError("Message write queue is full")
+            await asyncio.sleep(0.01)
+        if len(buffer) >= buffer.batch_size:
+            self._flush_wakeup.set()
+
+    # ==================== USER AUTHENTICATION ====================
+
+    async def create_user(self, email, password, name):
+        """Create a new user account"""
+        self._ensure_connected()
+        try:
+            # Hash password on the bcrypt process pool
+            hashed_password = await self.hasher.hash_async(password)
+
+            result = await self.users.insert_one(new_user_document(email, hashed_password, name))
+            await self.message_counters.insert_one(new_counter_document(str(result.inserted_id)))
+            return {
+                "success": True,
+                "user_id": str(result.inserted_id),
+                "message": "User created successfully"
+            }
+        except HasherBusyError:
+            raise
+        except Exception as e:
+            return signup_failure(e)
+
+    async def login_user(self, email, password):
+        """Authenticate user login"""
+        self._ensure_connected()
+        try:
+            user = await self.users.find_one({"email": email.lower()})
+
+            if not user:
+                return failure("Invalid email or password")
+
+            # Verify password on the bcrypt process pool
+            if await self.hasher.verify_async(password, user['password']):
+                update = {"last_login": datetime.utcnow()}
+                if self.hasher.needs_rehash(user['password']):
+                    # Stored cost differs from the calibrated one: upgrade transparently
+                    try:
+                        update["password"] = await self.hasher.hash_async(password)
+                        self.hasher.rehashed += 1
+                    except HasherBusyError:
+                        pass  # Try again on a later login
+
+                # Update last login
+                await self.users.update_one(
+                    {"_id": user['_id']},
+                    {"$set": update}
+                )
+
+                return login_success(user)
+            else:
+                return failure("Invalid email or password")
+        except HasherBusyError:
+            raise
+        except Exception as e:
+            return failure(e)
+
+    async def get_user_by_id(self, user_id):
+        """Get user information by ID"""
+        self._ensure_connected()
+        try:
+            user = await self.users.find_one({"_id": ObjectId(user_id)})
+            return public_user(user) if user else None
+        except:
+            return None
+
+    # ==================== CHAT MESSAGES ====================
+
+    async def save_message(self, user_id, message_type, content, latitude=None, longitude=None, district=None):
+        """Save a chat message"""
+        self._ensure_connected()
+        try:
+            message_data = build_message_document(
+                user_id, message_type, content, latitude, longitude, district
+            )
+
+            if self.write_buffer is not None:
+                # Queue for the background flusher
+                message_data["_id"] = ObjectId()
+                await self._enqueue_message(message_data)
+                return str(message_data["_id"])
+
+            result = await self.messages.insert_one(message_data)
+            await self._increment_counters([message_data])
+            return str(result.inserted_id)
+        except QueueFullError as e:
+            print(f"Dropped message for {user_id}: {e}")
+            return None
+        except Exception as e:
+            print(f"Error saving message: {e}")
+            return None
+
+    async def get_chat_history_page(self, user_id, limit=100, before=None, after=None, fields=None):
+        """Get one keyset page of a user's chat history (see MongoDatabase)"""
+        self._ensure_connected()
+        before = decode_cursor(before) if before else None
+        after = decode_cursor(after) if after else None
+        try:
+            query, sort = history_query(user_id, before, after, await self._hidden_before(user_id))
+            cursor = self.messages.find(query, history_projection(fields)).sort(sort).limit(limit + 1)
+            docs = [doc async for doc in cursor]
+            # Read-your-writes: include messages still waiting in the queue
+            return build_history_page(docs, limit, before, after, self._pending(user_id), fields)
+        except Exception as e:
+            print(f"Error retrieving chat history: {e}")
+            return build_history_page([], limit)
+
+    async def get_chat_history(self, user_id, limit=100):
+        """Get the most recent chat messages for a user, oldest first"""
+        page = await self.get_chat_history_page(user_id, limit)
+        return page["messages"]
+
+    async def iter_chat_history(self, user_id, fields=None, batch_size=None):
+        """Return an async iterator over every message of a user, oldest first
+        (see MongoDatabase; checks and the tombstone lookup run before it)"""
+        self._ensure_connected()
+        pending = self._pending(user_id)
+        query = visible_filter(user_id, await self._hidden_before(user_id))
+        cursor = self.messages.find(query, history_projection(fields)).sort(
+            EXPORT_SORT
+        ).batch_size(batch_size or export_batch_size())
+        return self._export_messages(cursor, pending, fields)
+
+    @staticmethod
+    async def _export_messages(cursor, pending, fields):
+        """Async export_messages over a cursor"""
+        unflushed = {doc["_id"] for doc in pending}
+        try:
+            async for doc in cursor:
+                unflushed.discard(doc["_id"])
+                yield serialize_message(doc, fields)
+        finally:
+            await cursor.close()
+        for doc in pending:
+            if doc["_id"] in unflushed:
+                yield serialize_message(doc, fields)
+
+    async def clear_chat_history(self, user_id):
+        """Clear all chat history for a user (deleted by a background job)"""
+        self._ensure_connected()
+        try:
+            if self.write_buffer is not None:
+                self.write_buffer.discard_user(user_id)
+            job = await self._start_deletion(user_id, CLEAR_HISTORY)
+            await self.message_counters.update_one({"_id": user_id}, CLEARED_COUNTER, upsert=True)
+            return deletion_started(job)
+        except Exception as e:
+            return failure(e)
+
+    async def get_history_version(self, user_id):
+        """Current history version token (see mongo_database.history_version)"""
+        self._ensure_connected()
+        counter = await self.message_counters.find_one({"_id": user_id}, {"version": 1})
+        return history_version(counter, self._pending(user_id))
+
+    async def get_message_count(self, user_id):
+        """Get total message count for a user from the per-user counter"""
+        self._ensure_connected()
+        pending = self._pending(user_id)
+        count = seeded_count(await self.message_counters.find_one({"_id": user_id}))
+        if count is not None:
+            return count + len(pending)
+        query = count_filter(user_id, await self._hidden_before(user_id), [doc["_id"] for doc in pending])
+        stored = await self.messages.count_documents(query)
+        try:
+            await self.message_counters.update_one(*seed_counter(user_id, stored), upsert=True)
+        except DuplicateKeyError:
+            pass  # Seeded concurrently
+        return stored + len(pending)
+
+    # ==================== USER MANAGEMENT ====================
+
+    async def update_user_profile(self, user_id, name=None):
+        """Update user profile"""
+        self._ensure_connected()
+        try:
+            update_data = profile_update(name)
+            if update_data:
+                await self.users.update_one(
+                    {"_id": ObjectId(user_id)},
+                    {"$set": update_data}
+                )
+                return {"success": True, "message": "Profile updated"}
+            return failure("No data to update")
+        except Exception as e:
+            return failure(e)
+
+    async def delete_user_account(self, user_id):
+        """Delete user account and all their data (messages via a background job)"""
+        self._ensure_connected()
+        try:
+            # Delete all messages
+            if self.write_buffer is not None:
+                self.write_buffer.discard_user(user_id)
+            job = await self._start_deletion(user_id, DELETE_ACCOUNT)
+            await self.message_counters.delete_one({"_id": user_id})
+
+            # Delete user
+            await self.users.delete_one({"_id": ObjectId(user_id)})
+
+            return {"success": True, "message": "Account deleted", "job_id": job["_id"]}
+        except Exception as e:
+            return failure(e)
@@ -0,0 +1,96 @@
+"""
+/chat latency under overload, with and without admission control.
+
+Open-loop load: requests arrive at a fixed rate regardless of how fast the
+server answers, at several multiples of generation capacity
+(max_active / stream duration). Every request uses its own user and prompt
+so neither the response cache nor coalescing helps. Without admission
+control everything queues behind the LLM gateway and latency grows with
+the backlog; with it, excess requests get a fast 429 and the p99 of the
+accepted ones stays bounded by the wait queue.
+
+Usage:
+    python bench_admission.py --capacity 50 --loads 0.5,1,2,4 --duration 5
+"""
+import argparse
+import asyncio
+import os
+import time
+
+os.environ.setdefault("LLM_PROVIDER", "fake")
+# Synthetic users authenticate with the raw user-id header
+os.environ.setdefault("ALLOW_USER_ID_HEADER", "true")
+
+import main
+from admission import AdmissionController
+from bench_client import asgi_request, percentile
+from llm_provider import FakeProvider, LLMGateway
+from memory_database import InMemoryDatabase
+
+
+async def open_loop(args, rate, label):
+    results = []
+
+    async def one(i):
+        results.append(await asgi_request(main.app, "POST", "/chat", headers={"user-id": f"{label}-{i}"}, body={
+            "message": f"Heritage route request {label} {i}", "language": "en",
+        }))
+
+    tasks = []
+    interval = 1 / rate
+    started = time.perf_counter()
+    for i in range(int(rate * args.duration)):
+        delay = started + i * interval - time.perf_counter()
+        if delay > 0:
+            await asyncio.sleep(delay)
+        tasks.append(asyncio.create_task(one(i)))
+    await asyncio.gather(*tasks)
+
+    accepted = [r["latency"] for r in results if r["status"] == 200 and b'"error"' not in r["body"]]
+    rejected = [r["latency"] for r in results if r["status"] == 429]
+    return {
+        "sent": len(results),
+        "accepted": len(accepted),
+        # 429s plus any request that timed out in the wait queue
+        "rejected": len(results) - len(accepted),
+        "p50": percentile(accepted, 50),
+        "p99": percentile(accepted, 99),
+        "reject_p99": percentile(rejected, 99),
+    }
+
+
+async def run(args):
+    stream_seconds = args.ttft_ms / 1000 + (args.tokens - 1) / args.tokens_per_sec
+    capacity = args.capacity / stream_seconds
+    main.db = InMemoryDatabase(hasher=main.password_hasher)
+    print(f"capacity: {args.capacity} concurrent x {stream_seconds:.2f}s streams = {capacity:.1f} req/s, "
+          f"wait queue {args.max_queue}")
+    print(f"{'mode':<10}{'load':>6}{'req/s':>8}{'sent':>7}{'ok':>7}{'429':>7}"
+          f"{'p50 s':>9}{'p99 s':>9}{'429 p99 ms':>12}")
+    for enabled in (False, True):
+        for load in [float(value) for value in args.loads.split(",")]:
+            # Fresh gateway and controller per run so no backlog carries over
+            main.llm = LLMGateway(
+                FakeProvider(tokens_per_sec=args.tokens_per_sec, ttft_ms=args.ttft_ms, tokens=args.tokens),
+                max_concurrency=args.capacity
+            )
+            main.admission = AdmissionController(
+                max_active=args.capacity, max_queue=args.max_queue, queue_timeout=60, enabled=enabled
+            )
+            label = f"{'on' if enabled else 'off'}-{load}"
+            stats = await open_loop(args, capacity * load, label)
+            print(f"{'admission' if enabled else 'no limit':<10}{load:>5.1f}x{capacity * load:>8.1f}"
+                  f"{stats['sent']:>7}{stats['accepted']:>7}{stats['rejected']:>7}"
+                  f"{stats['p50']:>9.2f}{stats['p99']:>9.2f}{stats['reject_p99'] * 1000:>12.1f}")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--capacity", type=int, default=50, help="concurrent generations")
+    parser.add_argument("--max-queue", type=int, default=25)
+    parser.add_argument("--loads", default="0.5,1,2,4", help="offered load as multiples of capacity")
+    parser.add_argument("--duration", type=float, default=5, help="seconds of arrivals per load level")
+    parser.add_argument("--tokens", type=int, default=50)
+    parser.add_argument("--tokens-per-sec", type=float, default=50)
+    parser.add_argument("--ttft-ms", type=float, default=100)
+    asyncio.run(run(parser.parse_args()))
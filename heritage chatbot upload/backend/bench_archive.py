@@ -0,0 +1,152 @@
+"""
+Working set, index size and history read latency before and after
+archiving old messages to compressed segment files.
+
+Needs a MongoDB server. Seeds synthetic chat histories (one document per
+message) into a scratch database, times history pages that reach back
+into old messages, then archives everything older than --keep-days
+before each user's newest message and times the same pages again, now
+served from the archive. $collStats before and after show what left the
+messages collection and its indexes; the archive's files are measured on
+disk. The scratch database and archive directory are removed afterwards
+unless --keep is given.
+
+Usage:
+    python bench_archive.py --mongo-uri mongodb://localhost:27017 --users 200 --messages 2000 --keep-days 14
+"""
+import argparse
+import os
+import random
+import shutil
+import tempfile
+import time
+from datetime import timedelta
+
+from pymongo import MongoClient
+
+from bench_client import summarize_ms
+from bench_message_storage import collection_stats, synthetic_history
+from message_archive import MessageArchive
+from mongo_database import MongoDatabase, encode_cursor
+
+
+def seed(database, args):
+    """Returns the user ids and, per user, cursors into the part that will be archived"""
+    rng = random.Random(args.seed)
+    user_ids = [f"user-{i}" for i in range(args.users)]
+    cursors = {}
+    for user_id in user_ids:
+        history = list(synthetic_history(user_id, args.messages, rng))
+        cutoff = history[-1]["timestamp"] - timedelta(days=args.keep_days)
+        old = [doc for doc in history if doc["timestamp"] < cutoff]
+        # Just inside the archive, and halfway through it
+        cursors[user_id] = [encode_cursor(old[-1]), encode_cursor(old[len(old) // 2])] if old else []
+        for start in range(0, len(history), 1000):
+            database.messages.insert_many(history[start:start + 1000], ordered=False)
+    return user_ids, cursors
+
+
+def time_reads(database, user_ids, cursors, args):
+    rng = random.Random(args.seed)
+    newest, archived = [], []
+    for _ in range(args.reads):
+        user_id = rng.choice(user_ids)
+        started = time.perf_counter()
+        database.get_chat_history_page(user_id, limit=args.page_size)
+        newest.append(time.perf_counter() - started)
+        for cursor in cursors[user_id]:
+            started = time.perf_counter()
+            database.get_chat_history_page(user_id, limit=args.page_size, before=cursor)
+            archived.append(time.perf_counter() - started)
+    return summarize_ms(newest), summarize_ms(archived)
+
+
+def time_exports(database, user_ids, args):
+    durations = []
+    for user_id in user_ids[:args.exports]:
+        started = time.perf_counter()
+        for _ in database.iter_chat_history(user_id):
+            pass
+        durations.append(time.perf_counter() - started)
+    return summarize_ms(durations)
+
+
+def directory_bytes(path):
+    segments = index = 0
+    for root, _, files in os.walk(path):
+        for name in files:
+            size = os.path.getsize(os.path.join(root, name))
+            if name.endswith(".seg"):
+                segments += size
+            else:
+                index += size
+    return segments, index
+
+
+def archive_all(database, user_ids, args):
+    """Archive each user's messages older than keep_days before their newest one"""
+    moved = 0
+    for user_id in user_ids:
+        newest = database.messages.find_one({"user_id": user_id}, {"timestamp": 1}, sort=[("timestamp", -1)])
+        moved += database.archive_user(user_id, newest["timestamp"] - timedelta(days=args.keep_days))
+    return moved
+
+
+def main(args):
+    client = MongoClient(args.mongo_uri)
+    storage = client[args.database]
+    directory = args.archive_dir or tempfile.mkdtemp(prefix="heritage-archive-")
+    archive = MessageArchive(directory=directory, pause_ms=0)
+    try:
+        database = MongoDatabase().attach(storage, "archive_bench")
+        database.archive = archive
+        started = time.perf_counter()
+        user_ids, cursors = seed(database, args)
+        print(f"seeded {args.users} users x {args.messages} messages in {time.perf_counter() - started:.1f}s")
+
+        time_reads(database, user_ids, cursors, args)  # warm the cache
+        rows = [("mongodb", collection_stats(database.messages), *time_reads(database, user_ids, cursors, args),
+                 time_exports(database, user_ids, args))]
+
+        started = time.perf_counter()
+        moved = archive_all(database, user_ids, args)
+        elapsed = time.perf_counter() - started
+        segments, index = directory_bytes(directory)
+        print(f"archived {moved} messages in {elapsed:.1f}s ({moved / elapsed:.0f}/s): "
+              f"{segments / 1e6:.1f} MB of segments, {index / 1e3:.1f} KB of index")
+
+        time_reads(database, user_ids, cursors, args)
+        rows.append(("archived", collection_stats(database.messages), *time_reads(database, user_ids, cursors, args),
+                     time_exports(database, user_ids, args)))
+
+        print(f"{'layout':<10}{'docs':>10}{'data MB':>10}{'disk MB':>10}{'index MB':>10}"
+              f"{'newest p50':>12}{'p99':>8}{'old p50':>9}{'p99':>8}{'export p50':>12}")
+        for label, stats, newest, old, export in rows:
+            print(f"{label:<10}{stats['documents']:>10}{stats['data_mb']:>10.1f}{stats['storage_mb']:>10.1f}"
+                  f"{stats['index_mb']:>10.1f}{newest['p50_ms']:>12.2f}{newest['p99_ms']:>8.2f}"
+                  f"{old['p50_ms']:>9.2f}{old['p99_ms']:>8.2f}{export['p50_ms']:>12.1f}")
+        before, after = rows[0][1], rows[1][1]
+        print(f"messages collection: {1 - after['data_mb'] / before['data_mb']:.0%} less data, "
+              f"{1 - after['index_mb'] / before['index_mb']:.0%} smaller indexes")
+    finally:
+        if not args.keep:
+            client.drop_database(args.database)
+            if not args.archive_dir:
+                shutil.rmtree(directory, ignore_errors=True)
+        client.close()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--mongo-uri", default=os.getenv("BENCH_MONGO_URI", "mongodb://localhost:27017"))
+    parser.add_argument("--database", default="heritage_archive_bench")
+    parser.add_argument("--archive-dir", help="archive directory (default: a temporary one)")
+    parser.add_argument("--users", type=int, default=200)
+    parser.add_argument("--messages", type=int, default=2000, help="messages per user, about 40 a day")
+    parser.add_argument("--keep-days", type=float, default=14, help="days of messages left in MongoDB")
+    parser.add_argument("--reads", type=int, default=500)
+    parser.add_argument("--exports", type=int, default=20, help="users whose whole history is exported")
+    parser.add_argument("--page-size", type=int, default=50)
+    parser.add_argument("--seed", type=int, default=7)
+    parser.add_argument("--keep", action="store_true", help="keep the scratch database and archive")
+    main(parser.parse_args())
@@ -0,0 +1,95 @@
+"""
+Concurrency benchmark for the /chat SSE pipeline.
+
+Runs the FastAPI app in-process against the fake LLM provider and an
+in-memory database, opens N concurrent /chat streams on a single event loop
+and reports how many streams were open at once, time to first token and the
+number of threads the process needed. Every stream asks a distinct question
+so none of them are coalesced or served from the response cache.
+
+Usage:
+    python bench_async_streams.py --streams 2000 --tokens 50 --tokens-per-sec 50
+"""
+import argparse
+import asyncio
+import os
+import statistics
+import threading
+import time
+
+os.environ.setdefault("LLM_PROVIDER", "fake")
+# Synthetic users authenticate with the raw user-id header
+os.environ.setdefault("ALLOW_USER_ID_HEADER", "true")
+
+import main
+from admission import AdmissionController
+from bench_client import asgi_request, percentile
+from llm_provider import FakeProvider, LLMGateway
+from memory_database import InMemoryDatabase
+
+
+async def open_chat_stream(app, user_id, stats):
+    """Drive one POST /chat through the ASGI app and record timings"""
+    def opened():
+        stats["open"] += 1
+        stats["peak_open"] = max(stats["peak_open"], stats["open"])
+
+    result = await asgi_request(
+        app, "POST", "/chat",
+        body={"message": f"3 day Thanjavur temple trip for {user_id}", "language": "en"},
+        headers={"user-id": user_id},
+        on_first_chunk=opened,
+    )
+    if result["ttft"] is not None:
+        stats["open"] -= 1
+        stats["ttft"].append(result["ttft"])
+    stats["total"].append(result["latency"])
+
+
+async def run(args):
+    main.llm = LLMGateway(
+        FakeProvider(tokens_per_sec=args.tokens_per_sec, ttft_ms=args.ttft_ms, tokens=args.tokens),
+        max_concurrency=args.streams
+    )
+    main.db = InMemoryDatabase(hasher=main.password_hasher)
+    # Measure raw stream capacity, not admission control
+    main.admission = AdmissionController(enabled=False)
+
+    stats = {"open": 0, "peak_open": 0, "ttft": [], "total": []}
+    peak_threads = threading.active_count()
+    done = asyncio.Event()
+
+    async def watch_threads():
+        nonlocal peak_threads
+        while not done.is_set():
+            peak_threads = max(peak_threads, threading.active_count())
+            await asyncio.sleep(0.05)
+
+    watcher = asyncio.create_task(watch_threads())
+    started = time.perf_counter()
+    await asyncio.gather(*(
+        open_chat_stream(main.app, f"user-{i}", stats) for i in range(args.streams)
+    ))
+    elapsed = time.perf_counter() - started
+    done.set()
+    await watcher
+
+    ideal = args.ttft_ms / 1000 + (args.tokens - 1) / args.tokens_per_sec
+    print(f"streams:            {args.streams} x {args.tokens} tokens ({ideal:.2f}s ideal each)")
+    print(f"wall time:          {elapsed:.2f}s")
+    print(f"peak open streams:  {stats['peak_open']}")
+    print(f"peak threads:       {peak_threads}")
+    print(f"ttft p50/p99:       {statistics.median(stats['ttft']) * 1000:.1f} / "
+          f"{percentile(stats['ttft'], 99) * 1000:.1f} ms")
+    print(f"stream p50/p99:     {statistics.median(stats['total']):.2f} / "
+          f"{percentile(stats['total'], 99):.2f} s")
+    print(f"messages saved:     {sum(len(messages) for messages in main.db.messages.values())}")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--streams", type=int, default=2000)
+    parser.add_argument("--tokens", type=int, default=50)
+    parser.add_argument("--tokens-per-sec", type=float, default=50)
+    parser.add_argument("--ttft-ms", type=float, default=20)
+    asyncio.run(run(parser.parse_args()))
@@ -0,0 +1,64 @@
+"""
+Per-request authentication cost: database lookup vs signed session token.
+
+"before" resolves the user the way /auth/me used to, with a users.find_one
+per request; the lookup is simulated with a configurable round-trip time
+since no MongoDB is needed for the comparison. "after" verifies an HMAC
+session token in-process, and the profile cache path serves /auth/me
+without touching the database.
+
+Usage:
+    python bench_auth.py --iterations 100000 --db-rtt-ms 1.0
+"""
+import argparse
+import time
+
+from bson import ObjectId
+
+from cache import LRUTTLCache
+from session_tokens import SessionTokenSigner
+
+
+def per_call_us(fn, iterations):
+    started = time.perf_counter()
+    for _ in range(iterations):
+        fn()
+    return (time.perf_counter() - started) / iterations * 1e6
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--iterations", type=int, default=100000)
+    parser.add_argument("--db-rtt-ms", type=float, default=1.0,
+                        help="simulated users.find_one round trip")
+    parser.add_argument("--db-iterations", type=int, default=500)
+    args = parser.parse_args()
+
+    user_id = str(ObjectId())
+    users = {ObjectId(user_id): {"_id": ObjectId(user_id), "name": "Bench", "email": "bench@example.com"}}
+
+    def find_one_lookup():
+        time.sleep(args.db_rtt_ms / 1000)
+        user = users.get(ObjectId(user_id))
+        return str(user["_id"])
+
+    signer = SessionTokenSigner(secret="bench-secret")
+    token = signer.issue(user_id)
+
+    cache = LRUTTLCache(max_entries=10000, ttl_seconds=300)
+    cache.set(user_id, {"user_id": user_id, "name": "Bench"})
+
+    before = per_call_us(find_one_lookup, args.db_iterations)
+    verify = per_call_us(lambda: signer.verify(token), args.iterations)
+    issue = per_call_us(lambda: signer.issue(user_id), args.iterations)
+    cached = per_call_us(lambda: (signer.verify(token), cache.get(user_id)), args.iterations)
+
+    print(f"before: find_one per request ({args.db_rtt_ms} ms RTT)  {before:10.1f} us")
+    print(f"after:  token verify                           {verify:10.2f} us")
+    print(f"after:  token verify + cached profile          {cached:10.2f} us")
+    print(f"        token issue (login only)               {issue:10.2f} us")
+    print(f"speedup (verify vs lookup):                    {before / verify:10.0f}x")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,90 @@
+"""
+Shared helpers for the benchmarks: an in-process ASGI client that records
+time to first body byte, and percentile summaries.
+"""
+import asyncio
+import json
+import time
+
+
+async def asgi_request(app, method, path, body=None, headers=None, query_string="", on_first_chunk=None,
+                       keep_body=True):
+    """Drive one request through the ASGI app without a network socket.
+
+    Returns a dict with status, the raw body, frames (number of non-empty
+    body messages, i.e. socket writes), ttft (seconds until the first
+    non-empty body chunk) and latency (seconds until the response finished).
+    on_first_chunk() is called when the first chunk arrives. With
+    keep_body=False only the byte count is kept, for very large responses.
+    """
+    raw_body = json.dumps(body).encode() if body is not None else b""
+    request_headers = [(b"content-type", b"application/json")]
+    for name, value in (headers or {}).items():
+        request_headers.append((name.lower().encode(), value.encode()))
+    scope = {
+        "type": "http",
+        "asgi": {"version": "3.0"},
+        "http_version": "1.1",
+        "method": method,
+        "scheme": "http",
+        "path": path,
+        "raw_path": path.encode(),
+        "query_string": query_string.encode(),
+        "root_path": "",
+        "headers": request_headers,
+        "client": ("127.0.0.1", 0),
+        "server": ("testserver", 80),
+    }
+    request_sent = False
+    disconnect = asyncio.Event()
+    chunks = []
+    result = {"status": None, "ttft": None, "bytes": 0, "frames": 0}
+    started = time.perf_counter()
+
+    async def receive():
+        nonlocal request_sent
+        if not request_sent:
+            request_sent = True
+            return {"type": "http.request", "body": raw_body, "more_body": False}
+        await disconnect.wait()
+        return {"type": "http.disconnect"}
+
+    async def send(message):
+        if message["type"] == "http.response.start":
+            result["status"] = message["status"]
+        elif message["type"] == "http.response.body" and message.get("body"):
+            if result["ttft"] is None:
+                result["ttft"] = time.perf_counter() - started
+                if on_first_chunk is not None:
+                    on_first_chunk()
+            result["bytes"] += len(message["body"])
+            result["frames"] += 1
+            if keep_body:
+                chunks.append(message["body"])
+
+    try:
+        await app(scope, receive, send)
+    finally:
+        disconnect.set()
+    result["latency"] = time.perf_counter() - started
+    result["body"] = b"".join(chunks)
+    return result
+
+
+def percentile(values, pct):
+    if not values:
+        return 0.0
+    ordered = sorted(values)
+    index = min(len(ordered) - 1, int(round(pct / 100 * (len(ordered) - 1))))
+    return ordered[index]
+
+
+def summarize_ms(values):
+    """count plus p50/p95/p99/max in milliseconds for a list of seconds"""
+    return {
+        "count": len(values),
+        "p50_ms": round(percentile(values, 50) * 1000, 3),
+        "p95_ms": round(percentile(values, 95) * 1000, 3),
+        "p99_ms": round(percentile(values, 99) * 1000, 3),
+        "max_ms": round(max(values) * 1000, 3) if values else 0.0,
+    }
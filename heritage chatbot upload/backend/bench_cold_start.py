@@ -0,0 +1,124 @@
+"""
+Cold start of the API process: import time, time until the server answers
+liveness, and time until it reports ready.
+
+Each run starts a fresh `uvicorn main:app` process and polls the probe
+endpoints every few milliseconds. By default MongoDB points at a closed
+local port, which is what an autoscaled replica sees when the database is
+slow or unreachable: the server must still come up and answer liveness.
+Pass --mongo-uri to measure readiness against a real server. Import time
+and the heavy modules left unloaded after `import main` are measured in
+a separate fresh interpreter.
+
+Usage:
+    python bench_cold_start.py --runs 5
+    python bench_cold_start.py --runs 5 --mongo-uri mongodb+srv://...
+"""
+import argparse
+import json
+import os
+import socket
+import statistics
+import subprocess
+import sys
+import time
+import urllib.error
+import urllib.request
+
+HEAVY_MODULES = ("groq", "httpx", "bcrypt", "certifi")
+
+IMPORT_PROBE = f"""
+import json, sys, time
+preloaded = set(sys.modules)  # site hooks (.pth files) may import some already
+started = time.perf_counter()
+import main
+print(json.dumps({{
+    "seconds": time.perf_counter() - started,
+    "loaded": [name for name in {HEAVY_MODULES!r} if name in sys.modules and name not in preloaded],
+}}))
+"""
+
+
+def free_port():
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+
+def status(url):
+    try:
+        with urllib.request.urlopen(url, timeout=1) as response:
+            return response.status
+    except urllib.error.HTTPError as e:
+        return e.code
+    except OSError:
+        return None
+
+
+def measure_import(env):
+    output = subprocess.run(
+        [sys.executable, "-c", IMPORT_PROBE], env=env, capture_output=True, text=True, check=True
+    ).stdout
+    return json.loads(output.strip().splitlines()[-1])
+
+
+def measure_server(env, args):
+    port = free_port()
+    started = time.perf_counter()
+    process = subprocess.Popen(
+        [sys.executable, "-m", "uvicorn", "main:app", "--port", str(port), "--log-level", "warning"],
+        env=env, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL,
+    )
+    live = ready = None
+    try:
+        while time.perf_counter() - started < args.timeout:
+            elapsed = time.perf_counter() - started
+            if live is None and status(f"http://127.0.0.1:{port}{args.live_path}") == 200:
+                live = elapsed
+            if live is not None and status(f"http://127.0.0.1:{port}{args.ready_path}") == 200:
+                ready = time.perf_counter() - started
+                break
+            if live is not None and args.live_only:
+                break
+            time.sleep(0.005)
+    finally:
+        process.terminate()
+        process.wait()
+    return live, ready
+
+
+def summary(values):
+    values = [value for value in values if value is not None]
+    if not values:
+        return "never"
+    return f"{statistics.median(values) * 1000:8.0f} ms median, {max(values) * 1000:6.0f} ms max"
+
+
+def main(args):
+    env = dict(os.environ, MONGO_URI=args.mongo_uri, LLM_PROVIDER=args.llm_provider)
+    env.setdefault("GROQ_API_KEY", "cold-start-bench")
+    imports, lives, readies = [], [], []
+    for _ in range(args.runs):
+        probe = measure_import(env)
+        imports.append(probe["seconds"])
+        live, ready = measure_server(env, args)
+        lives.append(live)
+        readies.append(ready)
+    print(f"MONGO_URI={args.mongo_uri} LLM_PROVIDER={args.llm_provider}, {args.runs} runs")
+    print(f"import main          {summary(imports)}")
+    print(f"heavy modules loaded by main {', '.join(probe['loaded']) or 'none'}")
+    print(f"live ({args.live_path}) {summary(lives)}")
+    if not args.live_only:
+        print(f"ready ({args.ready_path}) {summary(readies)}")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--runs", type=int, default=5)
+    parser.add_argument("--mongo-uri", default="mongodb://127.0.0.1:9/")
+    parser.add_argument("--llm-provider", default="groq")
+    parser.add_argument("--live-path", default="/health/live")
+    parser.add_argument("--ready-path", default="/health/ready")
+    parser.add_argument("--live-only", action="store_true", help="stop once liveness answers")
+    parser.add_argument("--timeout", type=float, default=30)
+    main(parser.parse_args())
@@ -0,0 +1,139 @@
+"""
+/chat/export throughput and peak memory for a synthetic 1M-message user.
+
+The app runs in-process on the blocking MongoDatabase whose messages
+collection is replaced by a synthetic one that generates documents lazily,
+so the measurement covers the server side of an export (cursor iteration,
+serialization, NDJSON encoding, gzip, threadpool hand-off) but not network
+or MongoDB time. Peak memory is the tracemalloc peak of a separate pass.
+"before" is what an export built on a list looks like: load every
+document, dump one JSON array, send it as a single body; it is run on
+--baseline-messages only since it needs memory proportional to the history.
+
+Usage:
+    python bench_export.py --messages 1000000 --baseline-messages 100000
+"""
+import argparse
+import asyncio
+import json
+import os
+import time
+import tracemalloc
+from datetime import datetime, timedelta
+
+from bson import ObjectId
+
+os.environ.setdefault("LLM_PROVIDER", "fake")
+# Synthetic users authenticate with the raw user-id header
+os.environ.setdefault("ALLOW_USER_ID_HEADER", "true")
+
+import main
+from admission import AdmissionController
+from bench_client import asgi_request
+from mongo_database import MongoDatabase, serialize_message
+
+TEXTS = [
+    "Tell me about the Brihadeeswarar Temple in Thanjavur",
+    "The Brihadeeswarar Temple was built by Raja Raja Chola I and completed in 1010 CE. " * 4,
+    "மாமல்லபுரம் கடற்கரை கோயில் பற்றி சொல்லுங்கள்",
+    "மாமல்லபுரம் கடற்கரை கோயில் பல்லவ மன்னர் இரண்டாம் நரசிம்மவர்மனால் கட்டப்பட்டது. " * 3,
+]
+
+
+class SyntheticCursor:
+    def __init__(self, count):
+        self.count = count
+
+    def sort(self, sort):
+        return self
+
+    def batch_size(self, size):
+        return self
+
+    def close(self):
+        pass
+
+    def __iter__(self):
+        start = datetime(2024, 1, 1)
+        for i in range(self.count):
+            yield {
+                "_id": ObjectId(),
+                "user_id": "bench-user",
+                "message_type": "user" if i % 2 == 0 else "assistant",
+                "content": TEXTS[i % len(TEXTS)],
+                "latitude": 10.7828,
+                "longitude": 79.1318,
+                "timestamp": start + timedelta(seconds=i),
+            }
+
+
+class SyntheticMessages:
+    def __init__(self, count):
+        self.count = count
+
+    def find(self, query, projection=None):
+        return SyntheticCursor(self.count)
+
+
+class SyntheticTombstones:
+    def find_one(self, query, projection=None):
+        return None
+
+
+def use_synthetic_db(count):
+    db = MongoDatabase(hasher=main.password_hasher)
+    db._connected = True
+    db.users = {}
+    db.messages = SyntheticMessages(count)
+    db.history_tombstones = SyntheticTombstones()
+    main.db = db
+
+
+async def export(export_format):
+    result = await asgi_request(
+        main.app, "GET", "/chat/export", headers={"user-id": "bench-user"},
+        query_string=f"format={export_format}", keep_body=False
+    )
+    assert result["status"] == 200, result
+    return result
+
+
+def export_as_list(count):
+    docs = list(SyntheticMessages(count).find({"user_id": "bench-user"}))
+    body = json.dumps([serialize_message(doc) for doc in docs], ensure_ascii=False).encode()
+    return {"bytes": len(body), "frames": 1}
+
+
+async def measure(label, count, run):
+    started = time.perf_counter()
+    result = await run()
+    seconds = time.perf_counter() - started
+
+    tracemalloc.start()
+    await run()
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+
+    print(f"{label:<24}{count:>10}{seconds:>9.2f}{count / seconds:>12,.0f}"
+          f"{result['bytes'] / 1e6:>10.1f}{result['frames']:>8}{peak / 1e6:>10.1f}")
+
+
+async def run(args):
+    main.admission = AdmissionController(enabled=False)
+    print(f"{'export':<24}{'messages':>10}{'seconds':>9}{'msgs/s':>12}{'MB out':>10}{'writes':>8}{'peak MB':>10}")
+
+    async def as_list():
+        return await asyncio.to_thread(export_as_list, args.baseline_messages)
+
+    await measure("before: list + dumps", args.baseline_messages, as_list)
+    for count in (args.baseline_messages, args.messages):
+        use_synthetic_db(count)
+        for export_format in ("ndjson", "ndjson.gz"):
+            await measure(f"after: {export_format}", count, lambda: export(export_format))
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--messages", type=int, default=1_000_000)
+    parser.add_argument("--baseline-messages", type=int, default=100_000)
+    asyncio.run(run(parser.parse_args()))
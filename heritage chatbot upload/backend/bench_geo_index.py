@@ -0,0 +1,83 @@
+"""
+Query latency of HeritageSiteIndex against dataset size.
+
+Builds grids over synthetic site sets spread across Tamil Nadu's bounding
+box (plus the bundled dataset) and times k-nearest and within-radius
+queries at random user locations, with a brute-force scan as baseline.
+
+Usage:
+    python bench_geo_index.py --sizes 100 1000 10000 100000 --queries 2000
+"""
+import argparse
+import random
+import time
+
+from heritage_sites import HeritageSiteIndex, haversine_km, load_heritage_sites
+
+# Rough bounding box of Tamil Nadu
+LAT_RANGE = (8.0, 13.6)
+LON_RANGE = (76.2, 80.4)
+
+
+def synthetic_sites(count, rng):
+    return [
+        {
+            "id": f"site-{i}",
+            "latitude": rng.uniform(*LAT_RANGE),
+            "longitude": rng.uniform(*LON_RANGE),
+        }
+        for i in range(count)
+    ]
+
+
+def time_per_query(fn, points):
+    started = time.perf_counter()
+    for lat, lon in points:
+        fn(lat, lon)
+    return (time.perf_counter() - started) / len(points) * 1e6
+
+
+def brute_force_knn(sites, k):
+    def query(lat, lon):
+        return sorted(
+            (haversine_km(lat, lon, s["latitude"], s["longitude"]), s["id"]) for s in sites
+        )[:k]
+    return query
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--sizes", type=int, nargs="+", default=[100, 1000, 10000, 100000])
+    parser.add_argument("--queries", type=int, default=2000)
+    parser.add_argument("--k", type=int, default=8)
+    parser.add_argument("--radius-km", type=float, default=25.0)
+    parser.add_argument("--cell-degrees", type=float, default=None,
+                        help="grid cell size (default: sized from the dataset density)")
+    parser.add_argument("--brute-force-limit", type=int, default=10000,
+                        help="skip the brute-force baseline above this size")
+    args = parser.parse_args()
+
+    rng = random.Random(42)
+    points = [(rng.uniform(*LAT_RANGE), rng.uniform(*LON_RANGE)) for _ in range(args.queries)]
+    datasets = [("bundled", load_heritage_sites())] + [
+        (str(size), synthetic_sites(size, rng)) for size in args.sizes
+    ]
+
+    print(f"{'dataset':>10} {'sites':>8} {'cell deg':>9} {'build ms':>9} {'knn us':>9} {'radius us':>10} {'brute us':>10}")
+    for name, sites in datasets:
+        started = time.perf_counter()
+        index = HeritageSiteIndex(sites, cell_degrees=args.cell_degrees)
+        build_ms = (time.perf_counter() - started) * 1000
+
+        knn_us = time_per_query(lambda lat, lon: index.nearest(lat, lon, k=args.k), points)
+        radius_us = time_per_query(lambda lat, lon: index.within_radius(lat, lon, args.radius_km), points)
+        if len(sites) <= args.brute_force_limit:
+            brute_points = points[: max(1, min(len(points), 200))]
+            brute = f"{time_per_query(brute_force_knn(sites, args.k), brute_points):10.1f}"
+        else:
+            brute = f"{'-':>10}"
+        print(f"{name:>10} {len(sites):>8} {index.cell_degrees:9.3f} {build_ms:9.1f} {knn_us:9.1f} {radius_us:10.1f} {brute}")
+
+
+if __name__ == "__main__":
+    main()
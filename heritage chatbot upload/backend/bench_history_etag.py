@@ -0,0 +1,85 @@
+"""
+/chat/history refetches of an unchanged history: full reads vs ETag
+revalidation (304) vs the serialized page cache.
+
+Runs the app in-process on the in-memory database with a simulated round
+trip per database call. "full" sends no If-None-Match and bypasses the
+page cache, i.e. what every refetch cost before; "304" sends the ETag of
+the previous response; "page cache" sends no ETag with the page cache on.
+
+Usage:
+    python bench_history_etag.py --messages 100 --requests 2000 --db-latency-ms 2
+"""
+import argparse
+import asyncio
+import os
+
+os.environ.setdefault("LLM_PROVIDER", "fake")
+# Synthetic users authenticate with the raw user-id header
+os.environ.setdefault("ALLOW_USER_ID_HEADER", "true")
+
+import main
+from bench_client import asgi_request, summarize_ms
+from cache import LRUTTLCache
+from memory_database import InMemoryDatabase
+
+USER = "bench-user"
+
+
+async def measure(args, if_none_match=None):
+    calls = 0
+    run_db = main.run_db
+
+    async def counting_run_db(method_name, *call_args, **kwargs):
+        nonlocal calls
+        calls += 1
+        return await run_db(method_name, *call_args, **kwargs)
+
+    main.run_db = counting_run_db
+    headers = {"user-id": USER}
+    if if_none_match:
+        headers["If-None-Match"] = if_none_match
+    results = []
+    try:
+        for _ in range(args.requests):
+            results.append(await asgi_request(
+                main.app, "GET", "/chat/history", headers=headers, query_string=f"limit={args.limit}"
+            ))
+    finally:
+        main.run_db = run_db
+    return {
+        "status": results[-1]["status"],
+        "bytes": results[-1]["bytes"],
+        "db_calls": calls / args.requests,
+        "latency": summarize_ms([result["latency"] for result in results]),
+    }
+
+
+async def run(args):
+    main.db = InMemoryDatabase(hasher=main.password_hasher)
+    for i in range(args.messages):
+        await main.db.save_message(USER, "user" if i % 2 == 0 else "assistant", f"message {i} " * 20)
+    main.db.latency_ms = args.db_latency_ms
+    version = await main.db.get_history_version(USER)
+    etag = main.history_etag(version, args.limit, None, None, None)
+
+    main.history_pages = None
+    rows = [("full", await measure(args)), ("304", await measure(args, etag))]
+    main.history_pages = LRUTTLCache(max_entries=1000, ttl_seconds=300)
+    rows.append(("page cache", await measure(args)))
+
+    print(f"{args.messages} messages, limit {args.limit}, {args.requests} requests, "
+          f"{args.db_latency_ms} ms per database call")
+    print(f"{'':<12}{'status':>8}{'bytes':>8}{'db calls':>10}{'p50 ms':>9}{'p99 ms':>9}")
+    for label, row in rows:
+        print(f"{label:<12}{row['status']:>8}{row['bytes']:>8}{row['db_calls']:>10.2f}"
+              f"{row['latency']['p50_ms']:>9.3f}{row['latency']['p99_ms']:>9.3f}")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--messages", type=int, default=100)
+    parser.add_argument("--limit", type=int, default=100)
+    parser.add_argument("--requests", type=int, default=2000)
+    parser.add_argument("--db-latency-ms", type=float, default=2)
+    asyncio.run(run(parser.parse_args()))
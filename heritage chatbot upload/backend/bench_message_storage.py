@@ -0,0 +1,128 @@
+"""
+Storage size, index size and history read latency: one document per
+message vs bucketed messages.
+
+Needs a MongoDB server. Seeds the same synthetic chat histories into a
+scratch database in both layouts (buckets written the way the migration
+tool writes them), reports $collStats for each, then times
+get_chat_history_page for the newest page and for an older page reached
+with a before cursor. The scratch database is dropped afterwards unless
+--keep is given.
+
+Usage:
+    python bench_message_storage.py --mongo-uri mongodb://localhost:27017 --users 200 --messages 2000
+"""
+import argparse
+import os
+import random
+import time
+from datetime import datetime, timedelta
+
+from bson import ObjectId
+from pymongo import MongoClient
+
+from bench_client import summarize_ms
+from bucket_storage import BucketedMongoDatabase, compact_message, new_bucket, split_buckets
+from mongo_database import MongoDatabase, encode_cursor
+
+TEXTS = [
+    "Tell me about the Brihadeeswarar Temple in Thanjavur",
+    "The Brihadeeswarar Temple was built by Raja Raja Chola I and completed in 1010 CE. " * 4,
+    "மாமல்லபுரம் கடற்கரை கோயில் பற்றி சொல்லுங்கள்",
+    "மாமல்லபுரம் கடற்கரை கோயில் பல்லவ மன்னர் இரண்டாம் நரசிம்மவர்மனால் கட்டப்பட்டது. " * 3,
+]
+
+
+def synthetic_history(user_id, count, rng):
+    """count messages over consecutive days, ~40 a day, coordinates on some user turns"""
+    timestamp = datetime(2024, 1, 1) + timedelta(minutes=rng.randrange(600))
+    for i in range(count):
+        timestamp += timedelta(seconds=rng.randrange(60, 2 * 86400 // 40))
+        located = i % 2 == 0 and rng.random() < 0.3
+        yield {
+            "_id": ObjectId(),
+            "user_id": user_id,
+            "message_type": "user" if i % 2 == 0 else "assistant",
+            "content": TEXTS[(i % 2) + 2 * rng.randrange(2)],
+            "latitude": 10.78 + rng.random() if located else None,
+            "longitude": 79.13 + rng.random() if located else None,
+            "timestamp": timestamp.replace(microsecond=0),
+        }
+
+
+def seed(documents, buckets, args):
+    rng = random.Random(args.seed)
+    user_ids = [f"user-{i}" for i in range(args.users)]
+    middles = {}
+    for user_id in user_ids:
+        history = list(synthetic_history(user_id, args.messages, rng))
+        middles[user_id] = encode_cursor(history[len(history) // 2])
+        for start in range(0, len(history), 1000):
+            documents.messages.insert_many(history[start:start + 1000], ordered=False)
+        runs = list(split_buckets([compact_message(doc) for doc in history], buckets.bucket_size))
+        buckets.buckets.insert_many([new_bucket(user_id, run) for run in runs], ordered=False)
+    return user_ids, middles
+
+
+def collection_stats(collection):
+    stats = list(collection.aggregate([{"$collStats": {"storageStats": {}}}]))[0]["storageStats"]
+    return {
+        "documents": stats["count"],
+        "data_mb": stats["size"] / 1e6,
+        "storage_mb": stats["storageSize"] / 1e6,
+        "index_mb": stats["totalIndexSize"] / 1e6,
+    }
+
+
+def time_reads(database, user_ids, middles, args):
+    rng = random.Random(args.seed)
+    newest, older = [], []
+    for _ in range(args.reads):
+        user_id = rng.choice(user_ids)
+        started = time.perf_counter()
+        database.get_chat_history_page(user_id, limit=args.page_size)
+        newest.append(time.perf_counter() - started)
+        started = time.perf_counter()
+        database.get_chat_history_page(user_id, limit=args.page_size, before=middles[user_id])
+        older.append(time.perf_counter() - started)
+    return summarize_ms(newest), summarize_ms(older)
+
+
+def main(args):
+    client = MongoClient(args.mongo_uri)
+    storage = client[args.database]
+    try:
+        documents = MongoDatabase().attach(storage, "documents")
+        buckets = BucketedMongoDatabase(bucket_size=args.bucket_size).attach(storage, "bucketed")
+        started = time.perf_counter()
+        user_ids, middles = seed(documents, buckets, args)
+        print(f"seeded {args.users} users x {args.messages} messages in {time.perf_counter() - started:.1f}s")
+
+        rows = [("documents", documents, documents.messages), ("buckets", buckets, buckets.buckets)]
+        print(f"{'layout':<12}{'docs':>10}{'data MB':>10}{'disk MB':>10}{'index MB':>10}"
+              f"{'newest p50':>12}{'p99':>8}{'older p50':>11}{'p99':>8}")
+        for label, database, collection in rows:
+            time_reads(database, user_ids, middles, args)  # warm the cache
+            newest, older = time_reads(database, user_ids, middles, args)
+            stats = collection_stats(collection)
+            print(f"{label:<12}{stats['documents']:>10}{stats['data_mb']:>10.1f}{stats['storage_mb']:>10.1f}"
+                  f"{stats['index_mb']:>10.1f}{newest['p50_ms']:>12.2f}{newest['p99_ms']:>8.2f}"
+                  f"{older['p50_ms']:>11.2f}{older['p99_ms']:>8.2f}")
+    finally:
+        if not args.keep:
+            client.drop_database(args.database)
+        client.close()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--mongo-uri", default=os.getenv("BENCH_MONGO_URI", "mongodb://localhost:27017"))
+    parser.add_argument("--database", default="heritage_storage_bench")
+    parser.add_argument("--users", type=int, default=200)
+    parser.add_argument("--messages", type=int, default=2000, help="messages per user")
+    parser.add_argument("--bucket-size", type=int, default=100)
+    parser.add_argument("--reads", type=int, default=500)
+    parser.add_argument("--page-size", type=int, default=50)
+    parser.add_argument("--seed", type=int, default=7)
+    parser.add_argument("--keep", action="store_true", help="keep the scratch database")
+    main(parser.parse_args())
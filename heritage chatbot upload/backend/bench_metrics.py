@@ -0,0 +1,106 @@
+"""
+Overhead of the /metrics instrumentation.
+
+Micro: cost of a single counter increment, labelled histogram observation
+and a full scrape render. Macro: CPU time per /chat stream with the
+registry enabled vs disabled (METRICS_ENABLED=false), using the fake LLM
+provider and the in-memory database; rounds alternate between the two so
+drift affects both equally.
+
+Usage:
+    python bench_metrics.py --streams 500 --tokens 100 --rounds 3
+"""
+import argparse
+import asyncio
+import os
+import time
+
+os.environ.setdefault("LLM_PROVIDER", "fake")
+# Synthetic users authenticate with the raw user-id header
+os.environ.setdefault("ALLOW_USER_ID_HEADER", "true")
+
+import main
+from admission import AdmissionController
+from bench_client import asgi_request
+from llm_provider import FakeProvider, LLMGateway
+from memory_database import InMemoryDatabase
+from metrics import MetricsRegistry, registry
+
+
+def per_call_ns(fn, iterations):
+    started = time.perf_counter()
+    for _ in range(iterations):
+        fn()
+    return (time.perf_counter() - started) / iterations * 1e9
+
+
+def micro(iterations):
+    bench_registry = MetricsRegistry(enabled=True)
+    counter = bench_registry.counter("bench_total", "bench")
+    histogram = bench_registry.histogram("bench_seconds", "bench", labels=("method",))
+    for method in ("save_message", "get_chat_history_page", "login_user", "get_message_count"):
+        histogram.labels(method).observe(0.001)
+    child = histogram.labels("save_message")
+
+    print(f"counter.inc                     {per_call_ns(counter.inc, iterations):8.0f} ns")
+    print(f"histogram.labels(m).observe     "
+          f"{per_call_ns(lambda: histogram.labels('save_message').observe(0.0042), iterations):8.0f} ns")
+    print(f"bound child.observe             {per_call_ns(lambda: child.observe(0.0042), iterations):8.0f} ns")
+    bench_registry.enabled = False
+    print(f"disabled child.observe          {per_call_ns(lambda: child.observe(0.0042), iterations):8.0f} ns")
+    render_us = per_call_ns(registry.render, 200) / 1000
+    print(f"full /metrics render            {render_us:8.1f} us ({len(registry.render().splitlines())} lines)")
+
+
+async def chat_round(args, round_index):
+    started_cpu = time.process_time()
+    started = time.perf_counter()
+    await asyncio.gather(*(
+        asgi_request(main.app, "POST", "/chat", headers={"user-id": f"user-{i}"}, body={
+            "message": f"Temple route round {round_index} stream {i}", "language": "en",
+            "latitude": 10.78, "longitude": 79.13,
+        })
+        for i in range(args.streams)
+    ))
+    return time.process_time() - started_cpu, time.perf_counter() - started
+
+
+async def macro(args):
+    main.llm = LLMGateway(
+        FakeProvider(tokens_per_sec=args.tokens_per_sec, ttft_ms=5, tokens=args.tokens),
+        max_concurrency=args.streams
+    )
+    main.db = InMemoryDatabase(hasher=main.password_hasher)
+    main.admission = AdmissionController(enabled=False)
+    cpu = {True: [], False: []}
+    await chat_round(args, "warm-up")
+    for round_index in range(args.rounds * 2):
+        enabled = round_index % 2 == 0
+        registry.enabled = enabled
+        # Distinct prompts every round so nothing is served from the response cache
+        used, _ = await chat_round(args, round_index)
+        cpu[enabled].append(used)
+    registry.enabled = True
+
+    on = min(cpu[True]) / args.streams * 1000
+    off = min(cpu[False]) / args.streams * 1000
+    print(f"\n/chat CPU per stream ({args.streams} streams x {args.tokens} tokens, best of {args.rounds})")
+    print(f"metrics disabled                {off:8.3f} ms")
+    print(f"metrics enabled                 {on:8.3f} ms")
+    print(f"overhead                        {(on - off) / off * 100:+8.2f} %")
+
+
+def main_cli():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--iterations", type=int, default=200000)
+    parser.add_argument("--streams", type=int, default=500)
+    parser.add_argument("--tokens", type=int, default=100)
+    parser.add_argument("--tokens-per-sec", type=float, default=1000)
+    parser.add_argument("--rounds", type=int, default=3)
+    args = parser.parse_args()
+    micro(args.iterations)
+    asyncio.run(macro(args))
+
+
+if __name__ == "__main__":
+    main_cli()
@@ -0,0 +1,99 @@
+"""
+Reverse geocoding throughput: R-tree prefilter vs testing every district
+polygon, and cached lookups, plus district accuracy on the heritage sites.
+
+Queries are random points around the gazetteer towns (where chat users
+are), a share of them outside the state. "brute force" runs the
+point-in-polygon test on every polygon in turn; "r-tree" tests only the
+polygons whose bounding box holds the point; "cached" repeats the
+r-tree queries through locate(), so every lookup is a hit on the rounded
+coordinates. The nearest-town search is included in all three; the
+"district" rows time the polygon step alone.
+
+Usage:
+    python bench_reverse_geocoder.py --queries 20000
+"""
+import argparse
+import random
+import time
+
+from heritage_sites import load_heritage_sites
+from reverse_geocoder import ReverseGeocoder, point_in_polygon
+
+
+def brute_force_district(geocoder, latitude, longitude):
+    for district, rings in geocoder.polygons:
+        if point_in_polygon(longitude, latitude, rings):
+            return district
+    return None
+
+
+def random_points(geocoder, args):
+    rng = random.Random(args.seed)
+    towns = geocoder.towns.sites
+    points = []
+    for _ in range(args.queries):
+        town = rng.choice(towns)
+        spread = args.spread_degrees if rng.random() > args.outside_share else 1.5
+        points.append((town["latitude"] + rng.uniform(-spread, spread),
+                       town["longitude"] + rng.uniform(-spread, spread)))
+    return points
+
+
+def rate(lookup, points):
+    started = time.perf_counter()
+    for latitude, longitude in points:
+        lookup(latitude, longitude)
+    elapsed = time.perf_counter() - started
+    return len(points) / elapsed, elapsed / len(points) * 1e6
+
+
+def main(args):
+    started = time.perf_counter()
+    geocoder = ReverseGeocoder.from_files(cache_entries=args.queries * 2)
+    load_ms = (time.perf_counter() - started) * 1000
+    print(f"loaded {len(geocoder.polygons)} polygons of {len(geocoder.districts)} districts and "
+          f"{len(geocoder.towns)} towns in {load_ms:.1f} ms (r-tree height {geocoder.tree.height})")
+
+    points = random_points(geocoder, args)
+    mismatches = sum(
+        geocoder.district(*point) != brute_force_district(geocoder, *point) for point in points
+    )
+
+    def brute_force(latitude, longitude):
+        geocoder.towns.nearest(latitude, longitude, k=1, max_distance_km=geocoder.max_town_km)
+        brute_force_district(geocoder, latitude, longitude)
+
+    # Rounded first, so the cached pass hits exactly the entries the r-tree pass stored
+    precision = geocoder.precision
+    points = [(round(lat, precision), round(lon, precision)) for lat, lon in points]
+    rows = [
+        ("district: all", rate(lambda lat, lon: brute_force_district(geocoder, lat, lon), points)),
+        ("district: tree", rate(geocoder.district, points)),
+        ("brute force", rate(brute_force, points)),
+    ]
+    geocoder.polygon_tests = geocoder.lookups = 0
+    rows.append(("r-tree", rate(geocoder.locate, points)))
+    tests = geocoder.polygon_tests / geocoder.lookups
+    rows.append(("cached", rate(geocoder.locate, points)))
+
+    print(f"{args.queries} queries, {args.outside_share:.0%} spread across the border; "
+          f"r-tree tests {tests:.2f} polygons per lookup vs {len(geocoder.polygons)}; "
+          f"{mismatches} district mismatches against brute force")
+    print(f"{'':<16}{'lookups/s':>12}{'us/lookup':>11}")
+    for label, (per_second, micros) in rows:
+        print(f"{label:<16}{per_second:>12.0f}{micros:>11.1f}")
+
+    sites = load_heritage_sites()
+    correct = sum(geocoder.locate(site["latitude"], site["longitude"])["district"] == site["district"]
+                  for site in sites)
+    print(f"heritage sites resolved to their recorded district: {correct}/{len(sites)}")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--queries", type=int, default=20000)
+    parser.add_argument("--spread-degrees", type=float, default=0.2, help="offset from a town, in degrees")
+    parser.add_argument("--outside-share", type=float, default=0.1, help="share of wider offsets")
+    parser.add_argument("--seed", type=int, default=7)
+    main(parser.parse_args())
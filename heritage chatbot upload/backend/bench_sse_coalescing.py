@@ -0,0 +1,83 @@
+"""
+SSE frames and CPU per /chat stream, one frame per delta vs coalesced.
+
+Runs the app in-process with the fake LLM provider and the in-memory
+database. "before" sends every delta as its own frame (flush interval 0),
+"after" uses the configured flush interval and byte threshold. Each frame
+is one ASGI body message, i.e. one socket write in production.
+
+Usage:
+    python bench_sse_coalescing.py --streams 300 --tokens 900 --tokens-per-sec 200
+"""
+import argparse
+import asyncio
+import os
+import statistics
+import time
+
+os.environ.setdefault("LLM_PROVIDER", "fake")
+# Synthetic users authenticate with the raw user-id header
+os.environ.setdefault("ALLOW_USER_ID_HEADER", "true")
+
+import main
+from admission import AdmissionController
+from bench_client import asgi_request, percentile
+from llm_provider import FakeProvider, LLMGateway
+from memory_database import InMemoryDatabase
+from sse import ChunkCoalescer
+
+
+async def run_streams(args, label):
+    started_cpu = time.process_time()
+    results = await asyncio.gather(*(
+        asgi_request(main.app, "POST", "/chat", headers={"user-id": f"user-{i}"}, body={
+            "message": f"Heritage walk {label} number {i}", "language": "en",
+        })
+        for i in range(args.streams)
+    ))
+    cpu = time.process_time() - started_cpu
+    return {
+        "frames": statistics.mean(result["frames"] for result in results),
+        "bytes": statistics.mean(len(result["body"]) for result in results),
+        "cpu_ms": cpu / args.streams * 1000,
+        "ttft_p50": percentile([result["ttft"] for result in results], 50) * 1000,
+        "ttft_p99": percentile([result["ttft"] for result in results], 99) * 1000,
+    }
+
+
+async def run(args):
+    main.llm = LLMGateway(
+        FakeProvider(tokens_per_sec=args.tokens_per_sec, ttft_ms=args.ttft_ms, tokens=args.tokens),
+        max_concurrency=args.streams
+    )
+    main.db = InMemoryDatabase(hasher=main.password_hasher)
+    main.admission = AdmissionController(enabled=False)
+
+    main.chunk_coalescer = ChunkCoalescer(flush_interval=0)
+    await run_streams(args, "warm-up")
+    before = await run_streams(args, "before")
+    main.chunk_coalescer = ChunkCoalescer(flush_interval=args.flush_ms / 1000, max_bytes=args.flush_bytes)
+    after = await run_streams(args, "after")
+
+    print(f"{args.streams} streams x {args.tokens} tokens at {args.tokens_per_sec:.0f} tokens/s, "
+          f"flush {args.flush_ms:.0f} ms / {args.flush_bytes} bytes")
+    print(f"{'':22}{'before':>12}{'after':>12}")
+    for key, label in (
+        ("frames", "frames per stream"),
+        ("bytes", "bytes per stream"),
+        ("cpu_ms", "CPU ms per stream"),
+        ("ttft_p50", "TTFT p50 ms"),
+        ("ttft_p99", "TTFT p99 ms"),
+    ):
+        print(f"{label:<22}{before[key]:>12.1f}{after[key]:>12.1f}")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--streams", type=int, default=300)
+    parser.add_argument("--tokens", type=int, default=900)
+    parser.add_argument("--tokens-per-sec", type=float, default=200)
+    parser.add_argument("--ttft-ms", type=float, default=50)
+    parser.add_argument("--flush-ms", type=float, default=50)
+    parser.add_argument("--flush-bytes", type=int, default=512)
+    asyncio.run(run(parser.parse_args()))
@@ -0,0 +1,183 @@
+"""
+Output tokens and /chat latency per language: the model writing the final
+markdown vs the compact structured format rendered by the server.
+
+Both modes carry the same answer: a two-day Thanjavur plan with three
+hotels and the five essentials, with notes written in the request's
+language. The compact answer is rendered with ItineraryRenderer, and that
+rendering is what the model has to write itself in markdown mode. A
+scripted provider streams each answer at --tokens-per-sec, split the way
+conversation_memory.estimate_tokens counts tokens, and stops at the
+LLM_MAX_TOKENS cap like a real model would. Requests run through the app
+in-process with the in-memory database.
+
+Usage:
+    python bench_structured_output.py --tokens-per-sec 250 --requests 20
+"""
+import argparse
+import asyncio
+import os
+
+os.environ.setdefault("LLM_PROVIDER", "fake")
+# Synthetic users authenticate with the raw user-id header
+os.environ.setdefault("ALLOW_USER_ID_HEADER", "true")
+
+import main
+from admission import AdmissionController
+from bench_client import asgi_request, summarize_ms
+from conversation_memory import estimate_tokens
+from itinerary import ItineraryRenderer
+from llm_provider import LLMGateway, LLMProvider
+from memory_database import InMemoryDatabase
+
+ORIGIN = (10.7870, 79.1378)  # Thanjavur bus stand
+
+COMPACT_ANSWERS = {
+    "en": """D|1
+S|brihadeeswarar-temple|Rajaraja Chola's granite vimana; arrive at 6 am for the abhishekam and soft light.
+S|thanjavur-maratha-palace|Bronze gallery and the Saraswathi Mahal manuscript library.
+S|schwartz-church-thanjavur|18th-century church built for the Maratha court, a short walk away.
+D|2
+S|airavatesvara-temple|Darasuram's musical steps and miniature friezes, usually uncrowded.
+S|adi-kumbeswarar-temple|Kumbakonam's largest temple; the tank and mandapam are worth a slow walk.
+S|swamimalai-temple|Hilltop Murugan shrine; bronze casting workshops line the road.
+H|Hotel Parisutham|Thanjavur|Pool and garden, 10 minutes from the Big Temple|*
+H|Ideal River View Resort|Thanjavur|Quiet cottages on the Vennar river
+H|Mantra Veppathur|Kumbakonam|Heritage resort close to the day 2 temples
+E|time|October to March; temples are coolest before 10 am
+E|dress|Cover shoulders and knees; shoes are left outside the shrines
+E|food|Thanjavur meals on banana leaf, degree coffee, Kumbakonam filter coffee
+E|transport|Hire a car for day 2; town buses link Thanjavur and Kumbakonam every 15 min
+E|duration|2 days, 3 with a slower pace
+""",
+    "ta": """D|1
+S|brihadeeswarar-temple|ராஜராஜ சோழனின் கருங்கல் விமானம்; காலை 6 மணிக்கு அபிஷேகம் காண வாருங்கள்.
+S|thanjavur-maratha-palace|வெண்கல சிலைக் காட்சியகமும் சரஸ்வதி மகால் நூலகமும் உள்ளன.
+S|schwartz-church-thanjavur|மராட்டிய அரசவைக்காக கட்டப்பட்ட 18ஆம் நூற்றாண்டு தேவாலயம், நடந்தே செல்லலாம்.
+D|2
+S|airavatesvara-temple|தாராசுரத்தின் இசைப் படிகளும் நுண்ணிய சிற்பங்களும்; கூட்டம் குறைவு.
+S|adi-kumbeswarar-temple|கும்பகோணத்தின் பெரிய கோயில்; குளமும் மண்டபமும் பார்க்க வேண்டியவை.
+S|swamimalai-temple|மலை மேல் முருகன் சன்னதி; வழியில் வெண்கல வார்ப்பு பட்டறைகள்.
+H|Hotel Parisutham|Thanjavur|நீச்சல் குளம், பெரிய கோயிலிலிருந்து 10 நிமிடம்|*
+H|Ideal River View Resort|Thanjavur|வெண்ணாறு கரையில் அமைதியான குடில்கள்
+H|Mantra Veppathur|Kumbakonam|இரண்டாம் நாள் கோயில்களுக்கு அருகில் பாரம்பரிய விடுதி
+E|time|அக்டோபர் முதல் மார்ச் வரை; காலை 10 மணிக்கு முன் வெயில் குறைவு
+E|dress|தோள்களும் முழங்கால்களும் மறைக்கும் உடை; காலணிகளை வெளியே விடவும்
+E|food|வாழை இலை சாப்பாடு, கும்பகோணம் டிகிரி காபி
+E|transport|இரண்டாம் நாள் கார் வாடகைக்கு எடுக்கவும்; 15 நிமிடத்திற்கு ஒரு பேருந்து உண்டு
+E|duration|2 நாட்கள், நிதானமாக என்றால் 3 நாட்கள்
+""",
+    "hi": """D|1
+S|brihadeeswarar-temple|राजराज चोल का ग्रेनाइट विमान; सुबह 6 बजे अभिषेक देखने आएं।
+S|thanjavur-maratha-palace|कांस्य मूर्तियों की गैलरी और सरस्वती महल पुस्तकालय।
+S|schwartz-church-thanjavur|मराठा दरबार के लिए बना 18वीं सदी का चर्च, पैदल दूरी पर।
+D|2
+S|airavatesvara-temple|दारासुरम की संगीतमय सीढ़ियां और बारीक नक्काशी; भीड़ कम रहती है।
+S|adi-kumbeswarar-temple|कुंभकोणम का सबसे बड़ा मंदिर; कुंड और मंडपम ज़रूर देखें।
+S|swamimalai-temple|पहाड़ी पर मुरुगन मंदिर; रास्ते में कांस्य ढलाई की कार्यशालाएं।
+H|Hotel Parisutham|Thanjavur|स्विमिंग पूल, बड़े मंदिर से 10 मिनट|*
+H|Ideal River View Resort|Thanjavur|वेन्नार नदी किनारे शांत कॉटेज
+H|Mantra Veppathur|Kumbakonam|दूसरे दिन के मंदिरों के पास हेरिटेज रिसॉर्ट
+E|time|अक्टूबर से मार्च; सुबह 10 बजे से पहले कम गर्मी
+E|dress|कंधे और घुटने ढके कपड़े; जूते बाहर उतारें
+E|food|केले के पत्ते पर भोजन, कुंभकोणम फ़िल्टर कॉफ़ी
+E|transport|दूसरे दिन कार किराए पर लें; हर 15 मिनट में बस मिलती है
+E|duration|2 दिन, आराम से घूमने के लिए 3 दिन
+""",
+}
+
+
+def split_tokens(text):
+    """Split text into pieces of one estimated token each (4 ASCII chars, or 1 other char)"""
+    piece = ""
+    for char in text:
+        if char < "\x80":
+            piece += char
+            if len(piece) == 4:
+                yield piece
+                piece = ""
+        else:
+            if piece:
+                yield piece
+                piece = ""
+            yield char
+    if piece:
+        yield piece
+
+
+def render(language):
+    renderer = ItineraryRenderer(main.site_index, language=language, origin=ORIGIN)
+    return renderer.feed(COMPACT_ANSWERS[language]) + renderer.close()
+
+
+class ScriptedProvider(LLMProvider):
+    """Streams a fixed answer at tokens_per_sec, cut off at max_tokens"""
+
+    name = "scripted"
+
+    def __init__(self, text, tokens_per_sec, ttft_ms):
+        self.tokens = list(split_tokens(text))
+        self.tokens_per_sec = tokens_per_sec
+        self.ttft_ms = ttft_ms
+
+    async def open_stream(self, messages, model, temperature, max_tokens):
+        await asyncio.sleep(self.ttft_ms / 1000)
+        return self._texts(self.tokens[:max_tokens])
+
+    async def _texts(self, tokens):
+        for i, token in enumerate(tokens):
+            if i:
+                await asyncio.sleep(1 / self.tokens_per_sec)
+            yield token
+
+
+async def run_mode(args, mode, language, text):
+    main.LLM_OUTPUT_MODE = mode
+    main.llm = LLMGateway(ScriptedProvider(text, args.tokens_per_sec, args.ttft_ms), max_concurrency=args.requests)
+    results = await asyncio.gather(*(
+        asgi_request(main.app, "POST", "/chat", headers={"user-id": f"{mode}-{language}-{i}"}, body={
+            "message": f"Plan a 2 day heritage trip around Thanjavur ({mode} {i})",
+            "language": language, "latitude": ORIGIN[0], "longitude": ORIGIN[1],
+        })
+        for i in range(args.requests)
+    ))
+    return {
+        "ttft": summarize_ms([result["ttft"] for result in results]),
+        "latency": summarize_ms([result["latency"] for result in results]),
+    }
+
+
+async def run(args):
+    main.db = InMemoryDatabase(hasher=main.password_hasher)
+    main.admission = AdmissionController(enabled=False)
+    main.conversation_memory.enabled = False
+    cap = LLMGateway(ScriptedProvider("", 1, 0)).max_tokens
+
+    print(f"{args.tokens_per_sec:.0f} tokens/s, {args.ttft_ms:.0f} ms to first token, "
+          f"max_tokens {cap}, {args.requests} requests per cell")
+    print(f"{'lang':<6}{'mode':<12}{'tokens':>8}{'cut off':>9}{'TTFT p50':>10}{'done p50':>10}{'done p99':>10}")
+    for language in args.languages:
+        rendered = render(language)
+        rows = (("markdown", rendered), ("structured", COMPACT_ANSWERS[language]))
+        stats = {}
+        for mode, text in rows:
+            tokens = estimate_tokens(text)
+            result = await run_mode(args, mode, language, text)
+            stats[mode] = (tokens, result)
+            print(f"{language:<6}{mode:<12}{min(tokens, cap):>8}{'yes' if tokens > cap else 'no':>9}"
+                  f"{result['ttft']['p50_ms']:>10.0f}{result['latency']['p50_ms']:>10.0f}"
+                  f"{result['latency']['p99_ms']:>10.0f}")
+        saved_tokens = 1 - stats["structured"][0] / stats["markdown"][0]
+        saved_latency = 1 - stats["structured"][1]["latency"]["p50_ms"] / stats["markdown"][1]["latency"]["p50_ms"]
+        cut = "" if stats["markdown"][0] <= cap else ", even though the markdown answer was cut off"
+        print(f"{language:<6}{saved_tokens:.0%} fewer output tokens than the complete markdown answer "
+              f"({stats['markdown'][0]}), {saved_latency:.0%} less time to last byte{cut}")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--tokens-per-sec", type=float, default=250)
+    parser.add_argument("--ttft-ms", type=float, default=200)
+    parser.add_argument("--requests", type=int, default=20)
+    parser.add_argument("--languages", nargs="+", default=["en", "ta", "hi"])
+    asyncio.run(run(parser.parse_args()))
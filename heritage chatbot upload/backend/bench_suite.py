@@ -0,0 +1,269 @@
+"""
+Reproducible end-to-end load test for the backend.
+
+Runs the FastAPI app in-process with the fake LLM provider and the
+in-memory database, then lets --users virtual users each sign up, log in
+and perform --ops-per-user requests drawn from a seeded mix of chat,
+history, profile and login calls. Reports throughput, chat time to first
+token and full-stream latency, and per-endpoint latency percentiles, and
+writes everything to a JSON file.
+
+Pass --compare with an earlier result file to diff against it; the run
+exits with status 1 if a tracked metric regressed by more than --tolerance
+percent.
+
+Usage:
+    python bench_suite.py --users 200 --ops-per-user 20
+    python bench_suite.py --compare bench_results/baseline.json
+"""
+import argparse
+import asyncio
+import json
+import os
+import random
+import sys
+import time
+from datetime import datetime
+
+os.environ.setdefault("LLM_PROVIDER", "fake")
+
+import main
+from admission import AdmissionController
+from bench_client import asgi_request, summarize_ms
+from heritage_sites import load_heritage_sites
+from llm_provider import FakeProvider, LLMGateway
+from memory_database import InMemoryDatabase
+from password_hasher import PasswordHasher
+
+QUESTIONS = (
+    "Plan a 2 day temple trip near me",
+    "Which Chola temples can I visit today?",
+    "Best heritage sites for a family weekend",
+    "Suggest a one day fort and palace route",
+    "Where can I see Pallava rock cut architecture?",
+    "What festivals are on at the temples nearby?",
+)
+LANGUAGES = ("en", "en", "en", "ta", "hi")
+
+# (section, metric, True if higher is better) compared by --compare
+TRACKED_METRICS = (
+    ("summary", "throughput_rps", True),
+    ("chat_ttft", "p50_ms", False),
+    ("chat_ttft", "p95_ms", False),
+    ("chat_ttft", "p99_ms", False),
+    ("chat_stream", "p50_ms", False),
+    ("chat_stream", "p99_ms", False),
+)
+
+
+def parse_mix(value):
+    """Parse "chat=4,history=3" into a list of (operation, weight)"""
+    mix = []
+    for item in value.split(","):
+        name, weight = item.split("=")
+        mix.append((name.strip(), float(weight)))
+    return mix
+
+
+class Recorder:
+    def __init__(self):
+        self.latencies = {}
+        self.errors = {}
+        self.ttft = []
+        self.streams = []
+
+    def record(self, endpoint, result, expected=200):
+        self.latencies.setdefault(endpoint, []).append(result["latency"])
+        if result["status"] != expected:
+            self.errors[endpoint] = self.errors.get(endpoint, 0) + 1
+            return False
+        return True
+
+
+async def virtual_user(index, args, mix, sites, recorder):
+    rng = random.Random(args.seed * 100003 + index)
+    email = f"bench-{index}@example.com"
+    password = f"password-{index}"
+
+    result = await asgi_request(main.app, "POST", "/auth/signup", body={
+        "email": email, "password": password, "name": f"Bench {index}"
+    })
+    if not recorder.record("POST /auth/signup", result):
+        return
+    result = await asgi_request(main.app, "POST", "/auth/login", body={"email": email, "password": password})
+    if not recorder.record("POST /auth/login", result):
+        return
+    headers = {"authorization": f"Bearer {json.loads(result['body'])['token']}"}
+
+    operations = [name for name, _ in mix]
+    weights = [weight for _, weight in mix]
+    for _ in range(args.ops_per_user):
+        operation = rng.choices(operations, weights)[0]
+        if operation == "chat":
+            site = rng.choice(sites)
+            message = rng.choice(QUESTIONS)
+            if args.unique_prompts:
+                message = f"{message} (user {index}, {rng.random():.6f})"
+            result = await asgi_request(main.app, "POST", "/chat", headers=headers, body={
+                "message": message,
+                "language": rng.choice(LANGUAGES),
+                "latitude": round(site["latitude"] + rng.uniform(-0.05, 0.05), 4),
+                "longitude": round(site["longitude"] + rng.uniform(-0.05, 0.05), 4),
+            })
+            if recorder.record("POST /chat", result):
+                recorder.ttft.append(result["ttft"] or result["latency"])
+                recorder.streams.append(result["latency"])
+        elif operation == "history":
+            result = await asgi_request(
+                main.app, "GET", "/chat/history", headers=headers, query_string=f"limit={args.history_limit}"
+            )
+            recorder.record("GET /chat/history", result)
+        elif operation == "me":
+            result = await asgi_request(main.app, "GET", "/auth/me", headers=headers)
+            recorder.record("GET /auth/me", result)
+        elif operation == "login":
+            result = await asgi_request(main.app, "POST", "/auth/login", body={"email": email, "password": password})
+            recorder.record("POST /auth/login", result)
+        else:
+            raise ValueError(f"Unknown operation in --mix: {operation}")
+        if args.think_ms:
+            await asyncio.sleep(rng.uniform(0, 2 * args.think_ms) / 1000)
+
+
+async def run(args):
+    main.llm = LLMGateway(
+        FakeProvider(tokens_per_sec=args.tokens_per_sec, ttft_ms=args.ttft_ms, tokens=args.tokens),
+        max_concurrency=args.llm_concurrency
+    )
+    # Queue sized for every signup at once so the run measures latency, not 503s
+    main.password_hasher = PasswordHasher(rounds=args.bcrypt_rounds, queue_limit=args.users)
+    main.db = InMemoryDatabase(hasher=main.password_hasher, latency_ms=args.db_latency_ms)
+    # Generation slots match the LLM limit; virtual users are not rate limited
+    main.admission = AdmissionController(
+        max_active=args.llm_concurrency, max_queue=args.users, user_rate_per_minute=1e9, user_burst=10**9
+    )
+    # Start the bcrypt worker processes outside the measured window
+    await main.password_hasher.hash_async("warm-up")
+
+    recorder = Recorder()
+    sites = load_heritage_sites()
+    mix = parse_mix(args.mix)
+    started = time.perf_counter()
+    try:
+        await asyncio.gather(*(
+            virtual_user(i, args, mix, sites, recorder) for i in range(args.users)
+        ))
+        elapsed = time.perf_counter() - started
+        server_stats = await main.stats()
+    finally:
+        main.password_hasher.shutdown()
+
+    total = sum(len(values) for values in recorder.latencies.values())
+    return {
+        "created_at": datetime.utcnow().isoformat(),
+        "config": vars(args),
+        "summary": {
+            "requests": total,
+            "errors": sum(recorder.errors.values()),
+            "wall_s": round(elapsed, 3),
+            "throughput_rps": round(total / elapsed, 2) if elapsed else 0.0,
+        },
+        "chat_ttft": summarize_ms(recorder.ttft),
+        "chat_stream": summarize_ms(recorder.streams),
+        "endpoints": {
+            endpoint: {**summarize_ms(values), "errors": recorder.errors.get(endpoint, 0)}
+            for endpoint, values in sorted(recorder.latencies.items())
+        },
+        "server_stats": server_stats,
+    }
+
+
+def print_report(results):
+    summary = results["summary"]
+    print(f"requests:       {summary['requests']} ({summary['errors']} errors) in {summary['wall_s']:.2f}s")
+    print(f"throughput:     {summary['throughput_rps']:.1f} req/s")
+    for label, key in (("chat ttft", "chat_ttft"), ("chat stream", "chat_stream")):
+        stats = results[key]
+        print(f"{label + ':':<16}p50 {stats['p50_ms']:8.1f}  p95 {stats['p95_ms']:8.1f}  "
+              f"p99 {stats['p99_ms']:8.1f} ms")
+    print()
+    print(f"{'endpoint':<22}{'count':>7}{'errors':>8}{'p50 ms':>10}{'p95 ms':>10}{'p99 ms':>10}")
+    for endpoint, stats in results["endpoints"].items():
+        print(f"{endpoint:<22}{stats['count']:>7}{stats['errors']:>8}"
+              f"{stats['p50_ms']:>10.1f}{stats['p95_ms']:>10.1f}{stats['p99_ms']:>10.1f}")
+
+
+def compare(results, baseline, tolerance):
+    """Print metric deltas against baseline; return the regressed metric names"""
+    regressions = []
+    print()
+    print(f"{'metric':<26}{'baseline':>12}{'current':>12}{'change':>10}")
+    rows = list(TRACKED_METRICS) + [
+        ("endpoints", endpoint, False) for endpoint in results["endpoints"]
+    ]
+    for section, metric, higher_is_better in rows:
+        if section == "endpoints":
+            old = baseline.get("endpoints", {}).get(metric, {}).get("p95_ms")
+            new = results["endpoints"][metric]["p95_ms"]
+            name = f"{metric} p95"
+        else:
+            old = baseline.get(section, {}).get(metric)
+            new = results[section][metric]
+            name = f"{section}.{metric}"
+        if not old:
+            continue
+        change = (new - old) / old * 100
+        worse = -change if higher_is_better else change
+        flag = ""
+        if worse > tolerance:
+            regressions.append(name)
+            flag = "  REGRESSION"
+        print(f"{name:<26}{old:>12.1f}{new:>12.1f}{change:>+9.1f}%{flag}")
+    return regressions
+
+
+def main_cli():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--users", type=int, default=200)
+    parser.add_argument("--ops-per-user", type=int, default=20)
+    parser.add_argument("--mix", default="chat=4,history=3,me=2,login=1",
+                        help="operation weights after signup/login")
+    parser.add_argument("--seed", type=int, default=1)
+    parser.add_argument("--think-ms", type=float, default=0, help="mean pause between a user's requests")
+    parser.add_argument("--unique-prompts", action="store_true",
+                        help="make every chat prompt distinct (no cache hits or coalescing)")
+    parser.add_argument("--history-limit", type=int, default=50)
+    parser.add_argument("--tokens", type=int, default=60)
+    parser.add_argument("--tokens-per-sec", type=float, default=200)
+    parser.add_argument("--ttft-ms", type=float, default=50)
+    parser.add_argument("--llm-concurrency", type=int, default=256)
+    parser.add_argument("--db-latency-ms", type=float, default=1.0, help="simulated database round trip")
+    parser.add_argument("--bcrypt-rounds", type=int, default=4,
+                        help="bcrypt cost for the run (production default is 12)")
+    parser.add_argument("--output", help="result file (default bench_results/suite-<time>.json)")
+    parser.add_argument("--compare", help="earlier result file to diff against")
+    parser.add_argument("--tolerance", type=float, default=10.0, help="allowed regression in percent")
+    args = parser.parse_args()
+
+    results = asyncio.run(run(args))
+    print_report(results)
+
+    output = args.output or os.path.join(
+        "bench_results", f"suite-{datetime.utcnow().strftime('%Y%m%dT%H%M%S')}.json"
+    )
+    os.makedirs(os.path.dirname(output) or ".", exist_ok=True)
+    with open(output, "w", encoding="utf-8") as f:
+        json.dump(results, f, indent=2, default=str)
+    print(f"\nresults written to {output}")
+
+    if args.compare:
+        with open(args.compare, encoding="utf-8") as f:
+            baseline = json.load(f)
+        regressions = compare(results, baseline, args.tolerance)
+        if regressions:
+            print(f"\n{len(regressions)} metric(s) regressed by more than {args.tolerance}%")
+            sys.exit(1)
+
+
+if __name__ == "__main__":
+    main_cli()
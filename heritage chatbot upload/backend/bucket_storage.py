@@ -0,0 +1,316 @@
+import os
+from datetime import timedelta
+
+from bson import ObjectId
+from pymongo import WriteConcern
+
+from deletion_jobs import deletion_bound
+from mongo_database import MongoDatabase
+
+# Newest buckets first for a user; also serves "after" and deletion scans
+BUCKET_INDEX = [("user_id", 1), ("start", -1)]
+
+# message_type <-> one-letter code stored in buckets
+TYPE_CODES = {"user": "u", "assistant": "a"}
+TYPE_NAMES = {code: name for name, code in TYPE_CODES.items()}
+
+# API field name -> key of a compact message inside a bucket
+COMPACT_FIELDS = {
+    "id": "i",
+    "type": "k",
+    "text": "c",
+    "timestamp": "ts",
+    "latitude": "lat",
+    "longitude": "lon",
+    "district": "d",
+}
+
+
+def compact_message(doc):
+    """Bucket entry for a message document: short keys, no user_id, no null coordinates or district"""
+    message = {
+        "i": doc["_id"],
+        "k": TYPE_CODES.get(doc["message_type"], doc["message_type"]),
+        "c": doc["content"],
+        "ts": doc["timestamp"],
+    }
+    if doc.get("latitude") is not None:
+        message["lat"] = doc["latitude"]
+    if doc.get("longitude") is not None:
+        message["lon"] = doc["longitude"]
+    if doc.get("district") is not None:
+        message["d"] = doc["district"]
+    return message
+
+
+def expand_message(user_id, message):
+    """Inverse of compact_message, in the shape of a messages collection document"""
+    kind = message.get("k")
+    return {
+        "_id": message["i"],
+        "user_id": user_id,
+        "message_type": TYPE_NAMES.get(kind, kind),
+        "content": message.get("c"),
+        "latitude": message.get("lat"),
+        "longitude": message.get("lon"),
+        "district": message.get("d"),
+        "timestamp": message["ts"],
+    }
+
+
+def message_key(message):
+    return message["ts"], message["i"]
+
+
+def day_start(timestamp):
+    return timestamp.replace(hour=0, minute=0, second=0, microsecond=0)
+
+
+def new_bucket(user_id, messages):
+    """Bucket document for compact messages sorted by (timestamp, _id)"""
+    return {
+        "_id": ObjectId(),
+        "user_id": user_id,
+        "start": messages[0]["ts"],
+        "end": messages[-1]["ts"],
+        "count": len(messages),
+        "messages": messages,
+    }
+
+
+def split_buckets(messages, bucket_size):
+    """Split sorted compact messages into runs that fit one bucket (same UTC day, at most bucket_size)"""
+    run = []
+    for message in messages:
+        if run and (len(run) >= bucket_size or day_start(message["ts"]) != day_start(run[0]["ts"])):
+            yield run
+            run = []
+        run.append(message)
+    if run:
+        yield run
+
+
+def bucket_projection(fields):
+    """Projection returning only the requested message fields (plus what reads need)"""
+    if not fields:
+        return None
+    projection = {"start": 1, "end": 1, "messages.i": 1, "messages.ts": 1}
+    for field in fields:
+        projection[f"messages.{COMPACT_FIELDS[field]}"] = 1
+    return projection
+
+
+def keep_messages(condition):
+    """Update pipeline keeping the bucket messages matching condition ($$m), with bounds recomputed"""
+    return [
+        {"$set": {"messages": {"$filter": {"input": "$messages", "as": "m", "cond": condition}}}},
+        {"$set": {
+            "count": {"$size": "$messages"},
+            "start": {"$min": "$messages.ts"},
+            "end": {"$max": "$messages.ts"},
+        }},
+    ]
+
+
+class BucketedMongoDatabase(MongoDatabase):
+    """MongoDatabase that stores messages with the bucket pattern.
+
+    Each message_buckets document holds up to bucket_size compact messages
+    of one user from one UTC day, so user_id, null coordinates and long
+    field names are stored once per bucket instead of once per message and
+    the index has one entry per bucket. Message ids, cursors and every
+    public method behave exactly as with one document per message.
+
+    A user's buckets cover disjoint time ranges, except when two saves race
+    a bucket rollover; page reads take one extra bucket to absorb that.
+    Enable with MESSAGE_STORAGE=buckets; migrate existing data with
+    migrate_messages_to_buckets.py.
+    """
+
+    def __init__(self, hasher=None, bucket_size=None, archive=None):
+        super().__init__(hasher, archive)
+        self.bucket_size = bucket_size or int(os.getenv("MESSAGE_BUCKET_SIZE", "100"))
+        self.buckets = None
+
+    def _init_message_storage(self):
+        super()._init_message_storage()
+        self.buckets = self.db[self.collection_prefix + 'message_buckets']
+
+    def _create_message_indexes(self):
+        self.buckets.create_index(BUCKET_INDEX)
+
+    def _insert_messages(self, docs, retry=False):
+        """Append messages to their day's open bucket, starting new buckets as needed.
+
+        With retry=True messages an earlier attempt already stored are
+        skipped, at the cost of one extra read per bucket.
+        """
+        by_user = {}
+        for doc in sorted(docs, key=lambda doc: (doc["timestamp"], doc["_id"])):
+            by_user.setdefault(doc["user_id"], []).append(compact_message(doc))
+        for user_id, messages in by_user.items():
+            for run in split_buckets(messages, self.bucket_size):
+                self._append(user_id, run, retry)
+
+    def _append(self, user_id, messages, retry=False):
+        day = day_start(messages[0]["ts"])
+        in_day = {"user_id": user_id, "start": {"$gte": day, "$lt": day + timedelta(days=1)}}
+        if retry:
+            ids = [message["i"] for message in messages]
+            stored = {
+                message["i"]
+                for bucket in self.buckets.find({**in_day, "messages.i": {"$in": ids}}, {"messages.i": 1})
+                for message in bucket["messages"]
+            }
+            messages = [message for message in messages if message["i"] not in stored]
+            if not messages:
+                return
+        result = self.buckets.update_one(
+            {**in_day, "count": {"$lte": self.bucket_size - len(messages)}},
+            {
+                "$push": {"messages": {"$each": messages}},
+                "$inc": {"count": len(messages)},
+                "$min": {"start": messages[0]["ts"]},
+                "$max": {"end": messages[-1]["ts"]},
+            }
+        )
+        if not result.modified_count:
+            # No bucket of that day has room left
+            self.buckets.insert_one(new_bucket(user_id, messages))
+
+    def _remove_messages(self, docs):
+        by_user = {}
+        for doc in docs:
+            by_user.setdefault(doc["user_id"], []).append(doc["_id"])
+        for user_id, ids in by_user.items():
+            self.buckets.update_many(
+                {"user_id": user_id, "messages.i": {"$in": ids}},
+                keep_messages({"$not": {"$in": ["$$m.i", ids]}})
+            )
+            self.buckets.delete_many({"user_id": user_id, "count": 0})
+
+    def _find_history_docs(self, user_id, limit, before, after, hidden_before, fields):
+        query = {"user_id": user_id}
+        if after is None:
+            if before is not None:
+                query["start"] = {"$lte": before[0]}
+            sort = [("start", -1)]
+        else:
+            # Start from the bucket holding the after cursor: the last one starting at or before it
+            holder = self.buckets.find_one(
+                {"user_id": user_id, "start": {"$lte": after[0]}}, {"start": 1}, sort=[("start", -1)]
+            )
+            if holder is not None:
+                query["start"] = {"$gte": holder["start"]}
+            sort = [("start", 1)]
+
+        docs = []
+        read_ahead = False
+        cursor = self.buckets.find(query, bucket_projection(fields)).sort(sort).batch_size(
+            limit // self.bucket_size + 2
+        )
+        try:
+            for bucket in cursor:
+                if hidden_before is not None and bucket["end"] < hidden_before[0]:
+                    if after is None:
+                        break  # Everything older is tombstoned too
+                    continue
+                for message in bucket["messages"]:
+                    key = message_key(message)
+                    if hidden_before is not None and key <= hidden_before:
+                        continue
+                    if (before is not None and key >= before) or (after is not None and key <= after):
+                        continue
+                    docs.append(expand_message(user_id, message))
+                if read_ahead:
+                    break
+                read_ahead = len(docs) > limit
+        finally:
+            cursor.close()
+        docs.sort(key=lambda doc: (doc["timestamp"], doc["_id"]), reverse=after is None)
+        return docs[:limit + 1]
+
+    def _iter_message_docs(self, user_id, hidden_before, fields, batch_size):
+        query = {"user_id": user_id}
+        if hidden_before is not None:
+            query["end"] = {"$gte": hidden_before[0]}
+        cursor = self.buckets.find(query, bucket_projection(fields)).sort([("start", 1)]).batch_size(
+            max(1, batch_size // self.bucket_size)
+        )
+        # Buckets that raced a rollover overlap; their messages are sorted together
+        overlapping = []
+        overlap_end = None
+        try:
+            for bucket in cursor:
+                if overlapping and bucket["start"] > overlap_end:
+                    yield from self._expand_sorted(user_id, overlapping, hidden_before)
+                    overlapping = []
+                overlap_end = max(overlap_end, bucket["end"]) if overlapping else bucket["end"]
+                overlapping.extend(bucket["messages"])
+            yield from self._expand_sorted(user_id, overlapping, hidden_before)
+        finally:
+            cursor.close()
+
+    @staticmethod
+    def _expand_sorted(user_id, messages, hidden_before):
+        for message in sorted(messages, key=message_key):
+            if hidden_before is None or message_key(message) > hidden_before:
+                yield expand_message(user_id, message)
+
+    def _count_stored_messages(self, user_id, hidden_before, exclude_ids):
+        match = {"messages.i": {"$nin": exclude_ids}}
+        if hidden_before is not None:
+            timestamp, oid = hidden_before
+            match["messages.ts"] = {"$gte": timestamp}
+            match["$nor"] = [{"messages.ts": timestamp, "messages.i": {"$lte": oid}}]
+        result = list(self.buckets.aggregate([
+            {"$match": {"user_id": user_id}},
+            {"$unwind": "$messages"},
+            {"$match": match},
+            {"$count": "count"},
+        ]))
+        return result[0]["count"] if result else 0
+
+    def _oldest_message_timestamp(self, user_id):
+        bucket = self.buckets.find_one({"user_id": user_id}, {"start": 1}, sort=[("start", 1)])
+        return bucket["start"] if bucket is not None else None
+
+    def _newest_stored_key(self, user_id):
+        newest = self.buckets.find_one({"user_id": user_id}, {"end": 1}, sort=[("end", -1)])
+        if newest is None:
+            return None
+        # Buckets that raced a rollover can share their end
+        tied = self.buckets.find({"user_id": user_id, "end": newest["end"]}, {"messages.ts": 1, "messages.i": 1})
+        return max(message_key(message) for bucket in tied for message in bucket["messages"])
+
+    def _delete_message_batch(self, job, batch_size):
+        """Delete whole buckets up to the job's bound, then trim the ones straddling it"""
+        buckets = self.buckets.with_options(write_concern=WriteConcern(w="majority"))
+        bound = deletion_bound(job)
+        query = {"user_id": job["user_id"]}
+        if bound is not None:
+            timestamp, oid = bound
+            query["start"] = {"$lte": timestamp}
+        full = list(
+            self.buckets.find({**query, "end": {"$lt": timestamp}} if bound is not None else query, {"count": 1})
+            .sort([("start", 1)]).limit(max(1, batch_size // self.bucket_size))
+        )
+        if full:
+            buckets.delete_many({"_id": {"$in": [bucket["_id"] for bucket in full]}})
+            return sum(bucket["count"] for bucket in full)
+        if bound is None:
+            return None
+        straddling = list(self.buckets.find({**query, "end": {"$gte": timestamp}}, {"count": 1}))
+        if not straddling:
+            return None
+        ids = [bucket["_id"] for bucket in straddling]
+        buckets.update_many({"_id": {"$in": ids}}, keep_messages({"$or": [
+            {"$gt": ["$$m.ts", timestamp]},
+            {"$and": [{"$eq": ["$$m.ts", timestamp]}, {"$gt": ["$$m.i", oid]}]},
+        ]}))
+        # The bound is usually a bucket's newest message, which empties it
+        buckets.delete_many({"user_id": job["user_id"], "count": 0})
+        remaining = sum(bucket["count"] for bucket in self.buckets.find({"_id": {"$in": ids}}, {"count": 1}))
+        # A bucket starting at the bound's millisecond still matches once
+        # trimmed; nothing removed means nothing is left
+        return sum(bucket["count"] for bucket in straddling) - remaining or None
@@ -0,0 +1,121 @@
+"""
+Generate the bundled district boundaries (data/tn_districts.geojson) from
+the town gazetteer.
+
+The boundaries are approximate: every gazetteer town gets the part of a
+coarse Tamil Nadu outline that is closer to it than to any other town (a
+Voronoi cell, measured on a locally equirectangular plane), and a
+district is the MultiPolygon of its towns' cells. Accuracy therefore
+follows gazetteer density; near district borders a point can land in
+the neighbouring district. Official boundaries in the same shape (a
+FeatureCollection of Polygon or MultiPolygon features with a "district"
+property, [longitude, latitude] coordinates) can replace the file as is.
+
+Usage:
+    python build_district_boundaries.py
+    python build_district_boundaries.py --towns data/tn_towns.json --output data/tn_districts.geojson
+"""
+import argparse
+import json
+import math
+import os
+
+from reverse_geocoder import DEFAULT_DISTRICTS_PATH, DEFAULT_TOWNS_PATH, load_towns
+
+# Coarse state outline as (latitude, longitude), clockwise from the
+# northern end of the coast: east coast, Rameswaram island, Gulf of
+# Mannar, then the Kerala, Karnataka and Andhra Pradesh borders back
+# north. The coast is drawn a few kilometres offshore so shoreline sites
+# (Kanyakumari, Dhanushkodi, Poompuhar) fall inside
+TN_OUTLINE = [
+    (13.56, 80.36), (13.10, 80.33), (12.62, 80.25), (12.20, 80.01), (11.75, 79.84),
+    (11.45, 79.83), (11.03, 79.91), (10.77, 79.90), (10.28, 79.90), (10.28, 79.45),
+    (10.00, 79.25), (9.70, 79.02), (9.48, 78.95), (9.34, 79.10), (9.34, 79.32),
+    (9.22, 79.47), (9.12, 79.47), (9.20, 79.20), (9.18, 78.78), (9.08, 78.45),
+    (8.74, 78.22), (8.45, 78.15), (8.33, 78.08), (8.03, 77.55), (8.12, 77.22),
+    (8.25, 77.10), (8.50, 77.18), (8.85, 77.18), (9.00, 77.20), (9.40, 77.30),
+    (9.62, 77.18), (10.00, 77.22), (10.20, 77.25), (10.25, 76.85), (10.55, 76.80),
+    (10.84, 76.84), (11.10, 76.72), (11.25, 76.50), (11.45, 76.25), (11.60, 76.27),
+    (11.65, 76.45), (11.60, 76.75), (11.85, 76.95), (11.95, 77.20), (11.85, 77.45),
+    (11.95, 77.70), (12.12, 77.78), (12.30, 77.50), (12.60, 77.60), (12.80, 77.78),
+    (12.85, 78.05), (12.80, 78.30), (13.00, 78.75), (13.08, 79.05), (13.15, 79.35),
+    (13.28, 79.55), (13.35, 79.80), (13.50, 80.00),
+]
+
+# Longitudes are scaled by the cosine of the state's mean latitude so
+# distances on the plane are close to ground distances
+LON_SCALE = math.cos(math.radians(11.0))
+
+
+def clip(polygon, point, other):
+    """Part of polygon closer to point than to other (Sutherland-Hodgman against their bisector)"""
+    nx, ny = other[0] - point[0], other[1] - point[1]
+    limit = (nx * (point[0] + other[0]) + ny * (point[1] + other[1])) / 2
+
+    def inside(p):
+        return nx * p[0] + ny * p[1] <= limit
+
+    def crossing(a, b):
+        da = nx * a[0] + ny * a[1] - limit
+        db = nx * b[0] + ny * b[1] - limit
+        t = da / (da - db)
+        return (a[0] + t * (b[0] - a[0]), a[1] + t * (b[1] - a[1]))
+
+    clipped = []
+    for i, current in enumerate(polygon):
+        previous = polygon[i - 1]
+        if inside(current):
+            if not inside(previous):
+                clipped.append(crossing(previous, current))
+            clipped.append(current)
+        elif inside(previous):
+            clipped.append(crossing(previous, current))
+    return clipped
+
+
+def town_cells(towns, outline):
+    """Voronoi cell of every town within the outline, in plane coordinates"""
+    points = [(town["longitude"] * LON_SCALE, town["latitude"]) for town in towns]
+    plane_outline = [(lon * LON_SCALE, lat) for lat, lon in outline]
+    cells = []
+    for i, point in enumerate(points):
+        cell = plane_outline
+        # Nearest towns first: the cell shrinks fast and later clips are cheap
+        for j in sorted(range(len(points)), key=lambda j: math.dist(point, points[j])):
+            if j != i and cell:
+                cell = clip(cell, point, points[j])
+        cells.append(cell)
+    return cells
+
+
+def district_features(towns, cells):
+    by_district = {}
+    for town, cell in zip(towns, cells):
+        if len(cell) >= 3:
+            ring = [[round(x / LON_SCALE, 4), round(y, 4)] for x, y in cell]
+            by_district.setdefault(town["district"], []).append([ring + [ring[0]]])
+    return [
+        {
+            "type": "Feature",
+            "properties": {"district": district, "source": "gazetteer-voronoi"},
+            "geometry": {"type": "MultiPolygon", "coordinates": polygons},
+        }
+        for district, polygons in sorted(by_district.items())
+    ]
+
+
+def main(args):
+    towns = load_towns(args.towns)
+    features = district_features(towns, town_cells(towns, TN_OUTLINE))
+    with open(args.output, "w", encoding="utf-8") as f:
+        json.dump({"type": "FeatureCollection", "features": features}, f, separators=(",", ":"))
+    parts = sum(len(feature["geometry"]["coordinates"]) for feature in features)
+    print(f"Wrote {len(features)} districts ({parts} polygons from {len(towns)} towns) "
+          f"to {args.output}, {os.path.getsize(args.output) / 1e3:.0f} KB")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--towns", default=DEFAULT_TOWNS_PATH)
+    parser.add_argument("--output", default=DEFAULT_DISTRICTS_PATH)
+    main(parser.parse_args())
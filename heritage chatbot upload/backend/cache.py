@@ -0,0 +1,224 @@
+import os
+import re
+import threading
+import time
+from collections import OrderedDict
+
+
+class LRUTTLCache:
+    """Thread-safe LRU cache with per-entry TTL and a total size budget.
+
+    Entries are evicted when they expire, when the cache holds more than
+    max_entries items, or when the summed entry sizes exceed max_bytes.
+    """
+
+    def __init__(self, max_entries=1024, ttl_seconds=3600, max_bytes=None):
+        self.max_entries = max_entries
+        self.ttl_seconds = ttl_seconds
+        self.max_bytes = max_bytes
+        self._entries = OrderedDict()  # key -> (expires_at, size, value)
+        self._bytes = 0
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.expirations = 0
+
+    def get(self, key):
+        """Return the cached value or None, refreshing its LRU position"""
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                self.misses += 1
+                return None
+            expires_at, size, value = entry
+            if expires_at <= time.monotonic():
+                self._remove(key)
+                self.expirations += 1
+                self.misses += 1
+                return None
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return value
+
+    def peek(self, key):
+        """Return the cached value or None without counting a lookup or refreshing it"""
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None or entry[0] <= time.monotonic():
+                return None
+            return entry[2]
+
+    def set(self, key, value, size=1):
+        """Insert or replace an entry and evict until within bounds"""
+        with self._lock:
+            if key in self._entries:
+                self._remove(key)
+            if self.max_bytes is not None and size > self.max_bytes:
+                return False
+            self._entries[key] = (time.monotonic() + self.ttl_seconds, size, value)
+            self._bytes += size
+            while len(self._entries) > self.max_entries or (
+                self.max_bytes is not None and self._bytes > self.max_bytes
+            ):
+                oldest = next(iter(self._entries))
+                self._remove(oldest)
+                self.evictions += 1
+            return True
+
+    def pop(self, key):
+        """Remove an entry if present"""
+        with self._lock:
+            if key in self._entries:
+                self._remove(key)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self._bytes = 0
+
+    def _remove(self, key):
+        _, size, _ = self._entries.pop(key)
+        self._bytes -= size
+
+    def __len__(self):
+        return len(self._entries)
+
+    def stats(self):
+        """Hit/miss/eviction counters and current usage"""
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                "entries": len(self._entries),
+                "bytes": self._bytes,
+                "max_entries": self.max_entries,
+                "max_bytes": self.max_bytes,
+                "ttl_seconds": self.ttl_seconds,
+                "hits": self.hits,
+                "misses": self.misses,
+                "hit_rate": round(self.hits / lookups, 4) if lookups else 0.0,
+                "evictions": self.evictions,
+                "expirations": self.expirations,
+            }
+
+
+_PUNCTUATION = re.compile(r"[^\w\s]", re.UNICODE)
+_WHITESPACE = re.compile(r"\s+")
+
+
+def normalize_message(message):
+    """Lowercase, drop punctuation and collapse whitespace"""
+    message = _PUNCTUATION.sub(" ", message.lower())
+    return _WHITESPACE.sub(" ", message).strip()
+
+
+def location_bucket(latitude, longitude, precision):
+    """Snap coordinates to a coarse grid cell (precision in degrees)"""
+    if latitude is None or longitude is None:
+        return None
+    return (
+        round(round(latitude / precision) * precision, 6),
+        round(round(longitude / precision) * precision, 6),
+    )
+
+
+class ResponseCache:
+    """Cache of completed /chat generations.
+
+    Keys combine the normalized user message, the response language, a
+    coarse location bucket and the prompt profile and output format the
+    message was routed to. Values are the tuple of streamed text chunks, so
+    a hit can be replayed as the same sequence of SSE events. Only prompts
+    without conversation context are cached: a follow-up means something
+    different in every conversation. A key of None is never cached.
+    """
+
+    def __init__(self, max_entries=None, ttl_seconds=None, max_bytes=None, location_precision=None):
+        self.enabled = os.getenv("RESPONSE_CACHE_ENABLED", "true").lower() == "true"
+        self.location_precision = location_precision or float(
+            os.getenv("RESPONSE_CACHE_LOCATION_PRECISION", "0.1")
+        )
+        self._cache = LRUTTLCache(
+            max_entries=max_entries or int(os.getenv("RESPONSE_CACHE_MAX_ENTRIES", "1024")),
+            ttl_seconds=ttl_seconds or float(os.getenv("RESPONSE_CACHE_TTL_SECONDS", "3600")),
+            max_bytes=max_bytes or int(os.getenv("RESPONSE_CACHE_MAX_BYTES", str(32 * 1024 * 1024))),
+        )
+
+    def make_key(self, message, language, latitude=None, longitude=None, profile=None, structured=False):
+        return (
+            normalize_message(message),
+            language,
+            location_bucket(latitude, longitude, self.location_precision),
+            # Normalizing drops the "?" routing looks at, so "worth it?" and
+            # "worth it" can get different profiles under the same text
+            profile,
+            structured,
+        )
+
+    def get(self, key):
+        """Return the cached chunks for a key, or None"""
+        if not self.enabled or key is None:
+            return None
+        return self._cache.get(key)
+
+    def put(self, key, chunks):
+        """Store the chunks of a completed generation"""
+        if not self.enabled or key is None or not chunks:
+            return
+        chunks = tuple(chunks)
+        size = sum(len(chunk.encode("utf-8")) for chunk in chunks)
+        self._cache.set(key, chunks, size=size)
+
+    def stats(self):
+        stats = self._cache.stats()
+        stats["enabled"] = self.enabled
+        return stats
+
+
+class HistoryVersionCache:
+    """Per-user chat history versions remembered in-process.
+
+    Lets /chat/history answer If-None-Match without a database query. This
+    process invalidates a user's entry whenever it saves, clears or deletes
+    their messages; writes made by other replicas are picked up once the
+    entry expires after ttl_seconds, which bounds how stale a 304 can be.
+
+    Reads follow begin() / store(): a version fetched from the database is
+    only stored if the user was not invalidated in the meantime, so a
+    lookup racing a write cannot cache the old version.
+    """
+
+    def __init__(self, max_entries=None, ttl_seconds=None):
+        self.enabled = os.getenv("HISTORY_VERSION_CACHE_ENABLED", "true").lower() == "true"
+        self._cache = LRUTTLCache(
+            max_entries=max_entries or int(os.getenv("HISTORY_VERSION_CACHE_MAX_ENTRIES", "100000")),
+            ttl_seconds=ttl_seconds or float(os.getenv("HISTORY_VERSION_CACHE_TTL_SECONDS", "10")),
+        )
+        self._lock = threading.Lock()
+        self._generation = 0
+
+    def begin(self, user_id):
+        """(version or None, generation) for a lookup"""
+        entry = self._cache.get(user_id) if self.enabled else None
+        if entry is None:
+            return None, None
+        return entry
+
+    def store(self, user_id, version, generation):
+        """Remember a version read from the database during the lookup begun at generation"""
+        if not self.enabled:
+            return
+        with self._lock:
+            current = self._cache.peek(user_id)
+            if (current[1] if current is not None else None) == generation:
+                self._cache.set(user_id, (version, generation))
+
+    def invalidate(self, user_id):
+        if not self.enabled:
+            return
+        with self._lock:
+            self._generation += 1
+            self._cache.set(user_id, (None, self._generation))
+
+    def stats(self):
+        return {"enabled": self.enabled, **self._cache.stats()}
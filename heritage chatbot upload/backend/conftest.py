@@ -0,0 +1,85 @@
+"""
+Helpers and fixtures shared by the storage tests, which run on mongomock.
+"""
+from datetime import datetime, timedelta
+from types import SimpleNamespace
+
+import pytest
+from bson import ObjectId
+
+from bucket_storage import BucketedMongoDatabase
+from mongo_database import MongoDatabase, build_message_document
+
+USER = "user-1"
+START = datetime(2024, 1, 1, 22)
+
+
+def history(count, step=timedelta(minutes=5), user_id=USER, start=START):
+    """count messages step apart, alternating user and assistant, crossing midnight"""
+    docs = []
+    for i in range(count):
+        doc = build_message_document(user_id, "user" if i % 2 == 0 else "assistant", f"m{i}",
+                                     12.5 if i % 3 == 0 else None, 79.1 if i % 3 == 0 else None)
+        doc["timestamp"] = start + step * i
+        doc["_id"] = ObjectId()
+        docs.append(doc)
+    return docs
+
+
+def open_database(cls, bucket_size=7, archive=None):
+    """A database of class cls on a fresh mongomock database"""
+    mongomock = pytest.importorskip("mongomock")
+    database = cls(hasher=SimpleNamespace(), archive=archive)
+    if isinstance(database, BucketedMongoDatabase):
+        database.bucket_size = bucket_size
+    database.deletion_config.pause_seconds = 0
+    return database.attach(mongomock.MongoClient().db, "test")
+
+
+def store(database, docs):
+    for doc in docs:
+        database._insert_messages([dict(doc)])
+
+
+def texts(page):
+    return [message["text"] for message in page["messages"]]
+
+
+def walk_back(database, limit):
+    """Every page from the newest backwards"""
+    page = database.get_chat_history_page(USER, limit=limit)
+    pages = [texts(page)]
+    while page["has_more"]:
+        page = database.get_chat_history_page(USER, limit=limit, before=page["before_cursor"])
+        pages.append(texts(page))
+    return pages
+
+
+def walk_forward(database, after, limit):
+    """Every page after the cursor, oldest first"""
+    pages = []
+    while True:
+        page = database.get_chat_history_page(USER, limit=limit, after=after)
+        if not page["messages"]:
+            return pages
+        pages.append(texts(page))
+        after = page["after_cursor"]
+
+
+def oldest_first(pages):
+    """Texts of walk_back pages in the order they were sent"""
+    return [text for page in reversed(pages) for text in page]
+
+
+def exported(database, **kwargs):
+    return [message["text"] for message in database.iter_chat_history(USER, **kwargs)]
+
+
+@pytest.fixture(params=[MongoDatabase, BucketedMongoDatabase], ids=["documents", "buckets"])
+def database_class(request):
+    return request.param
+
+
+@pytest.fixture
+def database(database_class):
+    return open_database(database_class)
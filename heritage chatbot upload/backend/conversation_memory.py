@@ -0,0 +1,195 @@
+import os
+import re
+from collections import deque
+
+from cache import LRUTTLCache
+
+_MARKDOWN = re.compile(r"[#*_`>|\[\]]+")
+_SENTENCE_END = re.compile(r"(?<=[.!?।])\s")
+
+
+def estimate_tokens(text):
+    """Cheap token estimate without a tokenizer.
+
+    About four ASCII characters per token; Tamil and Devanagari characters
+    are counted as a token each, which is close for Llama-family tokenizers.
+    """
+    if not text:
+        return 0
+    ascii_chars = sum(1 for char in text if char < "\x80")
+    return (ascii_chars + 3) // 4 + (len(text) - ascii_chars)
+
+
+def truncate_to_tokens(text, max_tokens):
+    """Cut text so estimate_tokens(text) stays within max_tokens"""
+    if estimate_tokens(text) <= max_tokens:
+        return text
+    # No token covers more than four characters, so nothing past this can fit
+    low, high = 0, min(len(text), max_tokens * 4)
+    while low < high:
+        middle = (low + high + 1) // 2
+        if estimate_tokens(text[:middle]) + 1 <= max_tokens:
+            low = middle
+        else:
+            high = middle - 1
+    return text[:low].rstrip() + "…"
+
+
+def gist(role, text, max_words):
+    """One summary line for a turn leaving the recent window"""
+    lines = [
+        _MARKDOWN.sub("", line).strip()
+        for line in text.splitlines()
+        # Section headings repeat in every answer and carry no context
+        if line.strip() and not line.lstrip().startswith("#")
+    ]
+    flattened = " ".join(line for line in lines if line)
+    if role == "user":
+        flattened = _SENTENCE_END.split(flattened, 1)[0]
+    words = flattened.split()
+    snippet = " ".join(words[:max_words]) + (" …" if len(words) > max_words else "")
+    return f"{'User asked' if role == 'user' else 'Assistant answered'}: {snippet}"
+
+
+class Conversation:
+    """Rolling summary lines plus the most recent turns of one user"""
+
+    __slots__ = ("summary", "summary_tokens", "turns", "turn_tokens", "version")
+
+    def __init__(self, version=None):
+        self.version = version  # History version the turns reflect; None if unknown
+        self.summary = deque()
+        self.summary_tokens = 0
+        self.turns = deque()  # (role, text, tokens)
+        self.turn_tokens = 0
+
+
+class ConversationMemory:
+    """Bounded per-user conversation context for /chat prompts.
+
+    Each user keeps the last max_turns messages verbatim (each capped at
+    message_tokens) and a rolling summary of older ones. A message leaving
+    the recent window is folded into the summary as one extractive line;
+    the oldest summary lines are dropped once summary_tokens is exceeded.
+    Together the context never exceeds token_budget, no matter how long
+    the history is.
+
+    Updates are incremental as turns are saved. Conversations live in an
+    LRU cache; a user who is not cached is rebuilt once from their most
+    recent warm_messages messages. Each conversation remembers the history
+    version (see HistoryVersionCache) it reflects and is only used while
+    that is still the user's version, so a clear or a message saved by
+    another replica makes the next request rebuild it from storage.
+    """
+
+    def __init__(self, max_turns=None, token_budget=None, summary_tokens=None, message_tokens=None,
+                 warm_messages=None, max_users=None, ttl_seconds=None, enabled=None):
+        self.enabled = enabled if enabled is not None else (
+            os.getenv("MEMORY_ENABLED", "true").lower() == "true"
+        )
+        self.max_turns = max_turns or int(os.getenv("MEMORY_RECENT_TURNS", "6"))
+        self.token_budget = token_budget or int(os.getenv("MEMORY_TOKEN_BUDGET", "1200"))
+        self.summary_budget = min(
+            summary_tokens or int(os.getenv("MEMORY_SUMMARY_TOKENS", "300")), self.token_budget // 2
+        )
+        self.message_tokens = min(
+            message_tokens or int(os.getenv("MEMORY_MESSAGE_TOKENS", "300")),
+            self.token_budget - self.summary_budget
+        )
+        self.warm_messages = warm_messages or int(os.getenv("MEMORY_WARM_MESSAGES", "20"))
+        self.gist_words = 30
+        self._conversations = LRUTTLCache(
+            max_entries=max_users or int(os.getenv("MEMORY_MAX_USERS", "10000")),
+            ttl_seconds=ttl_seconds or float(os.getenv("MEMORY_TTL_SECONDS", "3600")),
+        )
+        self.loads = 0
+        self.stale = 0
+        self.folded = 0
+
+    def get(self, user_id, version):
+        """Cached conversation for user_id at history version, or None if it has to be loaded"""
+        conversation = self._conversations.get(user_id)
+        if conversation is None:
+            return None
+        if conversation.version != version:
+            self.stale += 1
+            return None
+        return conversation
+
+    def holds(self, user_id):
+        """True if user_id has a cached conversation for record() to update"""
+        return self._conversations.peek(user_id) is not None
+
+    def load(self, user_id, messages, version=None):
+        """Rebuild a user's conversation from stored messages (oldest first) at history version"""
+        conversation = Conversation(version)
+        for message in messages[-self.warm_messages:]:
+            self._append(conversation, message.get("type"), message.get("text") or "")
+        self._conversations.set(user_id, conversation)
+        self.loads += 1
+        return conversation
+
+    def record(self, user_id, role, text, version=None):
+        """Add a saved message to the user's conversation if it is cached.
+
+        version is the user's history version read after the save; without
+        one the conversation is revalidated (and rebuilt) on its next use.
+        An uncached user is rebuilt from storage on their next request, which
+        already includes this message.
+        """
+        if not self.enabled:
+            return
+        conversation = self._conversations.get(user_id)
+        if conversation is not None:
+            self._append(conversation, role, text)
+            conversation.version = version
+
+    def forget(self, user_id):
+        self._conversations.pop(user_id)
+
+    def _append(self, conversation, role, text):
+        if not text:
+            return
+        text = truncate_to_tokens(text, self.message_tokens)
+        tokens = estimate_tokens(text)
+        conversation.turns.append((role, text, tokens))
+        conversation.turn_tokens += tokens
+        recent_budget = self.token_budget - self.summary_budget
+        while conversation.turns and (
+            len(conversation.turns) > self.max_turns or conversation.turn_tokens > recent_budget
+        ):
+            old_role, old_text, old_tokens = conversation.turns.popleft()
+            conversation.turn_tokens -= old_tokens
+            self._fold(conversation, old_role, old_text)
+
+    def _fold(self, conversation, role, text):
+        line = gist(role, text, self.gist_words)
+        tokens = estimate_tokens(line) + 1
+        conversation.summary.append((line, tokens))
+        conversation.summary_tokens += tokens
+        while conversation.summary_tokens > self.summary_budget:
+            _, dropped = conversation.summary.popleft()
+            conversation.summary_tokens -= dropped
+        self.folded += 1
+
+    def context(self, conversation):
+        """Summary lines and recent (role, text) turns for heritage_prompt"""
+        if conversation is None or not (conversation.summary or conversation.turns):
+            return None
+        return {
+            "summary": [line for line, _ in conversation.summary],
+            "turns": [(role, text) for role, text, _ in conversation.turns],
+            "tokens": conversation.summary_tokens + conversation.turn_tokens,
+        }
+
+    def stats(self):
+        stats = self._conversations.stats()
+        stats.update({
+            "enabled": self.enabled,
+            "token_budget": self.token_budget,
+            "max_turns": self.max_turns,
+            "loads": self.loads,
+            "stale": self.stale,
+            "folded": self.folded,
+        })
+        return stats
@@ -0,0 +1,209 @@
+import os
+from datetime import datetime, timedelta
+
+from bson import ObjectId
+
+from metrics import registry
+
+# Kinds of background deletion
+CLEAR_HISTORY = "clear_history"
+DELETE_ACCOUNT = "delete_account"
+
+# Batches are taken oldest first along the history index
+BATCH_SORT = [("timestamp", 1), ("_id", 1)]
+
+# Index for claiming the next runnable job
+JOBS_INDEX = [("status", 1), ("lease_until", 1)]
+
+# Runnable jobs are claimed oldest first
+CLAIM_SORT = [("created_at", 1)]
+
+# Tombstones written before cutoffs carried an _id covered every message
+# of their cutoff millisecond
+MAX_OBJECT_ID = ObjectId("f" * 24)
+
+DELETED_MESSAGES = registry.counter(
+    "deletion_job_messages_total", "Messages removed by background deletion jobs", labels=("kind",)
+)
+DELETION_BATCH_SECONDS = registry.histogram(
+    "deletion_job_batch_seconds", "Time to find and delete one batch of messages"
+)
+
+
+class DeletionJobConfig:
+    """Batch size, throttling and lease settings for background deletions.
+
+    Each batch deletes at most batch_size messages by _id and is followed
+    by a pause_seconds sleep, so a heavy user's history is removed as a
+    trickle of small deletes instead of one long delete_many. A running
+    job holds a lease_seconds lease that every batch renews; a job whose
+    lease ran out (its worker died) is picked up again by any worker.
+    """
+
+    def __init__(self, batch_size=None, pause_ms=None, lease_seconds=None, poll_seconds=None, max_attempts=None):
+        self.batch_size = batch_size or int(os.getenv("DELETE_BATCH_SIZE", "500"))
+        pause_ms = pause_ms if pause_ms is not None else float(os.getenv("DELETE_BATCH_PAUSE_MS", "100"))
+        self.pause_seconds = pause_ms / 1000
+        self.lease_seconds = lease_seconds or float(os.getenv("DELETE_JOB_LEASE_SECONDS", "60"))
+        self.poll_seconds = poll_seconds or float(os.getenv("DELETE_JOB_POLL_SECONDS", "10"))
+        self.max_attempts = max_attempts or int(os.getenv("DELETE_JOB_MAX_ATTEMPTS", "5"))
+
+
+def utc_now():
+    """Current UTC time truncated to milliseconds, like stored timestamps"""
+    now = datetime.utcnow()
+    return now.replace(microsecond=now.microsecond // 1000 * 1000)
+
+
+def new_deletion_job(user_id, kind, total=None, through=None):
+    """Job document for deleting the messages user_id has stored now.
+
+    through is the (timestamp, _id) key of the user's newest stored
+    message (None: nothing is stored). It doubles as the tombstone: reads
+    hide the user's messages with keys up to it from the moment the job
+    is created. Taking the bound from stored data rather than this
+    replica's clock keeps a message saved just after the clear, or by a
+    replica whose clock runs ahead, out of the job. The skew left is the
+    other way round: a message saved after the clear by a replica whose
+    clock is behind by more than the time since the newest cleared
+    message sorts before it, and is hidden and deleted with it.
+
+    Account deletions remove every message of the user, whatever the
+    bound, so messages another replica's write-behind queue flushes late
+    go too.
+    """
+    now = utc_now()
+    return {
+        "_id": str(ObjectId()),
+        "user_id": user_id,
+        "kind": kind,
+        "cutoff": through[0] if through is not None else None,
+        "cutoff_id": through[1] if through is not None else None,
+        "status": "pending",
+        "total": total,
+        "deleted": 0,
+        "batches": 0,
+        "attempts": 0,
+        "error": None,
+        "lease_until": now,
+        "created_at": now,
+        "updated_at": now,
+        "finished_at": None,
+    }
+
+
+def plan_deletion(user_id, kind, total=None, through=None):
+    """new_deletion_job as the databases start it: a clear with nothing
+    stored (through is None) is finished as soon as it exists and needs
+    neither a tombstone nor a worker"""
+    job = new_deletion_job(user_id, kind, total, through)
+    if kind == CLEAR_HISTORY and through is None:
+        job.update(finished_update()["$set"])
+    return job
+
+
+def tombstone_update(job):
+    """Upsert for the user's tombstone document (one per user, latest cutoff wins)"""
+    return {"$set": {"cutoff": job["cutoff"], "cutoff_id": job["cutoff_id"], "job_id": job["_id"]}}
+
+
+def cutoff_key(doc):
+    """(timestamp, _id) key a job or tombstone covers messages up to, or None"""
+    if doc is None or doc.get("cutoff") is None:
+        return None
+    return doc["cutoff"], doc.get("cutoff_id") or MAX_OBJECT_ID
+
+
+def deletion_bound(job):
+    """Key of the newest message a job deletes, or None when it deletes all of the user's messages"""
+    if job["kind"] == DELETE_ACCOUNT:
+        return None
+    key = cutoff_key(job)
+    if key is None:
+        raise ValueError(f"Deletion job {job['_id']} has no cutoff")
+    return key
+
+
+def at_or_before(key):
+    """Filter for messages whose (timestamp, _id) key is <= key"""
+    timestamp, oid = key
+    return {"timestamp": {"$lte": timestamp}, "$nor": [{"timestamp": timestamp, "_id": {"$gt": oid}}]}
+
+
+def after_key(key):
+    """Filter for messages whose (timestamp, _id) key is > key"""
+    timestamp, oid = key
+    return {"timestamp": {"$gte": timestamp}, "$nor": [{"timestamp": timestamp, "_id": {"$lte": oid}}]}
+
+
+def claim_filter(now):
+    """Pending jobs, and running jobs whose worker stopped renewing the lease"""
+    return {
+        "$or": [
+            {"status": "pending", "lease_until": {"$lte": now}},
+            {"status": "running", "lease_until": {"$lt": now}},
+        ]
+    }
+
+
+def lease_update(config, now):
+    return {"$set": {"status": "running", "lease_until": now + timedelta(seconds=config.lease_seconds), "updated_at": now}}
+
+
+def batch_filter(job):
+    """The job's messages that are still stored"""
+    query = {"user_id": job["user_id"]}
+    bound = deletion_bound(job)
+    if bound is not None:
+        query.update(at_or_before(bound))
+    return query
+
+
+def progress_update(config, deleted):
+    now = utc_now()
+    return {
+        "$inc": {"deleted": deleted, "batches": 1},
+        "$set": {"lease_until": now + timedelta(seconds=config.lease_seconds), "updated_at": now},
+    }
+
+
+def finished_update():
+    now = utc_now()
+    return {"$set": {"status": "done", "error": None, "updated_at": now, "finished_at": now}}
+
+
+def released_update():
+    """Hand a running job back on shutdown so the next worker resumes it"""
+    return {"$set": {"status": "pending", "lease_until": utc_now()}}
+
+
+def failed_update(config, job, error):
+    """Retry later with exponential backoff, or give up after max_attempts.
+
+    The tombstone stays in place either way, so the data remains hidden.
+    """
+    now = utc_now()
+    attempts = job.get("attempts", 0) + 1
+    if attempts >= config.max_attempts:
+        return {"$set": {"status": "failed", "attempts": attempts, "error": str(error), "updated_at": now}}
+    retry_at = now + timedelta(seconds=config.poll_seconds * 2 ** attempts)
+    return {"$set": {
+        "status": "pending", "attempts": attempts, "error": str(error), "lease_until": retry_at, "updated_at": now,
+    }}
+
+
+def serialize_job(job):
+    """API shape of a deletion job"""
+    finished_at = job.get("finished_at")
+    return {
+        "id": job["_id"],
+        "kind": job["kind"],
+        "status": job["status"],
+        "deleted": job.get("deleted", 0),
+        "total": job.get("total"),
+        "batches": job.get("batches", 0),
+        "attempts": job.get("attempts", 0),
+        "error": job.get("error"),
+        "created_at": job["created_at"].isoformat(),
+        "finished_at": finished_at.isoformat() if finished_at else None,
+    }
@@ -0,0 +1,73 @@
+"""
+Offline routing accuracy of IntentRouter on a labelled message set.
+
+Each line of the evaluation file is {"message", "language", "intent"}
+with the profile the message should get. Prints accuracy overall and per
+language, a confusion matrix, every misrouted message and the classifier's
+cost per message. Exits non-zero when accuracy is below --min-accuracy, so
+it can gate rule changes.
+
+Usage:
+    python eval_intent_routing.py
+    python eval_intent_routing.py --data data/intent_eval.jsonl --min-accuracy 0.9
+"""
+import argparse
+import json
+import os
+import time
+from collections import Counter
+
+from intent import IntentRouter
+
+DEFAULT_DATA = os.path.join(os.path.dirname(__file__), "data", "intent_eval.jsonl")
+
+
+def load_examples(path):
+    with open(path, encoding="utf-8") as f:
+        return [json.loads(line) for line in f if line.strip()]
+
+
+def main(args):
+    router = IntentRouter(enabled=True)
+    examples = load_examples(args.data)
+    profiles = list(router.profiles)
+    confusion = Counter()
+    correct_by_language = Counter()
+    total_by_language = Counter()
+    misrouted = []
+    for example in examples:
+        predicted = router.classify(example["message"])
+        confusion[example["intent"], predicted] += 1
+        total_by_language[example["language"]] += 1
+        if predicted == example["intent"]:
+            correct_by_language[example["language"]] += 1
+        else:
+            misrouted.append((example, predicted))
+
+    started = time.perf_counter()
+    for _ in range(args.repeat):
+        for example in examples:
+            router.classify(example["message"])
+    per_message_us = (time.perf_counter() - started) / (args.repeat * len(examples)) * 1e6
+
+    accuracy = sum(correct_by_language.values()) / len(examples)
+    print(f"{len(examples)} messages, accuracy {accuracy:.1%}, {per_message_us:.1f} µs per message")
+    for language in sorted(total_by_language):
+        print(f"  {language}: {correct_by_language[language]}/{total_by_language[language]}")
+    print("\n" + f"{'expected / routed':<20}" + "".join(f"{name:>12}" for name in profiles))
+    for expected in profiles:
+        print(f"{expected:<20}" + "".join(f"{confusion[expected, routed]:>12}" for routed in profiles))
+    if misrouted:
+        print("\nmisrouted:")
+        for example, predicted in misrouted:
+            print(f"  [{example['language']}] {example['intent']} -> {predicted}: {example['message']}")
+    if accuracy < args.min_accuracy:
+        raise SystemExit(f"accuracy {accuracy:.1%} is below {args.min_accuracy:.0%}")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--data", default=DEFAULT_DATA)
+    parser.add_argument("--min-accuracy", type=float, default=0.9)
+    parser.add_argument("--repeat", type=int, default=200, help="passes over the set when timing")
+    main(parser.parse_args())
@@ -0,0 +1,81 @@
+import json
+import os
+import zlib
+from contextlib import aclosing, closing
+
+# ?format= value -> response media type
+EXPORT_FORMATS = {
+    "ndjson": "application/x-ndjson",
+    "ndjson.gz": "application/gzip",
+}
+
+
+class NDJSONEncoder:
+    """Incremental NDJSON writer for history exports, optionally gzipped.
+
+    Lines are buffered up to chunk_bytes before being handed out, so a large
+    export goes out in a few big writes rather than one per message, and
+    the gzip stream is compressed chunk by chunk instead of all at the end.
+    """
+
+    def __init__(self, compress=False, chunk_bytes=None, level=None):
+        self.chunk_bytes = chunk_bytes or int(os.getenv("EXPORT_CHUNK_BYTES", "65536"))
+        self._compressor = None
+        if compress:
+            level = level if level is not None else int(os.getenv("EXPORT_GZIP_LEVEL", "6"))
+            # wbits 16 + 15: deflate with a gzip header and trailer
+            self._compressor = zlib.compressobj(level, zlib.DEFLATED, 16 + zlib.MAX_WBITS)
+        self._lines = []
+        self._buffered = 0
+        self.messages = 0
+
+    def write(self, message):
+        """Add one message. Returns the bytes ready to send, possibly b""."""
+        line = json.dumps(message, ensure_ascii=False, separators=(",", ":")).encode() + b"\n"
+        self._lines.append(line)
+        self._buffered += len(line)
+        self.messages += 1
+        if self._buffered >= self.chunk_bytes:
+            return self._drain()
+        return b""
+
+    def _drain(self):
+        data = b"".join(self._lines)
+        self._lines = []
+        self._buffered = 0
+        if self._compressor is not None:
+            return self._compressor.compress(data)
+        return data
+
+    def close(self):
+        """Remaining bytes, including the gzip trailer"""
+        data = self._drain()
+        if self._compressor is not None:
+            data += self._compressor.flush()
+        return data
+
+
+def ndjson_chunks(messages, compress=False, chunk_bytes=None):
+    """Encode a blocking iterator of messages into NDJSON body chunks"""
+    encoder = NDJSONEncoder(compress, chunk_bytes)
+    with closing(messages):
+        for message in messages:
+            chunk = encoder.write(message)
+            if chunk:
+                yield chunk
+    chunk = encoder.close()
+    if chunk:
+        yield chunk
+
+
+async def ndjson_chunks_async(messages, compress=False, chunk_bytes=None):
+    """Encode an async iterator of messages into NDJSON body chunks"""
+    encoder = NDJSONEncoder(compress, chunk_bytes)
+    async with aclosing(messages):
+        async for message in messages:
+            chunk = encoder.write(message)
+            if chunk:
+                yield chunk
+    chunk = encoder.close()
+    if chunk:
+        yield chunk
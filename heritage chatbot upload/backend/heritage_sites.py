@@ -0,0 +1,191 @@
+import heapq
+import json
+import math
+import os
+from urllib.parse import quote_plus
+
+EARTH_RADIUS_KM = 6371.0088
+KM_PER_DEGREE_LAT = 111.195
+
+DEFAULT_SITES_PATH = os.path.join(os.path.dirname(__file__), "data", "heritage_sites.json")
+
+
+def haversine_km(lat1, lon1, lat2, lon2):
+    """Great-circle distance between two points in kilometres"""
+    phi1 = math.radians(lat1)
+    phi2 = math.radians(lat2)
+    dphi = phi2 - phi1
+    dlambda = math.radians(lon2 - lon1)
+    a = math.sin(dphi / 2) ** 2 + math.cos(phi1) * math.cos(phi2) * math.sin(dlambda / 2) ** 2
+    return 2 * EARTH_RADIUS_KM * math.asin(math.sqrt(a))
+
+
+def maps_link(latitude, longitude):
+    """Google Maps link for a coordinate"""
+    return f"https://www.google.com/maps/search/?api=1&query={latitude:.5f},{longitude:.5f}"
+
+
+def maps_search_link(query):
+    """Google Maps search link for a place name"""
+    return f"https://www.google.com/maps/search/?api=1&query={quote_plus(query)}"
+
+
+def load_heritage_sites(path=DEFAULT_SITES_PATH):
+    """Load the bundled heritage site dataset"""
+    with open(path, encoding="utf-8") as f:
+        return json.load(f)
+
+
+class HeritageSiteIndex:
+    """In-memory uniform lat/lon grid over heritage sites.
+
+    Sites are bucketed into square cells of cell_degrees (by default sized so
+    a cell holds about SITES_PER_CELL sites). k-nearest queries
+    scan rings of cells outward from the query cell and stop once the ring's
+    minimum possible distance exceeds the current k-th best; radius queries
+    scan only the cells overlapping the radius' bounding box.
+    """
+
+    SITES_PER_CELL = 4
+
+    def __init__(self, sites, cell_degrees=None):
+        self.sites = list(sites)
+        self.cell_degrees = cell_degrees or self._auto_cell_degrees(self.sites)
+        self._by_id = {site["id"]: site for site in self.sites}
+        self._by_name = {site["name"].casefold(): site for site in self.sites}
+        self._cells = {}
+        # Precomputed per-site values reused by every distance computation
+        self._points = []
+        for i, site in enumerate(self.sites):
+            lat, lon = site["latitude"], site["longitude"]
+            self._points.append((math.radians(lat), math.radians(lon), math.cos(math.radians(lat))))
+            self._cells.setdefault(self._cell(lat, lon), []).append(i)
+        if self._cells:
+            rows = [cell[0] for cell in self._cells]
+            cols = [cell[1] for cell in self._cells]
+            self._bounds = (min(rows), max(rows), min(cols), max(cols))
+        else:
+            self._bounds = (0, -1, 0, -1)
+
+    @classmethod
+    def from_file(cls, path=DEFAULT_SITES_PATH, cell_degrees=None):
+        return cls(load_heritage_sites(path), cell_degrees=cell_degrees)
+
+    @classmethod
+    def _auto_cell_degrees(cls, sites):
+        if len(sites) < 2:
+            return 1.0
+        lats = [site["latitude"] for site in sites]
+        lons = [site["longitude"] for site in sites]
+        area = max(max(lats) - min(lats), 0.01) * max(max(lons) - min(lons), 0.01)
+        return min(max(math.sqrt(area * cls.SITES_PER_CELL / len(sites)), 0.005), 1.0)
+
+    def __len__(self):
+        return len(self.sites)
+
+    def get(self, site_id):
+        return self._by_id.get(site_id)
+
+    def find(self, key):
+        """Site by id, or by name ignoring case; None if unknown"""
+        key = key.strip()
+        return self._by_id.get(key) or self._by_name.get(key.casefold())
+
+    def _cell(self, lat, lon):
+        return (math.floor(lat / self.cell_degrees), math.floor(lon / self.cell_degrees))
+
+    def _cell_km(self, latitude):
+        """Smallest side of a cell at the given latitude, in km"""
+        return self.cell_degrees * KM_PER_DEGREE_LAT * max(math.cos(math.radians(min(latitude, 89.9))), 0.01)
+
+    def _distance(self, index, phi, lam, cos_phi):
+        site_phi, site_lam, site_cos = self._points[index]
+        a = math.sin((site_phi - phi) / 2) ** 2 + cos_phi * site_cos * math.sin((site_lam - lam) / 2) ** 2
+        return 2 * EARTH_RADIUS_KM * math.asin(math.sqrt(min(a, 1.0)))
+
+    def _ring(self, row, col, radius):
+        """Cells at Chebyshev distance radius from (row, col)"""
+        if radius == 0:
+            yield (row, col)
+            return
+        for c in range(col - radius, col + radius + 1):
+            yield (row - radius, c)
+            yield (row + radius, c)
+        for r in range(row - radius + 1, row + radius):
+            yield (r, col - radius)
+            yield (r, col + radius)
+
+    def nearest(self, latitude, longitude, k=5, max_distance_km=None):
+        """k nearest sites as (distance_km, site) pairs, closest first"""
+        if not self.sites or k <= 0:
+            return []
+        phi, lam = math.radians(latitude), math.radians(longitude)
+        cos_phi = math.cos(phi)
+        row, col = self._cell(latitude, longitude)
+        min_row, max_row, min_col, max_col = self._bounds
+        max_ring = max(abs(row - min_row), abs(row - max_row), abs(col - min_col), abs(col - max_col))
+
+        best = []  # max-heap of (-distance, index)
+        for radius in range(max_ring + 1):
+            # Every site in this ring is at least radius - 1 cells away; a
+            # cell is narrowest east-west at the ring's furthest latitude
+            ring_km = (radius - 1) * self._cell_km(abs(latitude) + radius * self.cell_degrees)
+            if len(best) == k and ring_km > -best[0][0]:
+                break
+            if max_distance_km is not None and ring_km > max_distance_km:
+                break
+            for cell in self._ring(row, col, radius):
+                for i in self._cells.get(cell, ()):
+                    d = self._distance(i, phi, lam, cos_phi)
+                    if max_distance_km is not None and d > max_distance_km:
+                        continue
+                    if len(best) < k:
+                        heapq.heappush(best, (-d, i))
+                    elif d < -best[0][0]:
+                        heapq.heapreplace(best, (-d, i))
+        return [(-d, self.sites[i]) for d, i in sorted(best, reverse=True)]
+
+    def within_radius(self, latitude, longitude, radius_km):
+        """All sites within radius_km as (distance_km, site) pairs, closest first"""
+        phi, lam = math.radians(latitude), math.radians(longitude)
+        cos_phi = math.cos(phi)
+        dlat = radius_km / KM_PER_DEGREE_LAT
+        dlon = radius_km / (KM_PER_DEGREE_LAT * max(math.cos(math.radians(min(abs(latitude) + dlat, 89.9))), 0.01))
+        min_row, min_col = self._cell(latitude - dlat, longitude - dlon)
+        max_row, max_col = self._cell(latitude + dlat, longitude + dlon)
+        found = []
+        for r in range(min_row, max_row + 1):
+            for c in range(min_col, max_col + 1):
+                for i in self._cells.get((r, c), ()):
+                    d = self._distance(i, phi, lam, cos_phi)
+                    if d <= radius_km:
+                        found.append((d, i))
+        found.sort()
+        return [(d, self.sites[i]) for d, i in found]
+
+
+def plan_route(latitude, longitude, candidates):
+    """Order sites as a greedy nearest-neighbour route from the user.
+
+    candidates are (distance_km, site) pairs. Returns dicts with the distance
+    from the user and the leg distance from the previous stop.
+    """
+    remaining = [site for _, site in candidates]
+    from_user = {site["id"]: distance for distance, site in candidates}
+    route = []
+    lat, lon = latitude, longitude
+    while remaining:
+        legs = [haversine_km(lat, lon, site["latitude"], site["longitude"]) for site in remaining]
+        nearest = min(range(len(remaining)), key=legs.__getitem__)
+        site = remaining.pop(nearest)
+        route.append({
+            "id": site["id"],
+            "name": site["name"],
+            "district": site["district"],
+            "description": site["description"],
+            "distance_from_user_km": round(from_user[site["id"]], 1),
+            "distance_from_previous_km": round(legs[nearest], 1),
+            "maps_link": maps_link(site["latitude"], site["longitude"]),
+        })
+        lat, lon = site["latitude"], site["longitude"]
+    return route
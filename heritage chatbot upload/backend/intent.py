@@ -0,0 +1,138 @@
+import os
+import re
+
+from metrics import registry
+from prompt import heritage_prompt, quick_fact_prompt, smalltalk_prompt
+
+# Prompt profiles, cheapest first
+SMALLTALK = "smalltalk"
+QUICK_FACT = "quick_fact"
+ITINERARY = "itinerary"
+
+PROFILE_REQUESTS = registry.counter("chat_prompt_profile_total", "/chat messages routed to each prompt profile",
+                                    labels=("profile",))
+PROFILE_TTFT = registry.histogram(
+    "chat_prompt_profile_ttft_seconds", "Time from /chat request to the first generated text", labels=("profile",)
+)
+PROFILE_LATENCY = registry.histogram(
+    "chat_prompt_profile_seconds", "Time from /chat request to the end of the generated answer", labels=("profile",)
+)
+PROFILE_OUTPUT_TOKENS = registry.histogram(
+    "chat_prompt_profile_output_tokens", "Estimated tokens per answer sent to the client", labels=("profile",),
+    buckets=(25, 50, 100, 150, 200, 300, 400, 600, 900, 1200)
+)
+
+# English keywords are matched as whole words; Tamil and Hindi ones as
+# substrings, since their vowel signs break \b and words take suffixes
+ITINERARY_WORDS = (
+    r"plan\w*|itinerar\w*|trip|trips|tour|tours|route|routes|day-?wise|days|weekend|"
+    r"places to (?:visit|see)|things to do|what to see|where (?:should|can) (?:i|we) go|"
+    r"visit (?:\w+ )?(?:and|then)|sightseeing|\d+\s*-?\s*days?"
+)
+ITINERARY_STEMS = (
+    "பயணத் திட்ட", "பயண திட்ட", "திட்டம்", "சுற்றுலா", "நாட்கள்", "நாள் பயண", "பார்க்க வேண்டிய இடங்கள்",
+    "यात्रा", "योजना", "घूमने की जगह", "घूमने के लिए", "दिन की", "दिनों", "टूर", "सैर", "कार्यक्रम",
+)
+SMALLTALK_WORDS = (
+    r"hi+|hello+|hey+|hiya|yo|namaste|vanakkam|good (?:morning|afternoon|evening|night)|"
+    r"thanks?|thank you|thx|ty|cheers|bye|goodbye|see you|ok(?:ay)?|cool|great|nice|awesome|"
+    r"how are you|who are you|what are you|what can you do|your name"
+)
+SMALLTALK_STEMS = (
+    "வணக்கம்", "நன்றி", "எப்படி இருக்க", "நீங்கள் யார்", "போய் வருகிறேன்", "சரி",
+    "नमस्ते", "नमस्कार", "धन्यवाद", "शुक्रिया", "कैसे हो", "कैसे हैं", "आप कौन", "अलविदा", "ठीक है",
+)
+QUICK_FACT_WORDS = (
+    r"what|when|who|whom|whose|which|where|why|how (?:much|far|long|old|many|to reach|do i get)|"
+    r"is|are|does|do|can|timings?|open(?:s|ing)?|clos(?:e|es|ing)|tickets?|fees?|entry|cost|price|"
+    r"built|history|distance|dress code|photography|allowed|famous for|tell me about|explain"
+)
+QUICK_FACT_STEMS = (
+    "என்ன", "எப்போது", "யார்", "எங்கே", "எங்கு", "எவ்வளவு", "எத்தனை", "ஏன்", "எப்படி", "நேரம்",
+    "கட்டணம்", "திறக்கும்", "கட்டப்பட்ட", "வரலாறு", "தூரம்", "பற்றி",
+    "क्या", "कब", "कौन", "कहाँ", "कहां", "कितना", "कितनी", "कितने", "क्यों", "कैसे", "समय",
+    "टिकट", "शुल्क", "खुलता", "बना", "इतिहास", "दूरी", "बारे में",
+)
+
+
+def _rule(words, stems):
+    ascii_part = rf"\b(?:{words})\b"
+    stem_part = "|".join(re.escape(stem) for stem in stems)
+    return re.compile(f"{ascii_part}|{stem_part}", re.IGNORECASE)
+
+
+class PromptProfile:
+    """A prompt template plus its output token cap (None: the gateway default)"""
+
+    __slots__ = ("name", "build", "max_tokens")
+
+    def __init__(self, name, build, max_tokens=None):
+        self.name = name
+        self.build = build
+        self.max_tokens = max_tokens
+
+
+class IntentRouter:
+    """Routes /chat messages to a prompt profile with keyword rules.
+
+    Trip-planning wording wins, so "hi, plan 2 days in Madurai" is still
+    an itinerary. Otherwise short greetings and thanks are small talk, and
+    short questions (what/when/how much, timings, fees, history) and bare
+    names of one or two words ("madurai meenakshi") are quick facts.
+    Anything else, including long or unclear messages, gets the
+    full itinerary profile, which is what every message used before.
+    Classifying takes a few microseconds and runs in-process.
+    """
+
+    def __init__(self, enabled=None, smalltalk_max_tokens=None, quick_fact_max_tokens=None,
+                 smalltalk_max_words=None, quick_fact_max_words=None):
+        self.enabled = enabled if enabled is not None else (
+            os.getenv("INTENT_ROUTING", "true").lower() == "true"
+        )
+        self.smalltalk_max_words = smalltalk_max_words or int(os.getenv("SMALLTALK_MAX_WORDS", "8"))
+        self.quick_fact_max_words = quick_fact_max_words or int(os.getenv("QUICK_FACT_MAX_WORDS", "25"))
+        self.profiles = {
+            SMALLTALK: PromptProfile(
+                SMALLTALK, smalltalk_prompt,
+                smalltalk_max_tokens or int(os.getenv("SMALLTALK_MAX_TOKENS", "200"))
+            ),
+            QUICK_FACT: PromptProfile(
+                QUICK_FACT, quick_fact_prompt,
+                quick_fact_max_tokens or int(os.getenv("QUICK_FACT_MAX_TOKENS", "350"))
+            ),
+            ITINERARY: PromptProfile(ITINERARY, heritage_prompt),
+        }
+        self._itinerary = _rule(ITINERARY_WORDS, ITINERARY_STEMS)
+        self._smalltalk = _rule(SMALLTALK_WORDS, SMALLTALK_STEMS)
+        self._quick_fact = _rule(QUICK_FACT_WORDS, QUICK_FACT_STEMS)
+        self.routed = dict.fromkeys(self.profiles, 0)
+
+    def classify(self, message):
+        """Profile name for a message"""
+        text = message.strip()
+        words = len(text.split())
+        if not text or self._itinerary.search(text):
+            return ITINERARY
+        if words <= self.smalltalk_max_words and self._smalltalk.search(text):
+            # "Thanks! When does it open?" is a question, not small talk
+            if not (text.endswith("?") and self._quick_fact.search(self._smalltalk.sub(" ", text))):
+                return SMALLTALK
+        if words <= self.quick_fact_max_words and (text.endswith("?") or self._quick_fact.search(text)):
+            return QUICK_FACT
+        if words <= 2:
+            return QUICK_FACT
+        return ITINERARY
+
+    def route(self, message):
+        """The PromptProfile to answer a message with"""
+        name = self.classify(message) if self.enabled else ITINERARY
+        self.routed[name] += 1
+        PROFILE_REQUESTS.labels(name).inc()
+        return self.profiles[name]
+
+    def stats(self):
+        return {
+            "enabled": self.enabled,
+            "routed": dict(self.routed),
+            "max_tokens": {name: profile.max_tokens for name, profile in self.profiles.items()},
+        }
@@ -0,0 +1,196 @@
+from conversation_memory import estimate_tokens
+from heritage_sites import haversine_km, maps_link, maps_search_link
+from metrics import registry
+from prompt import DAY_PLAN_HEADERS, ESSENTIALS_HEADERS, LANGUAGE_INSTRUCTIONS, STAY_HEADERS, localized
+
+STRUCTURED_OUTPUT_TOKENS = registry.histogram(
+    "chat_structured_output_tokens", "Estimated tokens per structured-mode answer, as generated and as rendered",
+    labels=("stage", "language"), buckets=(50, 100, 200, 300, 400, 600, 900, 1200, 1800, 2700, 4000)
+)
+STRUCTURED_UNKNOWN_SITES = registry.counter(
+    "chat_structured_unknown_sites_total", "S lines naming a site that is not in the dataset"
+)
+
+# Line tags of the compact format (see prompt.structured_prompt)
+DAY, SITE, HOTEL, ESSENTIAL, TEXT = "D", "S", "H", "E", "T"
+TAGS = {DAY, SITE, HOTEL, ESSENTIAL, TEXT}
+
+# Heading that opens the section a tag belongs to
+SECTION_HEADERS = {DAY: DAY_PLAN_HEADERS, SITE: DAY_PLAN_HEADERS, HOTEL: STAY_HEADERS, ESSENTIAL: ESSENTIALS_HEADERS}
+
+DAY_LABELS = {"en": "Day {day}", "ta": "நாள் {day}", "hi": "दिन {day}"}
+FROM_USER = {"en": "{km} km from you", "ta": "உங்களிடமிருந்து {km} கி.மீ", "hi": "आपसे {km} किमी"}
+FROM_PREVIOUS = {
+    "en": "{km} km from previous stop",
+    "ta": "முந்தைய இடத்திலிருந்து {km} கி.மீ",
+    "hi": "पिछले स्थान से {km} किमी",
+}
+MAP_LABELS = {"en": "Map", "ta": "வரைபடம்", "hi": "नक्शा"}
+BEST_PICK = {"en": "⭐ Best pick", "ta": "⭐ சிறந்த தேர்வு", "hi": "⭐ सबसे अच्छा विकल्प"}
+ESSENTIAL_LABELS = {
+    "en": {
+        "time": "Best time to visit", "dress": "Dress code", "food": "Local food",
+        "transport": "Transport options", "duration": "Ideal trip duration",
+    },
+    "ta": {
+        "time": "பார்வையிட சிறந்த நேரம்", "dress": "உடை விதிமுறை", "food": "உள்ளூர் உணவு",
+        "transport": "போக்குவரத்து வசதிகள்", "duration": "சிறந்த பயண காலம்",
+    },
+    "hi": {
+        "time": "घूमने का सबसे अच्छा समय", "dress": "पहनावा", "food": "स्थानीय भोजन",
+        "transport": "परिवहन विकल्प", "duration": "आदर्श यात्रा अवधि",
+    },
+}
+
+
+class ItineraryRenderer:
+    """Turns the compact line format into the localized markdown answer.
+
+    Feed it model deltas as they arrive; every completed line comes back
+    rendered, so the answer still streams. Sites are resolved against the
+    heritage dataset for their name, district, Maps link and the distance
+    from the previous stop (the first one from the user's location, when
+    known). Lines that are not in the compact format are passed through
+    unchanged, as soon as that is clear, so a model that ignores the
+    format still produces a readable answer.
+    """
+
+    def __init__(self, site_index, language="en", origin=None):
+        self.site_index = site_index
+        # Unknown codes render in English; keeping them would also make one
+        # metric series per client-supplied string
+        self.language = language if language in LANGUAGE_INSTRUCTIONS else "en"
+        self.position = origin
+        self.at_origin = origin is not None
+        self.section = None
+        self._generated = []
+        self._rendered = []
+        self._line = ""
+        self._passthrough = False
+
+    @property
+    def model_tokens(self):
+        return estimate_tokens("".join(self._generated))
+
+    @property
+    def rendered_tokens(self):
+        return estimate_tokens("".join(self._rendered))
+
+    def feed(self, text):
+        """Rendered markdown for the lines text completes (may be empty)"""
+        self._generated.append(text)
+        out = []
+        while text:
+            newline = text.find("\n")
+            piece, text = (text, "") if newline < 0 else (text[:newline + 1], text[newline + 1:])
+            if self._passthrough:
+                out.append(piece)
+            else:
+                self._line += piece
+                if newline >= 0:
+                    out.append(self._render_line(self._line))
+                    self._line = ""
+                elif not self._maybe_tagged(self._line):
+                    # Free text: stream it as it comes instead of waiting for the line
+                    out.append(self._line)
+                    self._line = ""
+                    self._passthrough = True
+            if newline >= 0:
+                self._passthrough = False
+        return self._emit("".join(out))
+
+    def close(self):
+        """Render a final line that has no trailing newline"""
+        line, self._line = self._line, ""
+        return self._emit(self._render_line(line) if line else "")
+
+    def _emit(self, rendered):
+        self._rendered.append(rendered)
+        return rendered
+
+    @staticmethod
+    def _maybe_tagged(partial):
+        stripped = partial.lstrip()
+        if len(stripped) < 2:
+            return stripped == "" or stripped in TAGS
+        return stripped[0] in TAGS and stripped[1] == "|"
+
+    def _render_line(self, line):
+        stripped = line.strip()
+        if len(stripped) < 2 or stripped[1] != "|" or stripped[0] not in TAGS:
+            return line
+        tag, *fields = [field.strip() for field in stripped.split("|")]
+        if tag == TEXT:
+            return " | ".join(fields) + "\n"
+        heading = self._heading(SECTION_HEADERS[tag])
+        if tag == DAY:
+            day = fields[0] if fields else ""
+            return heading + f"\n**{localized(DAY_LABELS, self.language).format(day=day)}**\n"
+        if tag == SITE:
+            return heading + self._render_site(fields)
+        if tag == HOTEL:
+            return heading + self._render_hotel(fields)
+        return heading + self._render_essential(fields)
+
+    def _heading(self, headers):
+        """The section heading when a line starts a new section, else nothing"""
+        if headers is self.section:
+            return ""
+        self.section = headers
+        return f"\n{localized(headers, self.language)}\n"
+
+    def _render_site(self, fields):
+        key = fields[0] if fields else ""
+        note = " | ".join(fields[1:])
+        site = self.site_index.find(key) if key else None
+        if site is None:
+            STRUCTURED_UNKNOWN_SITES.inc()
+            # No coordinates: the next stop's distance would be measured from the wrong place
+            self.position = None
+            self.at_origin = False
+            link = maps_search_link(f"{key}, Tamil Nadu")
+            return f"- **{key}**{self._note(note)}\n  - [{localized(MAP_LABELS, self.language)}]({link})\n"
+        details = []
+        if self.position is not None:
+            km = round(haversine_km(*self.position, site["latitude"], site["longitude"]), 1)
+            labels = FROM_USER if self.at_origin else FROM_PREVIOUS
+            details.append(localized(labels, self.language).format(km=km))
+        details.append(
+            f"[{localized(MAP_LABELS, self.language)}]({maps_link(site['latitude'], site['longitude'])})"
+        )
+        self.position = (site["latitude"], site["longitude"])
+        self.at_origin = False
+        return f"- **{site['name']}** ({site['district']}){self._note(note)}\n  - {' · '.join(details)}\n"
+
+    def _render_hotel(self, fields):
+        fields = fields + [""] * (3 - len(fields))
+        name, town, note = fields[0], fields[1], fields[2]
+        best = len(fields) > 3 and fields[3] == "*"
+        place = f"{name}, {town}" if town else name
+        link = maps_search_link(f"{place}, Tamil Nadu")
+        badge = f" {localized(BEST_PICK, self.language)}" if best else ""
+        return f"- **{place}**{badge}{self._note(note)} · [{localized(MAP_LABELS, self.language)}]({link})\n"
+
+    def _render_essential(self, fields):
+        key = fields[0] if fields else ""
+        labels = localized(ESSENTIAL_LABELS, self.language)
+        return f"- **{labels.get(key.lower(), key)}:** {' | '.join(fields[1:])}\n"
+
+    @staticmethod
+    def _note(note):
+        return f" — {note}" if note else ""
+
+
+async def render_stream(deltas, renderer):
+    """Render an async iterator of compact-format deltas into markdown deltas"""
+    try:
+        async for text in deltas:
+            rendered = renderer.feed(text)
+            if rendered:
+                yield rendered
+        rendered = renderer.close()
+        if rendered:
+            yield rendered
+    finally:
+        STRUCTURED_OUTPUT_TOKENS.labels("generated", renderer.language).observe(renderer.model_tokens)
+        STRUCTURED_OUTPUT_TOKENS.labels("rendered", renderer.language).observe(renderer.rendered_tokens)
@@ -0,0 +1,300 @@
+import asyncio
+import hashlib
+import os
+import random
+import threading
+import time
+from contextlib import aclosing
+
+from metrics import registry
+
+LLM_ACTIVE_STREAMS = registry.gauge("llm_active_streams", "Upstream LLM streams currently open")
+LLM_ERRORS = registry.counter(
+    "llm_errors_total", "LLM failures by provider and stage (retried, open_failed, stream_failed)",
+    labels=("provider", "reason")
+)
+LLM_TTFT = registry.histogram(
+    "llm_time_to_first_token_seconds", "Upstream time from opening a stream to its first delta",
+    labels=("model",)
+)
+LLM_TOKENS = registry.counter("llm_streamed_tokens_total", "Text deltas streamed from the LLM", labels=("model",))
+LLM_TOKENS_PER_SECOND = registry.histogram(
+    "llm_stream_tokens_per_second", "Per-stream delta rate after the first token",
+    labels=("model",), buckets=(1, 5, 10, 25, 50, 100, 200, 400, 800, 1600)
+)
+
+
+class LLMProviderError(Exception):
+    """Raised when a stream cannot be opened after all retries"""
+
+
+class LLMProvider:
+    """Backend that turns a chat request into an async stream of text deltas"""
+
+    name = "base"
+
+    async def open_stream(self, messages, model, temperature, max_tokens):
+        """Open a stream and return an async generator of text deltas; the
+        gateway aclose()s it when the consumer stops early"""
+        raise NotImplementedError
+
+    def is_retryable(self, error):
+        """Whether opening the stream may succeed if tried again"""
+        return isinstance(error, (asyncio.TimeoutError, ConnectionError))
+
+    def warm_up(self):
+        """Load SDKs and build clients ahead of the first request (blocking)"""
+
+    async def aclose(self):
+        pass
+
+
+class GroqProvider(LLMProvider):
+    """Groq chat completions over a pooled, keep-alive HTTP client.
+
+    The groq SDK and httpx are imported when the client is first built, by
+    warm_up() or the first request, so importing this module stays cheap.
+    """
+
+    name = "groq"
+
+    def __init__(self, api_key=None, max_connections=None, max_keepalive=None, read_timeout=None):
+        self.api_key = api_key or os.getenv("GROQ_API_KEY")
+        self.max_connections = max_connections or int(os.getenv("LLM_MAX_CONNECTIONS", "100"))
+        self.max_keepalive = max_keepalive or int(os.getenv("LLM_MAX_KEEPALIVE_CONNECTIONS", "20"))
+        self.read_timeout = read_timeout or float(os.getenv("LLM_READ_TIMEOUT", "60"))
+        self.http_client = None
+        self.client = None
+        self._retryable_errors = ()
+        self._client_lock = threading.Lock()
+
+    def warm_up(self):
+        with self._client_lock:
+            if self.client is not None:
+                return
+            import groq
+            import httpx
+
+            self.http_client = httpx.AsyncClient(
+                limits=httpx.Limits(max_connections=self.max_connections, max_keepalive_connections=self.max_keepalive),
+                timeout=httpx.Timeout(self.read_timeout, connect=10.0),
+            )
+            self._retryable_errors = (groq.APIConnectionError, groq.RateLimitError, groq.InternalServerError)
+            # Retries are handled by LLMGateway so they respect its timeout and backoff
+            self.client = groq.AsyncGroq(
+                api_key=self.api_key,
+                http_client=self.http_client,
+                max_retries=0,
+            )
+
+    async def open_stream(self, messages, model, temperature, max_tokens):
+        if self.client is None:
+            self.warm_up()
+        stream = await self.client.chat.completions.create(
+            model=model,
+            messages=messages,
+            temperature=temperature,
+            max_tokens=max_tokens,
+            stream=True
+        )
+        return self._texts(stream)
+
+    async def _texts(self, stream):
+        # Close on early exit too (cancelled followers, abandoned or
+        # disconnected streams), or the response holds its pooled
+        # connection until garbage collection
+        try:
+            async for chunk in stream:
+                if chunk.choices and chunk.choices[0].delta.content:
+                    yield chunk.choices[0].delta.content
+        finally:
+            await stream.close()
+
+    def is_retryable(self, error):
+        return super().is_retryable(error) or isinstance(error, self._retryable_errors)
+
+    async def aclose(self):
+        if self.http_client is not None:
+            await self.http_client.aclose()
+
+
+class FakeProvider(LLMProvider):
+    """Deterministic local backend for load tests and offline development.
+
+    Streams max_tokens word tokens derived from the prompt, after ttft_ms
+    and then at tokens_per_sec. The same prompt always yields the same text.
+    """
+
+    name = "fake"
+
+    VOCABULARY = (
+        "temple", "gopuram", "Chola", "Pallava", "Nayak", "mandapa", "heritage", "route",
+        "Day", "visit", "morning", "evening", "km", "from", "the", "and", "to", "near",
+        "sculpture", "fort", "palace", "museum", "festival", "Thanjavur", "Madurai",
+        "Mamallapuram", "Kanchipuram", "Srirangam", "stay", "hotel", "food", "dosa",
+    )
+
+    def __init__(self, tokens_per_sec=None, ttft_ms=None, tokens=None, fail_rate=None):
+        self.tokens_per_sec = tokens_per_sec or float(os.getenv("FAKE_LLM_TOKENS_PER_SEC", "50"))
+        self.ttft_ms = ttft_ms if ttft_ms is not None else float(os.getenv("FAKE_LLM_TTFT_MS", "300"))
+        self.tokens = tokens or int(os.getenv("FAKE_LLM_TOKENS", "0")) or None
+        self.fail_rate = fail_rate if fail_rate is not None else float(os.getenv("FAKE_LLM_FAIL_RATE", "0"))
+
+    async def open_stream(self, messages, model, temperature, max_tokens):
+        seed = hashlib.sha256(repr(messages).encode("utf-8")).digest()
+        rng = random.Random(seed)
+        if self.fail_rate and rng.random() < self.fail_rate:
+            raise ConnectionError("Fake provider: simulated connection failure")
+        await asyncio.sleep(self.ttft_ms / 1000)
+        return self._texts(rng, min(self.tokens or max_tokens, max_tokens))
+
+    async def _texts(self, rng, count):
+        interval = 1 / self.tokens_per_sec if self.tokens_per_sec > 0 else 0
+        for i in range(count):
+            if i:
+                await asyncio.sleep(interval)
+            yield rng.choice(self.VOCABULARY) + ("\n" if i % 12 == 11 else " ")
+
+
+def parse_model_limits(value):
+    """Parse "model-a=4,model-b=8" into {"model-a": 4, "model-b": 8}"""
+    limits = {}
+    for item in (value or "").split(","):
+        if "=" in item:
+            model, limit = item.split("=", 1)
+            limits[model.strip()] = int(limit)
+    return limits
+
+
+class LLMGateway:
+    """Concurrency-limited, retrying front door to an LLMProvider.
+
+    A global semaphore caps concurrent generations across all models and a
+    per-model semaphore caps each model; both are held for the whole stream.
+    Opening a stream is bounded by open_timeout and retried with jittered
+    exponential backoff when the provider says the error is retryable.
+    """
+
+    def __init__(self, provider, model=None, temperature=None, max_tokens=None,
+                 max_concurrency=None, model_concurrency=None, model_limits=None,
+                 open_timeout=None, retries=None, retry_base_delay=None):
+        self.provider = provider
+        self.model = model or os.getenv("LLM_MODEL", "llama-3.1-8b-instant")
+        self.temperature = temperature if temperature is not None else float(os.getenv("LLM_TEMPERATURE", "0.6"))
+        self.max_tokens = max_tokens or int(os.getenv("LLM_MAX_TOKENS", "900"))
+        self.max_concurrency = max_concurrency or int(os.getenv("LLM_MAX_CONCURRENCY", "256"))
+        self.model_concurrency = model_concurrency or int(os.getenv("LLM_MODEL_CONCURRENCY", str(self.max_concurrency)))
+        self.model_limits = model_limits if model_limits is not None else parse_model_limits(
+            os.getenv("LLM_MODEL_LIMITS")
+        )
+        self.open_timeout = open_timeout or float(os.getenv("LLM_OPEN_TIMEOUT", "15"))
+        self.retries = retries if retries is not None else int(os.getenv("LLM_OPEN_RETRIES", "2"))
+        self.retry_base_delay = retry_base_delay or float(os.getenv("LLM_RETRY_BASE_DELAY", "0.25"))
+        self._global_slots = asyncio.Semaphore(self.max_concurrency)
+        self._model_slots = {}
+        self.active = 0
+        self.waiting = 0
+        self.opened = 0
+        self.retried = 0
+        self.failed = 0
+
+    def _slots_for(self, model):
+        slots = self._model_slots.get(model)
+        if slots is None:
+            slots = asyncio.Semaphore(self.model_limits.get(model, self.model_concurrency))
+            self._model_slots[model] = slots
+        return slots
+
+    async def _open_with_retry(self, messages, model, temperature, max_tokens):
+        for attempt in range(self.retries + 1):
+            try:
+                stream = await asyncio.wait_for(
+                    self.provider.open_stream(messages, model, temperature, max_tokens),
+                    timeout=self.open_timeout,
+                )
+                self.opened += 1
+                return stream
+            except Exception as e:
+                if attempt >= self.retries or not self.provider.is_retryable(e):
+                    self.failed += 1
+                    LLM_ERRORS.labels(self.provider.name, "open_failed").inc()
+                    raise LLMProviderError(f"Could not open {self.provider.name} stream: {e!r}") from e
+                self.retried += 1
+                LLM_ERRORS.labels(self.provider.name, "retried").inc()
+                # Full jitter: spread retries from many streams over the backoff window
+                await asyncio.sleep(random.uniform(0, self.retry_base_delay * 2 ** attempt))
+
+    async def stream(self, messages, model=None, temperature=None, max_tokens=None):
+        """Yield text deltas for messages, holding a concurrency slot throughout"""
+        model = model or self.model
+        temperature = self.temperature if temperature is None else temperature
+        max_tokens = max_tokens or self.max_tokens
+        self.waiting += 1
+        try:
+            await self._global_slots.acquire()
+            try:
+                await self._slots_for(model).acquire()
+            except BaseException:
+                self._global_slots.release()
+                raise
+        finally:
+            self.waiting -= 1
+        self.active += 1
+        LLM_ACTIVE_STREAMS.inc()
+        started = time.perf_counter()
+        first_token_at = None
+        tokens = 0
+        try:
+            stream = await self._open_with_retry(messages, model, temperature, max_tokens)
+            async with aclosing(stream):
+                async for text in stream:
+                    if first_token_at is None:
+                        first_token_at = time.perf_counter()
+                        LLM_TTFT.labels(model).observe(first_token_at - started)
+                    tokens += 1
+                    yield text
+        except LLMProviderError:
+            raise
+        except Exception:
+            LLM_ERRORS.labels(self.provider.name, "stream_failed").inc()
+            raise
+        finally:
+            self.active -= 1
+            LLM_ACTIVE_STREAMS.dec()
+            if tokens:
+                LLM_TOKENS.labels(model).inc(tokens)
+                elapsed = time.perf_counter() - first_token_at
+                if tokens > 1 and elapsed > 0:
+                    LLM_TOKENS_PER_SECOND.labels(model).observe((tokens - 1) / elapsed)
+            self._slots_for(model).release()
+            self._global_slots.release()
+
+    def warm_up(self):
+        self.provider.warm_up()
+
+    async def aclose(self):
+        await self.provider.aclose()
+
+    def stats(self):
+        return {
+            "provider": self.provider.name,
+            "model": self.model,
+            "max_concurrency": self.max_concurrency,
+            "active": self.active,
+            "waiting": self.waiting,
+            "opened": self.opened,
+            "retried": self.retried,
+            "failed": self.failed,
+        }
+
+
+def create_llm_gateway():
+    """Build the gateway for LLM_PROVIDER (groq or fake)"""
+    provider_name = os.getenv("LLM_PROVIDER", "groq").lower()
+    if provider_name == "fake":
+        provider = FakeProvider()
+    elif provider_name == "groq":
+        provider = GroqProvider()
+    else:
+        raise ValueError(f"Unknown LLM_PROVIDER: {provider_name}")
+    return LLMGateway(provider)
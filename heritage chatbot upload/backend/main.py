@@ -1,14 +1,37 @@
 import os
-from fastapi import FastAPI, Header, HTTPException
+from fastapi import FastAPI, Depends, Header, HTTPException, Query
 from fastapi.middleware.cors import CORSMiddleware
-from fastapi.responses import StreamingResponse
+from fastapi.responses import StreamingResponse, Response, JSONResponse
+from starlette.concurrency import run_in_threadpool
 from pydantic import BaseModel, EmailStr
 from dotenv import load_dotenv
-from groq import Groq
-from prompt import heritage_prompt
-from mongo_database import MongoDatabase
-from typing import Optional
-import json
+from prompt import structured_prompt, format_location
+from heritage_sites import HeritageSiteIndex, plan_route
+from reverse_geocoder import ReverseGeocoder
+from itinerary import ItineraryRenderer, render_stream
+from intent import IntentRouter, ITINERARY, SMALLTALK, PROFILE_TTFT, PROFILE_LATENCY, PROFILE_OUTPUT_TOKENS
+from mongo_database import MongoDatabase, DatabaseUnavailableError, parse_fields
+from async_mongo_database import AsyncMongoDatabase
+from bucket_storage import BucketedMongoDatabase
+from message_archive import MessageArchive
+from cache import ResponseCache, LRUTTLCache, HistoryVersionCache
+from singleflight import StreamCoalescer
+from sse import ChunkCoalescer
+from export import EXPORT_FORMATS, ndjson_chunks, ndjson_chunks_async
+from resumable_streams import ResumableStreams, StreamGoneError, parse_last_event_id
+from conversation_memory import ConversationMemory, estimate_tokens
+from admission import AdmissionController, AdmissionRejected
+from password_hasher import PasswordHasher, HasherBusyError
+from session_tokens import SessionTokenSigner, InvalidTokenError
+from llm_provider import create_llm_gateway
+from startup import DatabaseConnector
+from metrics import registry as metrics_registry, CONTENT_TYPE as METRICS_CONTENT_TYPE
+from typing import Literal, Optional
+from contextlib import aclosing
+import asyncio
+import hashlib
+import inspect
+import time
 
 # Load environment variables
 load_dotenv()
@@ -22,27 +45,289 @@ app.add_middleware(
     allow_credentials=True,
     allow_methods=["*"],
     allow_headers=["*"],
+    expose_headers=["X-Generation-Id", "X-Prompt-Tokens", "X-Context-Tokens", "X-Prompt-Profile"],
 )
 
-# Initialize Groq client and MongoDB
-client = Groq(api_key=os.getenv("GROQ_API_KEY"))
-db = MongoDatabase()
+# Execution mode: "sync" keeps the blocking pymongo client (run in the
+# threadpool), "async" uses AsyncMongoClient on the event loop.
+EXECUTION_MODE = os.getenv("EXECUTION_MODE", "sync").lower()
+ASYNC_MODE = EXECUTION_MODE == "async"
+
+# Message layout: "documents" (one per message) or "buckets" (sync mode only)
+MESSAGE_STORAGE = os.getenv("MESSAGE_STORAGE", "documents").lower()
+
+# bcrypt runs on its own bounded process pool so login bursts cannot starve /chat
+password_hasher = PasswordHasher()
+BCRYPT_TARGET_MS = os.getenv("BCRYPT_TARGET_MS")
+# Start the bcrypt workers in the background at startup instead of on the first login
+BCRYPT_PREWARM = os.getenv("BCRYPT_PREWARM", "true").lower() == "true"
+
+# Messages older than ARCHIVE_AFTER_DAYS move from MongoDB to compressed
+# segment files under ARCHIVE_DIR; reads and exports still include them
+ARCHIVE_ENABLED = os.getenv("ARCHIVE_ENABLED", "false").lower() == "true"
+
+# Initialize LLM provider (LLM_PROVIDER=groq|fake) and MongoDB
+llm = create_llm_gateway()
+message_archive = MessageArchive() if ARCHIVE_ENABLED else None
+if ASYNC_MODE:
+    # Refused rather than downgraded, so a replica never silently ignores
+    # bucketed or archived messages its peers wrote
+    if MESSAGE_STORAGE == "buckets":
+        raise ValueError("MESSAGE_STORAGE=buckets is not supported with EXECUTION_MODE=async")
+    if ARCHIVE_ENABLED:
+        raise ValueError("ARCHIVE_ENABLED is not supported with EXECUTION_MODE=async")
+    db = AsyncMongoDatabase(hasher=password_hasher)
+elif MESSAGE_STORAGE == "buckets":
+    db = BucketedMongoDatabase(hasher=password_hasher, archive=message_archive)
+else:
+    db = MongoDatabase(hasher=password_hasher, archive=message_archive)
+
+# Signed session tokens, verified in-process on every authenticated request.
+# The raw user-id header is only accepted when enabled, for older clients.
+token_signer = SessionTokenSigner()
+ALLOW_USER_ID_HEADER = os.getenv("ALLOW_USER_ID_HEADER", "false").lower() == "true"
+if ALLOW_USER_ID_HEADER:
+    print("⚠️  ALLOW_USER_ID_HEADER is on: any client can act as any user by sending a user-id header. "
+          "Turn it off once older clients send session tokens.")
+
+# /auth/me profiles; invalidated by profile updates and account deletion
+profile_cache = LRUTTLCache(
+    max_entries=int(os.getenv("PROFILE_CACHE_MAX_ENTRIES", "10000")),
+    ttl_seconds=float(os.getenv("PROFILE_CACHE_TTL_SECONDS", "300"))
+)
+
+# Largest page /chat/history will return
+MAX_HISTORY_PAGE_SIZE = 200
+
+# Per-user history versions behind the /chat/history ETag, so an unchanged
+# history is answered with 304 without touching the database
+history_versions = HistoryVersionCache()
+
+# Optional cache of serialized /chat/history pages keyed by history version
+# (HISTORY_PAGE_CACHE_MAX_ENTRIES=0, the default, disables it)
+HISTORY_PAGE_CACHE_MAX_ENTRIES = int(os.getenv("HISTORY_PAGE_CACHE_MAX_ENTRIES", "0"))
+history_pages = LRUTTLCache(
+    max_entries=HISTORY_PAGE_CACHE_MAX_ENTRIES,
+    ttl_seconds=float(os.getenv("HISTORY_PAGE_CACHE_TTL_SECONDS", "300")),
+    max_bytes=int(os.getenv("HISTORY_PAGE_CACHE_MAX_BYTES", str(16 * 1024 * 1024)))
+) if HISTORY_PAGE_CACHE_MAX_ENTRIES > 0 else None
+
+# Verified heritage sites injected into prompts for nearby users
+NEARBY_SITES_COUNT = int(os.getenv("NEARBY_SITES_COUNT", "8"))
+NEARBY_SITES_MAX_KM = float(os.getenv("NEARBY_SITES_MAX_KM", "150"))
+site_index = HeritageSiteIndex.from_file()
+
+# Request coordinates resolved in-process to "district, nearest town" for
+# the prompt and stored with the user's message
+REVERSE_GEOCODING = os.getenv("REVERSE_GEOCODING", "true").lower() == "true"
+geocoder = ReverseGeocoder.from_files() if REVERSE_GEOCODING else None
+
+# LLM answer format: "markdown" (the model writes the final markdown) or
+# "structured" (the model writes compact tagged lines that the server renders
+# into the same localized markdown, adding headings, distances and Maps links)
+LLM_OUTPUT_MODE = os.getenv("LLM_OUTPUT_MODE", "markdown").lower()
+
+# Greetings and one-line questions get short prompts and small token caps
+# instead of the full itinerary template (INTENT_ROUTING=false to disable)
+intent_router = IntentRouter()
+
+# Completed generations, replayed for near-identical questions
+response_cache = ResponseCache()
+
+# Identical in-flight generations (same final prompt) share one upstream stream
+stream_coalescer = StreamCoalescer()
+
+# Small LLM deltas are merged into fewer SSE frames (first token is never delayed)
+chunk_coalescer = ChunkCoalescer()
+
+# Per-user rolling summary + recent turns, so follow-up questions keep context
+conversation_memory = ConversationMemory()
+
+# Generation slots, bounded wait queue and per-user rate limit for /chat
+admission = AdmissionController()
+
+# Numbered /chat events kept for a while so dropped clients can resume
+resumable_streams = ResumableStreams()
+
+# Hot-path instrumentation exposed on GET /metrics
+DB_LATENCY = metrics_registry.histogram(
+    "db_operation_seconds", "Database method latency as seen by the API", labels=("method",)
+)
+DB_ERRORS = metrics_registry.counter("db_operation_errors_total", "Database methods that raised", labels=("method",))
+CHAT_TTFT = metrics_registry.histogram(
+    "chat_time_to_first_token_seconds", "Time from /chat request to the first SSE event", labels=("source",)
+)
+CHAT_ACTIVE_STREAMS = metrics_registry.gauge("chat_active_streams", "/chat SSE responses currently streaming")
+CHAT_SSE_FRAMES = metrics_registry.counter("chat_sse_frames_total", "SSE frames written by /chat")
+HISTORY_REQUESTS = metrics_registry.counter(
+    "chat_history_requests_total", "/chat/history responses by source (not_modified, page_cache, database)",
+    labels=("source",)
+)
+CHAT_PROMPT_TOKENS = metrics_registry.histogram(
+    "chat_prompt_tokens", "Estimated /chat prompt size in tokens", labels=("part",),
+    buckets=(100, 250, 500, 750, 1000, 1500, 2000, 3000, 4000, 6000, 8000)
+)
+
+
+async def run_db(method_name, *args, **kwargs):
+    """Call a database method without blocking the event loop.
+
+    Coroutine methods (AsyncMongoDatabase) are awaited directly, blocking
+    methods (MongoDatabase) are run in the threadpool.
+    """
+    method = getattr(db, method_name)
+    started = time.perf_counter()
+    try:
+        if inspect.iscoroutinefunction(method):
+            return await method(*args, **kwargs)
+        return await run_in_threadpool(method, *args, **kwargs)
+    except Exception:
+        DB_ERRORS.labels(method_name).inc()
+        raise
+    finally:
+        DB_LATENCY.labels(method_name).observe(time.perf_counter() - started)
+
+
+def stream_completion(prompt, max_tokens=None):
+    """Yield text deltas for a prompt from the configured LLM provider"""
+    return llm.stream([
+        {"role": "system", "content": prompt}
+    ], max_tokens=max_tokens)
+
+
+def rendered_completion(prompt, req):
+    """Stream a structured-mode completion rendered into localized markdown"""
+    origin = None
+    if req.latitude is not None and req.longitude is not None:
+        origin = (req.latitude, req.longitude)
+    renderer = ItineraryRenderer(site_index, language=req.language, origin=origin)
+    return render_stream(stream_completion(prompt), renderer)
+
+
+async def current_history_version(user_id):
+    """A user's history version, through the in-process HistoryVersionCache"""
+    version, generation = history_versions.begin(user_id)
+    if version is None:
+        version = await run_db("get_history_version", user_id)
+        history_versions.store(user_id, version, generation)
+    return version
+
+
+async def conversation_for(user_id):
+    """Cached conversation for a user, rebuilt from recent history on a miss.
+
+    The cached one is only used at the user's current history version, so
+    clears and messages from other replicas are seen within the version
+    cache's TTL instead of the conversation's.
+    """
+    if not conversation_memory.enabled:
+        return None
+    version = await current_history_version(user_id)
+    conversation = conversation_memory.get(user_id, version)
+    if conversation is None:
+        messages = await run_db("get_chat_history", user_id, limit=conversation_memory.warm_messages)
+        conversation = conversation_memory.load(user_id, messages, version)
+    return conversation
+
+
+# MongoDB is connected (and indexed) in the background after startup
+db_connector = DatabaseConnector(
+    connect=lambda: run_db("connect"),
+    ensure_indexes=lambda: run_db("ensure_indexes"),
+)
+
+# Set once the LLM client and bcrypt pool are warmed up (see on_startup_warm_up)
+warm_up_done = asyncio.Event()
+
+
+def too_many_requests(error):
+    return HTTPException(
+        status_code=429, detail=str(error), headers={"Retry-After": str(error.retry_after)}
+    )
+
+
+async def user_profile(user_id):
+    """The /auth/me profile from profile_cache or the database, None if there is no such user"""
+    user = profile_cache.get(user_id)
+    if user is None:
+        user = await run_db("get_user_by_id", user_id)
+        if user:
+            profile_cache.set(user_id, user)
+    return user
+
+
+async def authenticated_user_id(
+    authorization: Optional[str] = Header(None),
+    legacy_user_id: Optional[str] = Header(None, alias="user-id")
+):
+    """Resolve the caller's user id from a Bearer session token.
+
+    Returns None when no credentials were sent, so each endpoint keeps its
+    own 401 message. Invalid or expired tokens, and tokens of deleted
+    accounts, are rejected here.
+    """
+    if authorization:
+        scheme, _, token = authorization.partition(" ")
+        if scheme.lower() != "bearer" or not token:
+            raise HTTPException(status_code=401, detail="Invalid authorization header")
+        try:
+            user_id = token_signer.verify(token.strip())
+        except InvalidTokenError as e:
+            raise HTTPException(status_code=401, detail=str(e))
+        # A token outlives its account; deleting the account drops the cached
+        # profile, so the next request finds no user
+        if await user_profile(user_id) is None:
+            raise HTTPException(status_code=401, detail="Account no longer exists")
+        return user_id
+    if ALLOW_USER_ID_HEADER and legacy_user_id:
+        return legacy_user_id
+    return None
+
+
+@app.exception_handler(DatabaseUnavailableError)
+async def database_unavailable(request, error):
+    return JSONResponse(
+        status_code=503, content={"detail": "Database is not available yet, try again shortly"},
+        headers={"Retry-After": "2"}
+    )
 
 
 @app.on_event("startup")
-def on_startup_connect_db():
+async def on_startup_connect_db():
+    # Nothing here waits on the network: the server answers liveness at once
+    # and reports ready once MongoDB is connected and warm-up has finished
     print("\n" + "="*60)
-    print("Starting Heritage AI Backend...")
+    print(f"Starting Heritage AI Backend ({EXECUTION_MODE} mode)...")
     print("="*60)
-    connected = db.connect()
-    if not connected:
-        print("\n⚠️  WARNING: MongoDB connection failed!")
-        print("   - Check MONGO_URI in .env file")
-        print("   - Ensure MongoDB cluster is running")
-        print("   - Check IP whitelist on Atlas")
-        print("   - Verify username/password")
-        print("\nSome features will not work until database is connected.")
+    print("   MongoDB connects in the background; see GET /health/ready")
+    print("   If it never becomes ready, check MONGO_URI in .env, the cluster,")
+    print("   the Atlas IP whitelist and the username/password.")
     print("="*60 + "\n")
+    db_connector.start()
+    asyncio.create_task(warm_up())
+
+
+async def warm_up():
+    """Load the LLM SDK, calibrate bcrypt and start its workers off the request path"""
+    try:
+        await run_in_threadpool(llm.warm_up)
+        if BCRYPT_TARGET_MS:
+            rounds = await run_in_threadpool(password_hasher.calibrate, float(BCRYPT_TARGET_MS))
+            print(f"✓ bcrypt cost calibrated to {rounds} rounds (~{BCRYPT_TARGET_MS} ms per hash)")
+        if BCRYPT_PREWARM:
+            await run_in_threadpool(password_hasher.warm_up)
+    except Exception as e:
+        # Not fatal: whatever failed is loaded on first use instead
+        print(f"⚠️  Warm-up failed: {e}")
+    warm_up_done.set()
+
+
+@app.on_event("shutdown")
+async def on_shutdown_close_db():
+    await db_connector.stop()
+    await run_db("close")
+    await llm.aclose()
+    password_hasher.shutdown()
 
 # ==================== REQUEST MODELS ====================
 
@@ -59,7 +344,7 @@ class ChatRequest(BaseModel):
     message: str
     latitude: Optional[float] = None
     longitude: Optional[float] = None
-    language: str = "en"  # 'en' (English), 'ta' (Tamil), 'hi' (Hindi)
+    language: Literal["en", "ta", "hi"] = "en"  # English, Tamil, Hindi
 
 class UpdateProfileRequest(BaseModel):
     name: Optional[str] = None
@@ -67,13 +352,14 @@ class UpdateProfileRequest(BaseModel):
 # ==================== AUTHENTICATION ENDPOINTS ====================
 
 @app.post("/auth/signup")
-def signup(req: SignupRequest):
+async def signup(req: SignupRequest):
     """User signup endpoint"""
     try:
         if len(req.password) < 6:
             raise HTTPException(status_code=400, detail="Password must be at least 6 characters")
         
-        result = db.create_user(
+        result = await run_db(
+            "create_user",
             email=req.email,
             password=req.password,
             name=req.name
@@ -85,19 +371,24 @@ def signup(req: SignupRequest):
         return {
             "success": True,
             "message": result['message'],
-            "user_id": result['user_id']
+            "user_id": result['user_id'],
+            "token": token_signer.issue(result['user_id']),
+            "expires_in": token_signer.ttl_seconds
         }
-    except HTTPException:
+    except (HTTPException, DatabaseUnavailableError):
         raise
+    except HasherBusyError as e:
+        raise HTTPException(status_code=503, detail=str(e))
     except Exception as e:
         print(f"Signup error: {e}")
         raise HTTPException(status_code=500, detail=f"Signup failed: {str(e)}")
 
 @app.post("/auth/login")
-def login(req: LoginRequest):
+async def login(req: LoginRequest):
     """User login endpoint"""
     try:
-        result = db.login_user(
+        result = await run_db(
+            "login_user",
             email=req.email,
             password=req.password
         )
@@ -110,33 +401,38 @@ def login(req: LoginRequest):
             "user_id": result['user_id'],
             "name": result['name'],
             "email": result['email'],
-            "message": result['message']
+            "message": result['message'],
+            "token": token_signer.issue(result['user_id']),
+            "expires_in": token_signer.ttl_seconds
         }
-    except HTTPException:
+    except (HTTPException, DatabaseUnavailableError):
         raise
+    except HasherBusyError as e:
+        raise HTTPException(status_code=503, detail=str(e))
     except Exception as e:
         print(f"Login error: {e}")
         raise HTTPException(status_code=500, detail=f"Login failed: {str(e)}")
 
 @app.get("/auth/me")
-def get_current_user(user_id: str = Header(None, alias="user-id")):
+async def get_current_user(user_id: Optional[str] = Depends(authenticated_user_id)):
     """Get current user information"""
     if not user_id:
         raise HTTPException(status_code=401, detail="Not authenticated")
     
-    user = db.get_user_by_id(user_id)
+    user = await user_profile(user_id)
     if not user:
         raise HTTPException(status_code=404, detail="User not found")
     
     return user
 
 @app.put("/auth/profile")
-def update_profile(req: UpdateProfileRequest, user_id: str = Header(None, alias="user-id")):
+async def update_profile(req: UpdateProfileRequest, user_id: Optional[str] = Depends(authenticated_user_id)):
     """Update user profile"""
     if not user_id:
         raise HTTPException(status_code=401, detail="Not authenticated")
     
-    result = db.update_user_profile(user_id, name=req.name)
+    result = await run_db("update_user_profile", user_id, name=req.name)
+    profile_cache.pop(user_id)
     
     if not result['success']:
         raise HTTPException(status_code=400, detail=result['message'])
@@ -146,91 +442,357 @@ def update_profile(req: UpdateProfileRequest, user_id: str = Header(None, alias=
 # ==================== CHAT ENDPOINTS ====================
 
 @app.post("/chat")
-def chat(req: ChatRequest, user_id: str = Header(None, alias="user-id")):
+async def chat(req: ChatRequest, user_id: Optional[str] = Depends(authenticated_user_id)):
     """Send a chat message with streaming response"""
     if not user_id:
         raise HTTPException(status_code=401, detail="Please login to use chat")
+    try:
+        admission.check_rate(user_id)
+    except AdmissionRejected as e:
+        raise too_many_requests(e)
+    received_at = time.perf_counter()
     
-    # Save user message
-    db.save_message(
-        user_id=user_id,
-        message_type="user",
-        content=req.message,
-        latitude=req.latitude,
-        longitude=req.longitude
-    )
+    # Context from earlier turns, taken before this message joins it
+    conversation = conversation_memory.context(await conversation_for(user_id))
     
-    location = f"Latitude: {req.latitude}, Longitude: {req.longitude}"
+    place = None
+    if geocoder is not None and req.latitude is not None and req.longitude is not None:
+        place = geocoder.locate(req.latitude, req.longitude)
+    location = format_location(req.latitude, req.longitude, place)
     
-    prompt = heritage_prompt(
+    profile = intent_router.route(req.message)
+    
+    nearby_sites = None
+    if profile.name != SMALLTALK and req.latitude is not None and req.longitude is not None:
+        nearby_sites = plan_route(
+            req.latitude,
+            req.longitude,
+            site_index.nearest(
+                req.latitude, req.longitude, k=NEARBY_SITES_COUNT, max_distance_km=NEARBY_SITES_MAX_KM
+            )
+        )
+    
+    # Only full itineraries use the structured output format
+    structured = LLM_OUTPUT_MODE == "structured" and profile.name == ITINERARY
+    max_tokens = profile.max_tokens or llm.max_tokens
+    prompt = (structured_prompt if structured else profile.build)(
         user_msg=req.message,
         location=location,
-        language=req.language
+        language=req.language,
+        nearby_sites=nearby_sites,
+        conversation=conversation
     )
+    prompt_tokens = estimate_tokens(prompt)
+    context_tokens = conversation["tokens"] if conversation else 0
+    CHAT_PROMPT_TOKENS.labels("total").observe(prompt_tokens)
+    CHAT_PROMPT_TOKENS.labels("context").observe(context_tokens)
     
-    # Stream the response
-    def generate_response():
-        full_response = ""
-        stream = client.chat.completions.create(
-            model="llama-3.1-8b-instant",
-            messages=[
-                {"role": "system", "content": prompt}
-            ],
-            temperature=0.6,
-            max_tokens=900,
-            stream=True
+    # Only first-turn prompts are shared; a follow-up depends on its conversation
+    cache_key = None
+    if conversation is None:
+        cache_key = response_cache.make_key(
+            req.message, req.language, req.latitude, req.longitude,
+            profile=profile.name,
+            structured=structured
         )
-        
-        for chunk in stream:
-            if chunk.choices[0].delta.content:
-                text = chunk.choices[0].delta.content
-                full_response += text
-                # Send as SSE format
-                yield f"data: {json.dumps({'text': text})}\n\n"
-        
-        # Save full AI response after streaming
-        db.save_message(
+    cached_chunks = response_cache.get(cache_key)
+    
+    # Only generations need a slot; cache hits are replayed straight away.
+    # Rejected before anything is saved, so a 429 leaves no orphan question.
+    ticket = None
+    if cached_chunks is None:
+        try:
+            ticket = admission.enter()
+        except AdmissionRejected as e:
+            raise too_many_requests(e)
+    
+    async def save_question():
+        await run_db(
+            "save_message",
             user_id=user_id,
-            message_type="assistant",
-            content=full_response
+            message_type="user",
+            content=req.message,
+            latitude=req.latitude,
+            longitude=req.longitude,
+            district=place["district"] if place else None
         )
+        history_versions.invalidate(user_id)
+        conversation_memory.record(user_id, "user", req.message)
     
-    return StreamingResponse(generate_response(), media_type="text/event-stream")
+    # Save user message once the request holds a slot, so a queue timeout
+    # leaves no question without an answer. Queued requests save it in the
+    # generation after they are admitted.
+    queued = ticket is not None and not ticket.admitted
+    if not queued:
+        try:
+            await save_question()
+        except BaseException:
+            if ticket is not None:
+                ticket.release()
+            raise
+    
+    # Produce the response events. This runs as a resumable generation in its
+    # own task, so a dropped connection can re-attach instead of asking again.
+    async def generate_events():
+        # Collect frames and join once at the end instead of repeated string copies
+        response_parts = []
+        CHAT_ACTIVE_STREAMS.inc()
+        try:
+            if queued:
+                # Tell the client where it stands until a generation slot frees up
+                async with aclosing(ticket.wait()) as positions:
+                    async for position in positions:
+                        yield {"queue_position": position}
+                await save_question()
+            if cached_chunks is not None:
+                CHAT_TTFT.labels("cache").observe(time.perf_counter() - received_at)
+                # Cache hit: replay the stored chunks as the same SSE events
+                for text in chunk_coalescer.batches(cached_chunks):
+                    response_parts.append(text)
+                    CHAT_SSE_FRAMES.inc()
+                    yield {"text": text}
+            else:
+                # Identical prompts in flight share one upstream stream; only a
+                # completed generation is cached
+                stream = stream_coalescer.join(
+                    stream_coalescer.make_key(
+                        prompt, model=llm.model, temperature=llm.temperature, max_tokens=max_tokens,
+                        profile=profile.name, structured=structured
+                    ),
+                    lambda: rendered_completion(prompt, req) if structured else stream_completion(prompt, max_tokens),
+                    on_complete=lambda completed: response_cache.put(cache_key, completed)
+                )
+                # aclosing: detach from the flight once the generation is abandoned
+                async with aclosing(stream):
+                    frames = chunk_coalescer.coalesce(stream)
+                    async with aclosing(frames):
+                        async for text in frames:
+                            if not response_parts:
+                                CHAT_TTFT.labels("llm").observe(time.perf_counter() - received_at)
+                                PROFILE_TTFT.labels(profile.name).observe(time.perf_counter() - received_at)
+                            response_parts.append(text)
+                            CHAT_SSE_FRAMES.inc()
+                            yield {"text": text}
+                PROFILE_LATENCY.labels(profile.name).observe(time.perf_counter() - received_at)
+                PROFILE_OUTPUT_TOKENS.labels(profile.name).observe(estimate_tokens("".join(response_parts)))
+        except AdmissionRejected as e:
+            # Waited too long in the queue; the 200 is already sent, so report it in-stream
+            yield {"error": str(e), "retry_after": e.retry_after}
+            return
+        finally:
+            if ticket is not None:
+                ticket.release()
+            CHAT_ACTIVE_STREAMS.dec()
+        
+        # Save full AI response after streaming. The answer was delivered in
+        # full, so a failed save is logged and the stream still ends with done.
+        full_response = "".join(response_parts)
+        try:
+            message_id = await run_db(
+                "save_message",
+                user_id=user_id,
+                message_type="assistant",
+                content=full_response
+            )
+        except Exception as e:
+            print(f"Error saving assistant message for {user_id}: {e}")
+            message_id = None
+        history_versions.invalidate(user_id)
+        if message_id is None:
+            return
+        if conversation_memory.holds(user_id):
+            # Keeps the conversation valid for the next turn at the new version
+            conversation_memory.record(
+                user_id, "assistant", full_response, await current_history_version(user_id)
+            )
+    
+    generation = resumable_streams.start(user_id, generate_events())
+    return StreamingResponse(
+        resumable_streams.follow(generation),
+        media_type="text/event-stream",
+        headers={
+            "X-Generation-Id": generation.id,
+            "X-Prompt-Tokens": str(prompt_tokens),
+            "X-Context-Tokens": str(context_tokens),
+            "X-Prompt-Profile": profile.name
+        }
+    )
+
+@app.get("/chat/resume/{generation_id}")
+async def resume_chat(
+    generation_id: str,
+    user_id: Optional[str] = Depends(authenticated_user_id),
+    last_event_id: Optional[str] = Header(None)
+):
+    """Re-attach to a /chat stream after a dropped connection.
+
+    Send the id of the last SSE event received as the Last-Event-ID header;
+    missed events are replayed and the stream continues live if the
+    generation is still running. No new LLM call is made.
+    """
+    if not user_id:
+        raise HTTPException(status_code=401, detail="Please login to use chat")
+    generation = resumable_streams.get(generation_id, user_id)
+    if generation is None:
+        raise HTTPException(status_code=404, detail="Stream not found or expired")
+    try:
+        after_seq = parse_last_event_id(last_event_id)
+        generation.check_resumable(after_seq)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    except StreamGoneError as e:
+        raise HTTPException(status_code=410, detail=str(e))
+    return StreamingResponse(
+        resumable_streams.follow(generation, after_seq),
+        media_type="text/event-stream",
+        headers={"X-Generation-Id": generation.id}
+    )
+
+def history_etag(version, limit, before, after, fields):
+    """Strong ETag for one /chat/history representation at a history version"""
+    key = f"{version}|{limit}|{before}|{after}|{','.join(fields or ())}"
+    return '"' + hashlib.blake2b(key.encode(), digest_size=12).hexdigest() + '"'
+
+
+def etag_matches(if_none_match, etag):
+    """True if an If-None-Match header lists etag (weak comparison, as RFC 9110 requires)"""
+    if not if_none_match:
+        return False
+    if if_none_match.strip() == "*":
+        return True
+    return any(tag.strip().removeprefix("W/") == etag for tag in if_none_match.split(","))
+
 
 @app.get("/chat/history")
-def get_history(user_id: str = Header(None, alias="user-id")):
-    """Get chat history for logged-in user"""
+async def get_history(
+    user_id: Optional[str] = Depends(authenticated_user_id),
+    limit: int = Query(100, ge=1, le=MAX_HISTORY_PAGE_SIZE),
+    before: Optional[str] = None,
+    after: Optional[str] = None,
+    fields: Optional[str] = None,
+    if_none_match: Optional[str] = Header(None)
+):
+    """Get one page of chat history for logged-in user.
+
+    Returns the newest messages by default; pass before_cursor back as
+    ?before= for older pages or after_cursor as ?after= for newer messages.
+    ?fields=id,type,text limits the returned message fields. Responses carry
+    an ETag; sending it back as If-None-Match gets a 304 while the history
+    is unchanged.
+    """
     if not user_id:
         raise HTTPException(status_code=401, detail="Please login to view chat history")
+    if before and after:
+        raise HTTPException(status_code=400, detail="Use either before or after, not both")
+    try:
+        selected_fields = parse_fields(fields)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
     
-    messages = db.get_chat_history(user_id)
-    message_count = db.get_message_count(user_id)
+    version = await current_history_version(user_id)
+    etag = history_etag(version, limit, before, after, selected_fields)
+    # Per-user content: browsers may keep it but must revalidate every time
+    headers = {"ETag": etag, "Cache-Control": "private, no-cache", "Vary": "Authorization, user-id"}
+    if etag_matches(if_none_match, etag):
+        HISTORY_REQUESTS.labels("not_modified").inc()
+        return Response(status_code=304, headers=headers)
     
-    return {
-        "messages": messages,
-        "total_count": message_count
-    }
+    page_key = (user_id, etag)
+    body = history_pages.get(page_key) if history_pages is not None else None
+    if body is not None:
+        HISTORY_REQUESTS.labels("page_cache").inc()
+        return Response(content=body, media_type="application/json", headers=headers)
+    
+    try:
+        page = await run_db(
+            "get_chat_history_page",
+            user_id,
+            limit=limit,
+            before=before,
+            after=after,
+            fields=selected_fields
+        )
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    message_count = await run_db("get_message_count", user_id)
+    
+    body = JSONResponse({**page, "total_count": message_count}).body
+    if history_pages is not None:
+        history_pages.set(page_key, body, size=len(body))
+    HISTORY_REQUESTS.labels("database").inc()
+    return Response(content=body, media_type="application/json", headers=headers)
+
+@app.get("/chat/export")
+async def export_history(
+    user_id: Optional[str] = Depends(authenticated_user_id),
+    export_format: str = Query("ndjson", alias="format"),
+    fields: Optional[str] = None
+):
+    """Download the whole chat history as NDJSON, oldest first.
+
+    ?format=ndjson.gz returns gzip-compressed NDJSON. The body is streamed
+    straight from a database cursor, so memory use does not depend on how
+    many messages the user has.
+    """
+    if not user_id:
+        raise HTTPException(status_code=401, detail="Please login to export chat history")
+    if export_format not in EXPORT_FORMATS:
+        raise HTTPException(status_code=400, detail=f"format must be one of: {', '.join(EXPORT_FORMATS)}")
+    try:
+        fields = parse_fields(fields)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+
+    compress = export_format.endswith(".gz")
+    # Connection and deletion checks run here, so failures still get their
+    # status code; only the cursor is read while streaming
+    messages = await run_db("iter_chat_history", user_id, fields=fields)
+    if inspect.isasyncgen(messages):
+        body = ndjson_chunks_async(messages, compress)
+    else:
+        # Blocking cursor: StreamingResponse pulls each chunk in the threadpool
+        body = ndjson_chunks(messages, compress)
+    return StreamingResponse(
+        body,
+        media_type=EXPORT_FORMATS[export_format],
+        headers={"Content-Disposition": f'attachment; filename="chat-history.{export_format}"'}
+    )
 
 @app.delete("/chat/history")
-def clear_history(user_id: str = Header(None, alias="user-id")):
+async def clear_history(user_id: Optional[str] = Depends(authenticated_user_id)):
     """Clear chat history for logged-in user"""
     if not user_id:
         raise HTTPException(status_code=401, detail="Not authenticated")
     
-    result = db.clear_chat_history(user_id)
+    result = await run_db("clear_chat_history", user_id)
+    history_versions.invalidate(user_id)
+    conversation_memory.forget(user_id)
     
     if not result['success']:
         raise HTTPException(status_code=400, detail=result['message'])
     
     return result
 
+@app.get("/chat/deletions/{job_id}")
+async def deletion_progress(job_id: str, user_id: Optional[str] = Depends(authenticated_user_id)):
+    """Progress of a background deletion started by clearing history or deleting the account"""
+    if not user_id:
+        raise HTTPException(status_code=401, detail="Not authenticated")
+    job = await run_db("get_deletion_job", user_id, job_id)
+    if job is None:
+        raise HTTPException(status_code=404, detail="Deletion job not found")
+    return job
+
 @app.delete("/auth/account")
-def delete_account(user_id: str = Header(None, alias="user-id")):
+async def delete_account(user_id: Optional[str] = Depends(authenticated_user_id)):
     """Delete user account and all data"""
     if not user_id:
         raise HTTPException(status_code=401, detail="Not authenticated")
     
-    result = db.delete_user_account(user_id)
+    result = await run_db("delete_user_account", user_id)
+    history_versions.invalidate(user_id)
+    profile_cache.pop(user_id)
+    conversation_memory.forget(user_id)
     
     if not result['success']:
         raise HTTPException(status_code=400, detail=result['message'])
@@ -239,10 +801,53 @@ def delete_account(user_id: str = Header(None, alias="user-id")):
 
 # ==================== HEALTH CHECK ====================
 
+@app.get("/health/live")
+async def health_live():
+    """Liveness: the process is up and serving (never checks dependencies)"""
+    return {"status": "alive"}
+
+@app.get("/health/ready")
+async def health_ready():
+    """Readiness: MongoDB connected and warm-up finished; 503 until then"""
+    ready = db_connector.connected and warm_up_done.is_set()
+    body = {
+        "status": "ready" if ready else "starting",
+        "database": db_connector.stats(),
+        "warmed_up": warm_up_done.is_set(),
+    }
+    return JSONResponse(status_code=200 if ready else 503, content=body)
+
+@app.get("/metrics")
+async def metrics():
+    """Prometheus scrape endpoint"""
+    return Response(content=metrics_registry.render(), media_type=METRICS_CONTENT_TYPE)
+
+@app.get("/stats")
+async def stats():
+    """Runtime statistics for in-process caches and queues"""
+    return {
+        "response_cache": response_cache.stats(),
+        "message_persistence": db.write_behind_stats(),
+        "message_archive": message_archive.stats() if message_archive is not None else None,
+        "password_hashing": password_hasher.stats(),
+        "profile_cache": profile_cache.stats(),
+        "history_versions": history_versions.stats(),
+        "history_pages": history_pages.stats() if history_pages is not None else None,
+        "reverse_geocoder": geocoder.stats() if geocoder is not None else None,
+        "stream_coalescing": stream_coalescer.stats(),
+        "conversation_memory": conversation_memory.stats(),
+        "admission": admission.stats(),
+        "resumable_streams": resumable_streams.stats(),
+        "llm": llm.stats(),
+        "intent_routing": intent_router.stats(),
+        "database_connection": db_connector.stats()
+    }
+
 @app.get("/")
-def root():
+async def root():
     return {
         "status": "Heritage AI backend running with MongoDB",
         "version": "2.0",
+        "execution_mode": EXECUTION_MODE,
         "features": ["user_auth", "chat_history", "location_tracking"]
     }
@@ -0,0 +1,200 @@
+import asyncio
+from datetime import datetime
+
+from bson import ObjectId
+
+from mongo_database import (
+    build_message_document, build_history_page, decode_cursor, export_batch_size, serialize_message,
+)
+from password_hasher import PasswordHasher, HasherBusyError
+from deletion_jobs import CLEAR_HISTORY, DELETE_ACCOUNT, finished_update, new_deletion_job, serialize_job
+
+
+class InMemoryDatabase:
+    """Process-local stand-in for AsyncMongoDatabase, used by the benchmarks.
+
+    Same method names, arguments and return shapes as the MongoDB classes so
+    main.py runs unchanged. Passwords still go through the bcrypt pool;
+    latency_ms adds a simulated database round trip to every call.
+    """
+
+    def __init__(self, hasher=None, latency_ms=0.0):
+        self.hasher = hasher or PasswordHasher()
+        self.latency_ms = latency_ms
+        self.users = {}
+        self.emails = {}
+        # user_id -> messages in insertion (timestamp, _id) order
+        self.messages = {}
+        self.deletion_jobs = {}
+        # user_id -> history version, bumped by every save and clear
+        self.versions = {}
+
+    async def _round_trip(self):
+        if self.latency_ms:
+            await asyncio.sleep(self.latency_ms / 1000)
+
+    async def connect(self):
+        print("✓ In-memory database ready")
+        return True
+
+    async def ensure_indexes(self):
+        pass
+
+    async def close(self):
+        pass
+
+    def write_behind_stats(self):
+        return None
+
+    def _start_deletion(self, user_id, kind):
+        """Delete the user's messages at once, recorded as an already finished job"""
+        deleted = self.messages.pop(user_id, [])
+        self.versions[user_id] = self.versions.get(user_id, 0) + 1
+        job = new_deletion_job(user_id, kind, len(deleted))
+        job.update(finished_update()["$set"], deleted=len(deleted), batches=1)
+        self.deletion_jobs[job["_id"]] = job
+        return job
+
+    async def get_deletion_job(self, user_id, job_id):
+        await self._round_trip()
+        job = self.deletion_jobs.get(job_id)
+        return serialize_job(job) if job is not None and job["user_id"] == user_id else None
+
+    # ==================== USER AUTHENTICATION ====================
+
+    async def create_user(self, email, password, name):
+        """Create a new user account"""
+        email = email.lower()
+        if email in self.emails:
+            return {"success": False, "message": "Email already exists"}
+        hashed_password = await self.hasher.hash_async(password)
+        await self._round_trip()
+        if email in self.emails:
+            return {"success": False, "message": "Email already exists"}
+        user_id = ObjectId()
+        self.users[user_id] = {
+            "_id": user_id,
+            "email": email,
+            "password": hashed_password,
+            "name": name,
+            "created_at": datetime.utcnow(),
+            "last_login": None
+        }
+        self.emails[email] = user_id
+        return {"success": True, "user_id": str(user_id), "message": "User created successfully"}
+
+    async def login_user(self, email, password):
+        """Authenticate user login"""
+        await self._round_trip()
+        user = self.users.get(self.emails.get(email.lower()))
+        if not user or not await self.hasher.verify_async(password, user['password']):
+            return {"success": False, "message": "Invalid email or password"}
+        user["last_login"] = datetime.utcnow()
+        if self.hasher.needs_rehash(user['password']):
+            try:
+                user["password"] = await self.hasher.hash_async(password)
+                self.hasher.rehashed += 1
+            except HasherBusyError:
+                pass
+        return {
+            "success": True,
+            "user_id": str(user['_id']),
+            "name": user['name'],
+            "email": user['email'],
+            "message": "Login successful"
+        }
+
+    async def get_user_by_id(self, user_id):
+        """Get user information by ID"""
+        await self._round_trip()
+        try:
+            user = self.users.get(ObjectId(user_id))
+        except Exception:
+            return None
+        if not user:
+            return None
+        return {
+            "user_id": str(user['_id']),
+            "name": user['name'],
+            "email": user['email'],
+            "created_at": user['created_at']
+        }
+
+    # ==================== CHAT MESSAGES ====================
+
+    async def save_message(self, user_id, message_type, content, latitude=None, longitude=None, district=None):
+        """Save a chat message"""
+        await self._round_trip()
+        message_data = build_message_document(user_id, message_type, content, latitude, longitude, district)
+        message_data["_id"] = ObjectId()
+        self.messages.setdefault(user_id, []).append(message_data)
+        self.versions[user_id] = self.versions.get(user_id, 0) + 1
+        return str(message_data["_id"])
+
+    async def get_chat_history_page(self, user_id, limit=100, before=None, after=None, fields=None):
+        """Get one keyset page of a user's chat history, same contract as MongoDatabase"""
+        before = decode_cursor(before) if before else None
+        after = decode_cursor(after) if after else None
+        await self._round_trip()
+        stored = self.messages.get(user_id, [])
+        if after is not None:
+            docs = [doc for doc in stored if (doc['timestamp'], doc['_id']) > after][:limit + 1]
+        else:
+            docs = [
+                doc for doc in reversed(stored)
+                if before is None or (doc['timestamp'], doc['_id']) < before
+            ][:limit + 1]
+        return build_history_page(docs, limit, before, after, None, fields)
+
+    async def get_chat_history(self, user_id, limit=100):
+        """Get the most recent chat messages for a user, oldest first"""
+        return (await self.get_chat_history_page(user_id, limit))["messages"]
+
+    async def iter_chat_history(self, user_id, fields=None, batch_size=None):
+        """Return an async iterator over every message of a user, oldest first"""
+        await self._round_trip()
+        return self._export_messages(list(self.messages.get(user_id, [])), fields, batch_size or export_batch_size())
+
+    async def _export_messages(self, stored, fields, batch_size):
+        """One round trip per batch after the first"""
+        for start in range(0, len(stored), batch_size):
+            if start:
+                await self._round_trip()
+            for doc in stored[start:start + batch_size]:
+                yield serialize_message(doc, fields)
+
+    async def clear_chat_history(self, user_id):
+        """Clear all chat history for a user"""
+        await self._round_trip()
+        job = self._start_deletion(user_id, CLEAR_HISTORY)
+        return {"success": True, "job_id": job["_id"], "status": job["status"]}
+
+    async def get_history_version(self, user_id):
+        """Current history version token"""
+        await self._round_trip()
+        return str(self.versions.get(user_id, 0))
+
+    async def get_message_count(self, user_id):
+        """Get total message count for a user"""
+        await self._round_trip()
+        return len(self.messages.get(user_id, []))
+
+    # ==================== USER MANAGEMENT ====================
+
+    async def update_user_profile(self, user_id, name=None):
+        """Update user profile"""
+        await self._round_trip()
+        user = self.users.get(ObjectId(user_id))
+        if user and name:
+            user["name"] = name
+            return {"success": True, "message": "Profile updated"}
+        return {"success": False, "message": "No data to update"}
+
+    async def delete_user_account(self, user_id):
+        """Delete user account and all their data"""
+        await self._round_trip()
+        job = self._start_deletion(user_id, DELETE_ACCOUNT)
+        user = self.users.pop(ObjectId(user_id), None)
+        if user:
+            self.emails.pop(user["email"], None)
+        return {"success": True, "message": "Account deleted", "job_id": job["_id"]}
@@ -0,0 +1,468 @@
+import calendar
+import hashlib
+import heapq
+import os
+import re
+import struct
+import threading
+import time
+import zlib
+try:
+    import fcntl
+except ImportError:  # Windows: locks only cover this process
+    fcntl = None
+from collections import namedtuple
+from contextlib import closing, contextmanager
+from datetime import datetime, timedelta
+
+import bson
+from bson import ObjectId
+
+from bucket_storage import compact_message, expand_message
+from cache import LRUTTLCache
+from metrics import registry
+
+# One index record per compressed block: first and last (timestamp ms, _id)
+# key, segment number, offset and length of the block in the segment,
+# message count and CRC-32 of the compressed bytes
+INDEX_RECORD = struct.Struct("<q12sq12sIQIII")
+INDEX_FILE = "index"
+LOCK_SUFFIX = ".lock"
+SEGMENT_FILE = "{:06d}.seg"
+
+# User ids that can be used as a directory name as they are
+SAFE_NAME = re.compile(r"[A-Za-z0-9_-]{1,64}")
+
+# Per-user locks are striped so their number stays fixed
+LOCK_STRIPES = 64
+
+# Times a read starts over from a fresh index after drop_through removed or
+# rewrote the segments it was reading (a missing file, or a block whose
+# bytes no longer match because a segment number was reused). Real
+# corruption still raises once these are used up.
+READ_RETRIES = 3
+STALE_READ_ERRORS = (FileNotFoundError, ValueError)
+
+EPOCH = datetime(1970, 1, 1)
+
+ArchiveBlock = namedtuple(
+    "ArchiveBlock", "first_ms first_id last_ms last_id segment offset length count crc"
+)
+
+ARCHIVED_MESSAGES = registry.counter("archive_messages_total", "Messages moved from MongoDB to the archive")
+ARCHIVE_READ_SECONDS = registry.histogram(
+    "archive_read_seconds", "Time to read archived messages for one history page or export", labels=("kind",)
+)
+
+
+def to_ms(timestamp):
+    """Milliseconds since the epoch of a naive UTC datetime"""
+    return calendar.timegm(timestamp.timetuple()) * 1000 + timestamp.microsecond // 1000
+
+
+def from_ms(ms):
+    return EPOCH + timedelta(milliseconds=ms)
+
+
+def doc_key(doc):
+    return doc["timestamp"], doc["_id"]
+
+
+def block_key(ms, oid):
+    return from_ms(ms), ObjectId(oid)
+
+
+class MessageArchive:
+    """Append-only, compressed archive of old chat messages on local disk.
+
+    Every user gets a directory, sharded by a hash of the user id, holding
+    segment files and an index. A segment is a sequence of zlib-compressed
+    BSON blocks of up to block_messages compact messages (the bucket
+    layout's short keys); segments roll over at segment_max_bytes. The
+    index has one fixed-size record per block with its key range and
+    offset, so a history page reads the index (cached while the file is
+    unchanged) and decompresses only the blocks it needs.
+
+    A user's archive only ever grows by messages newer than everything
+    already in it, so its blocks are sorted and never overlap. Blocks are
+    written and synced before their index records; a crash leaves at worst
+    unreferenced bytes in a segment or a torn last record, which is
+    ignored and truncated on the next append. Dropping messages writes the
+    surviving ones to new segments and atomically replaces the index, so
+    a crash leaves either the old or the new archive, never a mix. Reads
+    take no lock; one that raced a drop starts over from the new index.
+
+    The directory is local: with several replicas, point ARCHIVE_DIR at a
+    volume they share (with working file locks, which serialize writers
+    across replicas) and run the archival job (ARCHIVE_JOB_ENABLED) on one
+    of them only.
+    """
+
+    def __init__(self, directory=None, after_days=None, block_messages=None, segment_max_bytes=None,
+                 compression_level=None, index_cache_entries=None, job_enabled=None,
+                 interval_seconds=None, batch_size=None, pause_ms=None):
+        self.directory = directory or os.getenv(
+            "ARCHIVE_DIR", os.path.join(os.path.dirname(os.path.abspath(__file__)), "archive")
+        )
+        self.after_days = after_days if after_days is not None else float(os.getenv("ARCHIVE_AFTER_DAYS", "90"))
+        self.block_messages = block_messages or int(os.getenv("ARCHIVE_BLOCK_MESSAGES", "100"))
+        self.segment_max_bytes = segment_max_bytes or int(
+            os.getenv("ARCHIVE_SEGMENT_MAX_BYTES", str(64 * 1024 * 1024))
+        )
+        self.compression_level = compression_level if compression_level is not None else int(
+            os.getenv("ARCHIVE_COMPRESSION_LEVEL", "6")
+        )
+        self.job_enabled = job_enabled if job_enabled is not None else (
+            os.getenv("ARCHIVE_JOB_ENABLED", "true").lower() == "true"
+        )
+        self.interval_seconds = interval_seconds or float(os.getenv("ARCHIVE_INTERVAL_SECONDS", "3600"))
+        self.batch_size = batch_size or int(os.getenv("ARCHIVE_BATCH_SIZE", "1000"))
+        pause_ms = pause_ms if pause_ms is not None else float(os.getenv("ARCHIVE_BATCH_PAUSE_MS", "50"))
+        self.pause_seconds = pause_ms / 1000
+        self._indexes = LRUTTLCache(
+            max_entries=index_cache_entries or int(os.getenv("ARCHIVE_INDEX_CACHE_ENTRIES", "10000")),
+            ttl_seconds=3600
+        )
+        self._locks = [threading.Lock() for _ in range(LOCK_STRIPES)]
+        self.messages_written = 0
+        self.blocks_written = 0
+        self.bytes_written = 0
+        self.blocks_read = 0
+        self.bytes_read = 0
+        self.last_pass = None
+
+    def cutoff(self):
+        """Messages older than this are archived"""
+        return datetime.utcnow() - timedelta(days=self.after_days)
+
+    @contextmanager
+    def lock(self, user_id):
+        """Serializes archiving and deleting a user's messages across threads
+        and, through a lock file beside the user's directory, processes"""
+        with self._locks[zlib.crc32(user_id.encode()) % LOCK_STRIPES]:
+            if fcntl is None:
+                yield
+                return
+            path = self._user_dir(user_id) + LOCK_SUFFIX
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            fd = os.open(path, os.O_RDWR | os.O_CREAT, 0o644)
+            try:
+                fcntl.flock(fd, fcntl.LOCK_EX)
+                yield
+            finally:
+                # Closing the descriptor releases the lock
+                os.close(fd)
+
+    def _user_dir(self, user_id):
+        digest = hashlib.blake2b(user_id.encode(), digest_size=16).hexdigest()
+        name = user_id if SAFE_NAME.fullmatch(user_id) else digest
+        return os.path.join(self.directory, digest[:2], name)
+
+    # ==================== INDEX ====================
+
+    @staticmethod
+    def _read_index(path):
+        """Blocks listed in an index file, ignoring a torn last record"""
+        try:
+            with open(path, "rb") as f:
+                data = f.read()
+        except FileNotFoundError:
+            return []
+        whole = len(data) - len(data) % INDEX_RECORD.size
+        return [ArchiveBlock(*fields) for fields in INDEX_RECORD.iter_unpack(data[:whole])]
+
+    def blocks(self, user_id):
+        """A user's blocks, oldest first (cached until the index file changes)"""
+        path = os.path.join(self._user_dir(user_id), INDEX_FILE)
+        try:
+            stat = os.stat(path)
+        except FileNotFoundError:
+            return []
+        signature = (stat.st_ino, stat.st_size, stat.st_mtime_ns)
+        cached = self._indexes.get(user_id)
+        if cached is not None and cached[0] == signature:
+            return cached[1]
+        blocks = self._read_index(path)
+        self._indexes.set(user_id, (signature, blocks))
+        return blocks
+
+    def last_key(self, user_id):
+        """(timestamp, _id) of the newest archived message, or None"""
+        blocks = self.blocks(user_id)
+        if not blocks:
+            return None
+        return block_key(blocks[-1].last_ms, blocks[-1].last_id)
+
+    # ==================== WRITES ====================
+
+    def append(self, user_id, docs):
+        """Append message documents sorted by (timestamp, _id), all newer than last_key().
+
+        Call under lock(user_id).
+        """
+        if not docs:
+            return 0
+        path = self._user_dir(user_id)
+        os.makedirs(path, exist_ok=True)
+        index_path = os.path.join(path, INDEX_FILE)
+        blocks = self._read_index(index_path)
+        records = self._write_blocks(path, docs, blocks[-1].segment if blocks else 1)
+        # Index records go in only once their blocks are on disk
+        with open(index_path, "ab") as index:
+            torn = index.tell() % INDEX_RECORD.size
+            if torn:
+                index.truncate(index.tell() - torn)
+            index.write(b"".join(records))
+            self._sync_close(index)
+        self.messages_written += len(docs)
+        ARCHIVED_MESSAGES.inc(len(docs))
+        return len(docs)
+
+    def _write_blocks(self, path, docs, segment):
+        """Write docs as compressed blocks to segment and later ones, synced. Returns their index records."""
+        records = []
+        out = None
+        try:
+            for start in range(0, len(docs), self.block_messages):
+                run = docs[start:start + self.block_messages]
+                data = zlib.compress(
+                    bson.encode({"m": [compact_message(doc) for doc in run]}), self.compression_level
+                )
+                if out is None:
+                    out = open(os.path.join(path, SEGMENT_FILE.format(segment)), "ab")
+                if out.tell() and out.tell() + len(data) > self.segment_max_bytes:
+                    self._sync_close(out)
+                    out = None
+                    segment += 1
+                    out = open(os.path.join(path, SEGMENT_FILE.format(segment)), "ab")
+                records.append(INDEX_RECORD.pack(
+                    to_ms(run[0]["timestamp"]), run[0]["_id"].binary,
+                    to_ms(run[-1]["timestamp"]), run[-1]["_id"].binary,
+                    segment, out.tell(), len(data), len(run), zlib.crc32(data)
+                ))
+                out.write(data)
+                self.bytes_written += len(data)
+        finally:
+            if out is not None:
+                self._sync_close(out)
+        self.blocks_written += len(records)
+        return records
+
+    @staticmethod
+    def _sync_close(f):
+        f.flush()
+        os.fsync(f.fileno())
+        f.close()
+
+    @staticmethod
+    def _sync_directory(path):
+        if os.name == "nt":
+            return
+        fd = os.open(path, os.O_RDONLY)
+        try:
+            os.fsync(fd)
+        finally:
+            os.close(fd)
+
+    def drop_through(self, user_id, through=None):
+        """Remove the user's archived messages with (timestamp, _id) keys up to
+        through, or all of them without it. Returns how many.
+
+        Call under lock(user_id). Segments are append-only, so the messages
+        left (normally none) are copied to new segments first; replacing the
+        index with one listing only those is the single step that commits
+        the drop. Unreferenced segments are removed afterwards, including
+        any left by an earlier drop that crashed.
+        """
+        path = self._user_dir(user_id)
+        index_path = os.path.join(path, INDEX_FILE)
+        blocks = self._read_index(index_path)
+        if not blocks:
+            return 0
+        kept = []
+        if through is not None:
+            through_ms = to_ms(through[0])
+            if blocks[0].first_ms > through_ms:
+                return 0
+            kept = [
+                doc
+                for block in blocks if block.last_ms >= through_ms
+                for doc in self.read_block(user_id, block) if doc_key(doc) > through
+            ]
+        records = self._write_blocks(path, kept, max(block.segment for block in blocks) + 1) if kept else []
+        temporary = index_path + ".tmp"
+        with open(temporary, "wb") as index:
+            index.write(b"".join(records))
+            self._sync_close(index)
+        os.replace(temporary, index_path)
+        self._sync_directory(path)
+        self._indexes.pop(user_id)
+        referenced = {SEGMENT_FILE.format(INDEX_RECORD.unpack(record)[4]) for record in records}
+        for name in os.listdir(path):
+            if name.endswith(".seg") and name not in referenced:
+                os.remove(os.path.join(path, name))
+        if not records:
+            os.remove(index_path)
+            os.rmdir(path)
+        return sum(block.count for block in blocks) - len(kept)
+
+    # ==================== READS ====================
+
+    def _fresh_read(self, user_id, read):
+        """read(), run again with a freshly loaded index if a drop_through
+        committed while it ran"""
+        for attempt in range(READ_RETRIES + 1):
+            try:
+                return read()
+            except STALE_READ_ERRORS:
+                if attempt == READ_RETRIES:
+                    raise
+                self._indexes.pop(user_id)
+
+    def read_block(self, user_id, block):
+        """Message documents of one block, oldest first"""
+        path = os.path.join(self._user_dir(user_id), SEGMENT_FILE.format(block.segment))
+        with open(path, "rb") as f:
+            f.seek(block.offset)
+            data = f.read(block.length)
+        if len(data) != block.length or zlib.crc32(data) != block.crc:
+            raise ValueError(f"Corrupt archive block in {path} at offset {block.offset}")
+        self.blocks_read += 1
+        self.bytes_read += block.length
+        return [expand_message(user_id, message) for message in bson.decode(zlib.decompress(data))["m"]]
+
+    def page(self, user_id, limit, before=None, after=None, hidden_before=None):
+        """Up to limit + 1 archived documents for a history page, in query order
+        (newest first, or oldest first with an after cursor). hidden_before
+        is a tombstone's (timestamp, _id) key."""
+        return self._fresh_read(user_id, lambda: self._page(user_id, limit, before, after, hidden_before))
+
+    def _page(self, user_id, limit, before, after, hidden_before):
+        started = time.perf_counter()
+        hidden_ms = to_ms(hidden_before[0]) if hidden_before is not None else None
+        blocks = [block for block in self.blocks(user_id) if hidden_ms is None or block.last_ms >= hidden_ms]
+        if after is None:
+            if before is not None:
+                blocks = [block for block in blocks if block_key(block.first_ms, block.first_id) < before]
+            blocks.reverse()
+        else:
+            blocks = [block for block in blocks if block_key(block.last_ms, block.last_id) > after]
+        docs = []
+        for block in blocks:
+            for doc in self.read_block(user_id, block):
+                key = doc_key(doc)
+                if hidden_before is not None and key <= hidden_before:
+                    continue
+                if (before is not None and key >= before) or (after is not None and key <= after):
+                    continue
+                docs.append(doc)
+            # Blocks never overlap, so the next one cannot hold a closer message
+            if len(docs) > limit:
+                break
+        docs.sort(key=doc_key, reverse=after is None)
+        ARCHIVE_READ_SECONDS.labels("page").observe(time.perf_counter() - started)
+        return docs[:limit + 1]
+
+    def merge_page(self, user_id, docs, limit, before=None, after=None, hidden_before=None):
+        """Add archived messages to up to limit + 1 stored documents of a page, in query order.
+
+        Only touches the archive when the page reaches back into it.
+        """
+        last = self.last_key(user_id)
+        if last is None:
+            return docs
+        if after is None:
+            if len(docs) > limit and doc_key(docs[-1]) > last:
+                return docs
+        elif after >= last:
+            return docs
+        stored = {doc["_id"] for doc in docs}
+        archived = self.page(user_id, limit, before, after, hidden_before)
+        docs = docs + [doc for doc in archived if doc["_id"] not in stored]
+        docs.sort(key=doc_key, reverse=after is None)
+        return docs[:limit + 1]
+
+    def iter_messages(self, user_id, hidden_before=None):
+        """Every archived document of a user, oldest first.
+
+        After a drop_through that committed while this ran, reading goes on
+        from the new index after the last document yielded.
+        """
+        resume = hidden_before
+        for attempt in range(READ_RETRIES + 1):
+            try:
+                for doc in self._iter_blocks(user_id, resume):
+                    resume = doc_key(doc)
+                    yield doc
+                return
+            except STALE_READ_ERRORS:
+                if attempt == READ_RETRIES:
+                    raise
+                self._indexes.pop(user_id)
+
+    def _iter_blocks(self, user_id, hidden_before):
+        hidden_ms = to_ms(hidden_before[0]) if hidden_before is not None else None
+        for block in self.blocks(user_id):
+            if hidden_ms is not None and block.last_ms < hidden_ms:
+                continue
+            started = time.perf_counter()
+            docs = self.read_block(user_id, block)
+            ARCHIVE_READ_SECONDS.labels("export").observe(time.perf_counter() - started)
+            for doc in docs:
+                if hidden_before is None or doc_key(doc) > hidden_before:
+                    yield doc
+
+    def merge_stored(self, user_id, stored, hidden_before=None):
+        """Merge archived documents into an oldest-first iterator of stored documents.
+
+        A message archived just before a crash may still be stored too; it
+        is yielded once.
+        """
+        with closing(stored):
+            if not self.blocks(user_id):
+                yield from stored
+                return
+            previous = None
+            for doc in heapq.merge(self.iter_messages(user_id, hidden_before), stored, key=doc_key):
+                if doc["_id"] != previous:
+                    yield doc
+                previous = doc["_id"]
+
+    def archived_ids(self, user_id, since):
+        """_ids of archived messages in the blocks that end at or after key since.
+
+        Call under lock(user_id).
+        """
+        return {
+            doc["_id"]
+            for block in self.blocks(user_id) if block_key(block.last_ms, block.last_id) >= since
+            for doc in self.read_block(user_id, block)
+        }
+
+    def count(self, user_id, hidden_before=None):
+        """Archived messages of a user not hidden by a tombstone"""
+        return self._fresh_read(user_id, lambda: self._count(user_id, hidden_before))
+
+    def _count(self, user_id, hidden_before):
+        hidden_ms = to_ms(hidden_before[0]) if hidden_before is not None else None
+        total = 0
+        for block in self.blocks(user_id):
+            if hidden_ms is None or block.first_ms > hidden_ms:
+                total += block.count
+            elif block.last_ms >= hidden_ms:
+                total += sum(doc_key(doc) > hidden_before for doc in self.read_block(user_id, block))
+        return total
+
+    def stats(self):
+        return {
+            "directory": self.directory,
+            "after_days": self.after_days,
+            "job_enabled": self.job_enabled,
+            "messages_written": self.messages_written,
+            "blocks_written": self.blocks_written,
+            "bytes_written": self.bytes_written,
+            "blocks_read": self.blocks_read,
+            "bytes_read": self.bytes_read,
+            "last_pass": self.last_pass,
+            "index_cache": self._indexes.stats(),
+        }
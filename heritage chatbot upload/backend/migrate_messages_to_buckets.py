@@ -0,0 +1,116 @@
+"""
+Backfill message_buckets from the one-document-per-message messages collection.
+
+Run it while the app is stopped (or still on MESSAGE_STORAGE=documents and
+re-run it right before switching), then start the app with
+MESSAGE_STORAGE=buckets. Each user is rebuilt from scratch and marked done
+in bucket_migrations, so an interrupted run can simply be started again;
+users already marked done are skipped unless --force is given. The
+messages collection is left untouched unless --delete-source is passed,
+in which case a user's documents are deleted only after their bucket
+count has been verified.
+
+Usage:
+    python migrate_messages_to_buckets.py --dry-run
+    python migrate_messages_to_buckets.py --batch-size 2000
+    python migrate_messages_to_buckets.py --user 64f0c0ffee... --force
+"""
+import argparse
+import time
+
+from bucket_storage import BucketedMongoDatabase, compact_message, new_bucket, split_buckets
+from mongo_database import EXPORT_SORT
+
+
+def user_ids(db, only_user):
+    if only_user:
+        yield only_user
+        return
+    for group in db.messages.aggregate([{"$group": {"_id": "$user_id"}}], allowDiskUse=True):
+        yield group["_id"]
+
+
+def migrate_user(db, user_id, args):
+    """Rebuild one user's buckets. Returns (messages, buckets)."""
+    if not args.dry_run:
+        db.buckets.delete_many({"user_id": user_id})
+    cursor = db.messages.find({"user_id": user_id}).sort(EXPORT_SORT).batch_size(args.batch_size)
+    messages = buckets = 0
+    pending = []
+    run = []
+
+    def write(bucket_runs):
+        nonlocal buckets
+        docs = [new_bucket(user_id, bucket_run) for bucket_run in bucket_runs]
+        buckets += len(docs)
+        if docs and not args.dry_run:
+            db.buckets.insert_many(docs, ordered=False)
+
+    with cursor:
+        for doc in cursor:
+            messages += 1
+            run.append(compact_message(doc))
+            if len(run) >= args.batch_size:
+                # Keep the last, possibly partial bucket open for the next messages
+                *complete, run = list(split_buckets(run, db.bucket_size))
+                pending.extend(complete)
+                if len(pending) >= args.insert_buckets:
+                    write(pending)
+                    pending = []
+    pending.extend(split_buckets(run, db.bucket_size))
+    write(pending)
+    return messages, buckets
+
+
+def verify_user(db, user_id, expected):
+    stored = sum(bucket["count"] for bucket in db.buckets.find({"user_id": user_id}, {"count": 1}))
+    return stored == expected
+
+
+def main(args):
+    db = BucketedMongoDatabase()
+    if not db.connect():
+        raise SystemExit("Could not connect to MongoDB")
+    db.ensure_indexes()
+    migrations = db.db["bucket_migrations"]
+    started = time.perf_counter()
+    total_users = total_messages = total_buckets = skipped = 0
+    try:
+        for user_id in user_ids(db, args.user):
+            if not args.force and migrations.find_one({"_id": user_id, "done": True}):
+                skipped += 1
+                continue
+            messages, buckets = migrate_user(db, user_id, args)
+            total_users += 1
+            total_messages += messages
+            total_buckets += buckets
+            if args.dry_run:
+                continue
+            if not verify_user(db, user_id, messages):
+                print(f"✗ {user_id}: bucket count does not match {messages} messages, leaving source in place")
+                continue
+            if args.delete_source:
+                db.messages.delete_many({"user_id": user_id})
+            migrations.update_one(
+                {"_id": user_id},
+                {"$set": {"done": True, "messages": messages, "buckets": buckets, "migrated_at": time.time()}},
+                upsert=True
+            )
+            if total_users % 100 == 0:
+                print(f"  {total_users} users, {total_messages} messages, {total_buckets} buckets")
+    finally:
+        db.close()
+    elapsed = time.perf_counter() - started
+    print(f"{'Would migrate' if args.dry_run else 'Migrated'} {total_users} users, {total_messages} messages "
+          f"into {total_buckets} buckets in {elapsed:.1f}s ({skipped} already done)")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--user", help="migrate only this user_id")
+    parser.add_argument("--batch-size", type=int, default=1000, help="messages read per cursor batch")
+    parser.add_argument("--insert-buckets", type=int, default=50, help="buckets written per insert_many")
+    parser.add_argument("--force", action="store_true", help="rebuild users already marked done")
+    parser.add_argument("--delete-source", action="store_true", help="delete migrated messages after verifying")
+    parser.add_argument("--dry-run", action="store_true", help="count only, write nothing")
+    main(parser.parse_args())
@@ -1,33 +1,438 @@
-from pymongo import MongoClient
+from pymongo import MongoClient, ReturnDocument, UpdateOne, WriteConcern
+from pymongo.errors import BulkWriteError, DuplicateKeyError
 from datetime import datetime
 from bson import ObjectId
-import bcrypt
+from collections import Counter
+from contextlib import closing
+import base64
 import os
+import threading
+import time
 from dotenv import load_dotenv
+from write_behind import WriteBehindBuffer, QueueFullError
+from password_hasher import PasswordHasher, HasherBusyError
+from deletion_jobs import (
+    BATCH_SORT,
+    CLAIM_SORT,
+    CLEAR_HISTORY,
+    DELETE_ACCOUNT,
+    DELETED_MESSAGES,
+    DELETION_BATCH_SECONDS,
+    JOBS_INDEX,
+    DeletionJobConfig,
+    after_key,
+    batch_filter,
+    claim_filter,
+    cutoff_key,
+    deletion_bound,
+    failed_update,
+    finished_update,
+    lease_update,
+    plan_deletion,
+    progress_update,
+    released_update,
+    serialize_job,
+    tombstone_update,
+    utc_now,
+)
 
 load_dotenv()
 
-class MongoDatabase:
-    def __init__(self):
+# Retries for a failed write-behind batch before it is dropped
+WRITE_BEHIND_RETRIES = 3
+
+# Index used for keyset pagination of a user's history
+HISTORY_INDEX = [("user_id", 1), ("timestamp", -1), ("_id", -1)]
+
+# Indexes of the messages collection
+MESSAGE_INDEXES = ([("user_id", 1), ("timestamp", -1)], HISTORY_INDEX)
+
+# Exports walk HISTORY_INDEX backwards: oldest message first
+EXPORT_SORT = [("timestamp", 1), ("_id", 1)]
+
+# Pages and newest-message lookups walk it forwards
+NEWEST_FIRST = [("timestamp", -1), ("_id", -1)]
+
+# API field name -> stored document field
+MESSAGE_FIELDS = {
+    "id": "_id",
+    "type": "message_type",
+    "text": "content",
+    "timestamp": "timestamp",
+    "latitude": "latitude",
+    "longitude": "longitude",
+    "district": "district",
+}
+
+
+def build_message_document(user_id, message_type, content, latitude=None, longitude=None, district=None):
+    """Build the document stored in the messages collection"""
+    now = datetime.utcnow()
+    return {
+        "user_id": user_id,
+        "message_type": message_type,
+        "content": content,
+        "latitude": latitude,
+        "longitude": longitude,
+        "district": district,
+        # MongoDB stores milliseconds; truncate so cursors match stored values
+        "timestamp": now.replace(microsecond=now.microsecond // 1000 * 1000)
+    }
+
+
+def serialize_message(msg, fields=None):
+    """Convert a stored message document into the API response shape"""
+    message = {
+        "id": str(msg['_id']),
+        "type": msg.get('message_type'),
+        "text": msg.get('content'),
+        "timestamp": msg['timestamp'].isoformat(),
+        "latitude": msg.get('latitude'),
+        "longitude": msg.get('longitude'),
+        "district": msg.get('district')
+    }
+    if fields:
+        return {key: message[key] for key in fields}
+    return message
+
+
+def parse_fields(fields):
+    """Validate a comma separated field list. Returns a list or None for all fields."""
+    if not fields:
+        return None
+    requested = [field.strip() for field in fields.split(",") if field.strip()]
+    unknown = [field for field in requested if field not in MESSAGE_FIELDS]
+    if unknown:
+        raise ValueError(f"Unknown fields: {', '.join(unknown)}")
+    return requested
+
+
+def history_projection(fields):
+    """Mongo projection for the requested API fields (keys needed by cursors always included)"""
+    if not fields:
+        return None
+    projection = {"_id": 1, "timestamp": 1}
+    for field in fields:
+        projection[MESSAGE_FIELDS[field]] = 1
+    return projection
+
+
+def encode_cursor(msg):
+    """Opaque keyset cursor for a message: its timestamp and _id"""
+    raw = f"{msg['timestamp'].isoformat()}|{msg['_id']}"
+    return base64.urlsafe_b64encode(raw.encode()).decode().rstrip("=")
+
+
+def decode_cursor(cursor):
+    """Inverse of encode_cursor. Raises ValueError for malformed cursors."""
+    try:
+        padded = cursor + "=" * (-len(cursor) % 4)
+        timestamp, oid = base64.urlsafe_b64decode(padded.encode()).decode().split("|")
+        return datetime.fromisoformat(timestamp), ObjectId(oid)
+    except Exception:
+        raise ValueError("Invalid history cursor")
+
+
+def visible_filter(user_id, hidden_before=None):
+    """A user's messages, minus those tombstoned by a pending deletion job"""
+    query = {"user_id": user_id}
+    if hidden_before is not None:
+        query.update(after_key(hidden_before))
+    return query
+
+
+def history_query(user_id, before=None, after=None, hidden_before=None):
+    """Filter and sort for one keyset page.
+
+    before: decoded cursor, page holds messages older than it (newest first)
+    after: decoded cursor, page holds messages newer than it (oldest first)
+    hidden_before: tombstone (timestamp, _id) key, messages up to it are being deleted
+    Without a cursor the page holds the newest messages.
+    """
+    query = visible_filter(user_id, hidden_before)
+    if after is not None:
+        timestamp, oid = after
+        query["$or"] = [
+            {"timestamp": {"$gt": timestamp}},
+            {"timestamp": timestamp, "_id": {"$gt": oid}},
+        ]
+        return query, [("timestamp", 1), ("_id", 1)]
+    if before is not None:
+        timestamp, oid = before
+        query["$or"] = [
+            {"timestamp": {"$lt": timestamp}},
+            {"timestamp": timestamp, "_id": {"$lt": oid}},
+        ]
+    return query, NEWEST_FIRST
+
+
+def count_filter(user_id, hidden_before, exclude_ids):
+    """Visible stored messages of a user, minus those still counted as pending"""
+    query = visible_filter(user_id, hidden_before)
+    query["_id"] = {"$nin": exclude_ids}
+    return query
+
+
+def message_key(doc):
+    """(timestamp, _id) key of a message document, or None"""
+    return (doc["timestamp"], doc["_id"]) if doc is not None else None
+
+
+def _in_page(doc, before, after):
+    key = (doc['timestamp'], doc['_id'])
+    if after is not None and key <= after:
+        return False
+    if before is not None and key >= before:
+        return False
+    return True
+
+
+def build_history_page(docs, limit, before=None, after=None, pending=None, fields=None):
+    """Turn up to limit + 1 fetched documents into a chronological page.
+
+    pending holds unflushed write-behind documents, merged in for
+    read-your-writes.
+    """
+    ascending = after is not None
+    if pending:
+        seen = {doc['_id'] for doc in docs}
+        docs = docs + [
+            doc for doc in pending
+            if doc['_id'] not in seen and _in_page(doc, before, after)
+        ]
+        docs.sort(key=lambda doc: (doc['timestamp'], doc['_id']), reverse=not ascending)
+    has_more = len(docs) > limit
+    docs = docs[:limit]
+    if not ascending:
+        docs.reverse()
+
+    # before_cursor fetches older messages (only offered when some exist),
+    # after_cursor fetches anything newer than this page
+    before_cursor = after_cursor = None
+    if docs:
+        if ascending or has_more:
+            before_cursor = encode_cursor(docs[0])
+        after_cursor = encode_cursor(docs[-1])
+    return {
+        "messages": [serialize_message(doc, fields) for doc in docs],
+        "has_more": has_more,
+        "before_cursor": before_cursor,
+        "after_cursor": after_cursor,
+    }
+
+
+def export_messages(docs, pending, fields=None):
+    """Serialize stored documents, then the write-behind documents not among them"""
+    unflushed = {doc["_id"] for doc in pending}
+    with closing(docs):
+        for doc in docs:
+            unflushed.discard(doc["_id"])
+            yield serialize_message(doc, fields)
+    # Messages still waiting in the write-behind queue are the newest
+    for doc in pending:
+        if doc["_id"] in unflushed:
+            yield serialize_message(doc, fields)
+
+
+def count_increments(docs, sign=1):
+    """Per-user $inc operations for the message counters (the history version only goes up)"""
+    return [
+        UpdateOne({"_id": user_id}, {"$inc": {"count": sign * count, "version": count}}, upsert=True)
+        for user_id, count in Counter(doc["user_id"] for doc in docs).items()
+    ]
+
+
+# Counter update for a cleared history
+CLEARED_COUNTER = {"$set": {"count": 0, "seeded": True}, "$inc": {"version": 1}}
+
+
+def seeded_count(counter):
+    """Stored message count from a message_counters document, or None if it was never seeded"""
+    if counter is None or not counter.get("seeded"):
+        return None
+    return counter.get("count", 0)
+
+
+def seed_counter(user_id, stored):
+    """Filter and update seeding a counter with a count of stored messages (no-op if seeded meanwhile)"""
+    return {"_id": user_id, "seeded": {"$ne": True}}, {"$set": {"count": stored, "seeded": True}}
+
+
+def new_user_document(email, hashed_password, name):
+    """Build the document stored in the users collection"""
+    return {
+        "email": email.lower(),
+        "password": hashed_password,
+        "name": name,
+        "created_at": datetime.utcnow(),
+        "last_login": None
+    }
+
+
+def new_counter_document(user_id):
+    """New users start with a seeded message counter"""
+    return {"_id": user_id, "count": 0, "seeded": True}
+
+
+def failure(message):
+    return {"success": False, "message": str(message)}
+
+
+def signup_failure(error):
+    """Result for a failed create_user insert"""
+    if isinstance(error, DuplicateKeyError) or "duplicate key error" in str(error):
+        return failure("Email already exists")
+    return failure(error)
+
+
+def login_success(user):
+    return {
+        "success": True,
+        "user_id": str(user['_id']),
+        "name": user['name'],
+        "email": user['email'],
+        "message": "Login successful"
+    }
+
+
+def public_user(user):
+    """get_user_by_id shape of a users document"""
+    return {
+        "user_id": str(user['_id']),
+        "name": user['name'],
+        "email": user['email'],
+        "created_at": user['created_at']
+    }
+
+
+def profile_update(name=None):
+    """$set for update_user_profile, or None when nothing changes"""
+    update_data = {}
+    if name:
+        update_data["name"] = name
+    return update_data or None
+
+
+def deletion_started(job):
+    """Result of clear_chat_history"""
+    return {"success": True, "job_id": job["_id"], "status": job["status"]}
+
+
+def history_version(counter, pending):
+    """Opaque token that changes whenever a user's visible history changes.
+
+    counter is the user's message_counters document (or None); its version
+    is bumped with every stored message and every clear. Messages still in
+    the write-behind queue are part of the history too.
+    """
+    version = str(counter.get("version", 0)) if counter is not None else "0"
+    if pending:
+        version += f".{len(pending)}.{pending[-1]['_id']}"
+    return version
+
+
+def only_duplicate_key_errors(error):
+    """True if a bulk insert failed only because some documents already exist"""
+    if not isinstance(error, BulkWriteError):
+        return False
+    details = error.details or {}
+    write_errors = details.get("writeErrors", [])
+    return bool(write_errors) and not details.get("writeConcernErrors") and all(
+        err.get("code") == 11000 for err in write_errors
+    )
+
+
+def export_batch_size():
+    """Documents per cursor round trip when exporting a whole history"""
+    return int(os.getenv("EXPORT_BATCH_SIZE", "1000"))
+
+
+class DatabaseUnavailableError(RuntimeError):
+    """Raised while the database is not connected yet; the API answers 503"""
+
+
+def write_behind_enabled():
+    """MESSAGE_WRITE_MODE=write_behind batches message inserts in the background"""
+    return os.getenv("MESSAGE_WRITE_MODE", "direct").lower() == "write_behind"
+
+
+class MongoDatabaseBase:
+    """Connection state shared by MongoDatabase and AsyncMongoDatabase.
+
+    Nothing here talks to MongoDB; the drivers do the I/O and build their
+    queries, documents and results with the module-level helpers above.
+    """
+
+    def __init__(self, hasher=None):
         # Defer actual connection until app startup to avoid crashing on import
         self.client = None
+        # Prepended to message collection names; set by MongoDatabase.attach
+        self.collection_prefix = ""
+        self._reset_collections()
+        self.indexes_ready = False
+        # bcrypt work runs on a bounded process pool
+        self.hasher = hasher or PasswordHasher()
+        # Optional write-behind queue for save_message
+        self.write_buffer = WriteBehindBuffer() if write_behind_enabled() else None
+        self._flusher = None
+        # History clears and account deletions run as throttled background jobs
+        self.deletion_config = DeletionJobConfig()
+        self._deleter = None
+
+    def _bind_collections(self, db):
+        self.db = db
+        self.users = db['users']
+        self.message_counters = db['message_counters']
+        self.deletion_jobs = db['deletion_jobs']
+        self.history_tombstones = db['history_tombstones']
+        self._init_message_storage()
+
+    def _init_message_storage(self):
+        """Collections holding messages (runs in connect)"""
+        self.messages = self.db[self.collection_prefix + 'messages']
+
+    def _reset_collections(self):
         self.db = None
         self.users = None
         self.messages = None
+        self.message_counters = None
+        self.deletion_jobs = None
+        self.history_tombstones = None
         self._connected = False
 
     def _ensure_connected(self):
         """Check connection status and raise helpful error if not connected."""
         if not self._connected or self.users is None:
-            raise RuntimeError(
+            raise DatabaseUnavailableError(
                 "Database not connected. Check MongoDB URI in .env and ensure cluster is running. "
                 "Error details available in server logs."
             )
 
+    def _pending(self, user_id):
+        """The user's messages still waiting in the write-behind queue"""
+        return self.write_buffer.pending_for(user_id) if self.write_buffer is not None else []
+
+    def write_behind_stats(self):
+        """Counters for the write-behind queue, or None in direct mode"""
+        if self.write_buffer is None:
+            return None
+        return self.write_buffer.stats()
+
+
+class MongoDatabase(MongoDatabaseBase):
+    def __init__(self, hasher=None, archive=None):
+        super().__init__(hasher)
+        self._deleter_wakeup = threading.Event()
+        self._stopping = threading.Event()
+        # Optional MessageArchive: old messages move to compressed files on disk
+        self.archive = archive
+        self._archiver = None
+
     def connect(self):
-        """Establish MongoDB connection and create indexes.
+        """Establish the MongoDB connection (indexes are created by ensure_indexes).
 
-        Returns True on success, False on failure.
+        Returns True on success, False on failure; safe to call again after
+        a failure.
         """
         import certifi
 
@@ -35,26 +440,354 @@ class MongoDatabase:
         try:
             # Force TLS and provide CA bundle from certifi for reliable SSL handshake
             self.client = MongoClient(mongo_uri, tls=True, tlsCAFile=certifi.where(), serverSelectionTimeoutMS=5000)
-            self.db = self.client['heritage_chatbot']
-
-            # Collections
-            self.users = self.db['users']
-            self.messages = self.db['messages']
-
-            # Create indexes (may raise if server unreachable)
-            self.users.create_index("email", unique=True)
-            self.messages.create_index([("user_id", 1), ("timestamp", -1)])
+            # Fails within serverSelectionTimeoutMS if the server is unreachable
+            self.client.admin.command("ping")
+            self._bind_collections(self.client['heritage_chatbot'])
             self._connected = True
+            self._start_flusher()
+            self._start_deleter()
+            self._start_archiver()
             print("✓ MongoDB connected successfully")
             return True
         except Exception as e:
             print(f"✗ MongoDB connection failed: {e}")
+            if self.client is not None:
+                self.client.close()
             self.client = None
-            self.db = None
-            self.users = None
-            self.messages = None
-            self._connected = False
+            self._reset_collections()
             return False
+
+    def ensure_indexes(self):
+        """Create the indexes once per process, after connect() succeeded"""
+        if self.indexes_ready:
+            return
+        self._ensure_connected()
+        self.users.create_index("email", unique=True)
+        self._create_message_indexes()
+        self.deletion_jobs.create_index(JOBS_INDEX)
+        self.deletion_jobs.create_index("user_id")
+        self.indexes_ready = True
+        print("✓ MongoDB indexes ready")
+
+    def attach(self, db, name=None):
+        """Use collections of an already open database instead of connect().
+
+        For tests and benchmarks: no background workers or write-behind
+        queue run, and a name prefixes the message collections so several
+        layouts can share one scratch database.
+        """
+        self.collection_prefix = f"{name}_" if name else ""
+        self._bind_collections(db)
+        self.write_buffer = None
+        self._connected = True
+        self._create_message_indexes()
+        return self
+
+    def close(self):
+        """Flush queued messages and close the underlying client"""
+        self._stopping.set()
+        self._deleter_wakeup.set()
+        if self._deleter is not None:
+            self._deleter.join()
+            self._deleter = None
+        if self._archiver is not None:
+            self._archiver.join()
+            self._archiver = None
+        if self.write_buffer is not None:
+            self.write_buffer.close()
+            if self._flusher is not None:
+                self._flusher.join()
+                self._flusher = None
+        if self.client is not None:
+            self.client.close()
+
+    # ==================== WRITE-BEHIND ====================
+
+    def _start_flusher(self):
+        if self.write_buffer is None or self._flusher is not None:
+            return
+        self._flusher = threading.Thread(
+            target=self._flush_loop, name="message-write-behind", daemon=True
+        )
+        self._flusher.start()
+
+    def _flush_loop(self):
+        """Write batches until the buffer is closed and drained"""
+        while True:
+            batch = self.write_buffer.wait_batch()
+            if not batch:
+                return
+            self._write_batch(batch)
+
+    def _write_batch(self, batch):
+        for attempt in range(WRITE_BEHIND_RETRIES):
+            try:
+                self._insert_messages(batch, retry=attempt > 0)
+                break
+            except Exception as e:
+                # Documents from an earlier partial attempt come back as duplicates
+                if only_duplicate_key_errors(e):
+                    break
+                print(f"Error flushing {len(batch)} messages (attempt {attempt + 1}): {e}")
+                time.sleep(0.1 * 2 ** attempt)
+        else:
+            self.write_buffer.mark_failed(batch)
+            return
+        # Bump counters before the batch leaves the pending view so counts never dip
+        self._increment_counters(batch)
+        discarded = self.write_buffer.mark_flushed(batch)
+        if discarded:
+            # History was cleared while this batch was in flight
+            discarded = set(discarded)
+            docs = [doc for doc in batch if doc["_id"] in discarded]
+            self._remove_messages(docs)
+            self._increment_counters(docs, sign=-1)
+
+    def _increment_counters(self, docs, sign=1):
+        operations = count_increments(docs, sign)
+        if operations:
+            try:
+                self.message_counters.bulk_write(operations, ordered=False)
+            except Exception as e:
+                print(f"Error updating message counters: {e}")
+
+    # ==================== MESSAGE STORAGE ====================
+    # One document per message. BucketedMongoDatabase overrides these hooks
+    # and _init_message_storage.
+
+    def _create_message_indexes(self):
+        for index in MESSAGE_INDEXES:
+            self.messages.create_index(index)
+
+    def _insert_messages(self, docs, retry=False):
+        """Store message documents that already carry their _id.
+
+        retry: an earlier attempt with these documents may have partly
+        succeeded (duplicate key errors are tolerated by the caller here).
+        """
+        self.messages.insert_many(docs, ordered=False)
+
+    def _remove_messages(self, docs):
+        self.messages.delete_many({"_id": {"$in": [doc["_id"] for doc in docs]}})
+
+    def _find_history_docs(self, user_id, limit, before, after, hidden_before, fields):
+        """Up to limit + 1 stored documents for one page, in query order"""
+        query, sort = history_query(user_id, before, after, hidden_before)
+        return list(self.messages.find(query, history_projection(fields)).sort(sort).limit(limit + 1))
+
+    def _iter_message_docs(self, user_id, hidden_before, fields, batch_size):
+        """Every stored document of a user, oldest first"""
+        query = visible_filter(user_id, hidden_before)
+        cursor = self.messages.find(query, history_projection(fields)).sort(EXPORT_SORT).batch_size(batch_size)
+        try:
+            yield from cursor
+        finally:
+            cursor.close()
+
+    def _count_stored_messages(self, user_id, hidden_before, exclude_ids):
+        return self.messages.count_documents(count_filter(user_id, hidden_before, exclude_ids))
+
+    def _oldest_message_timestamp(self, user_id):
+        """Timestamp of the user's oldest stored message, or None"""
+        doc = self.messages.find_one({"user_id": user_id}, {"timestamp": 1}, sort=[("timestamp", 1)])
+        return doc["timestamp"] if doc is not None else None
+
+    def _newest_stored_key(self, user_id):
+        """(timestamp, _id) of the user's newest stored message, or None"""
+        return message_key(self.messages.find_one({"user_id": user_id}, {"timestamp": 1}, sort=NEWEST_FIRST))
+
+    def _delete_message_batch(self, job, batch_size):
+        """Delete up to batch_size of the job's messages by _id.
+
+        Returns how many were deleted, or None once nothing is left. Deletes
+        wait for a majority of replicas, so a job never runs ahead of
+        replication.
+        """
+        ids = [
+            doc["_id"] for doc in
+            self.messages.find(batch_filter(job), {"_id": 1}).sort(BATCH_SORT).limit(batch_size)
+        ]
+        if not ids:
+            return None
+        messages = self.messages.with_options(write_concern=WriteConcern(w="majority"))
+        return messages.delete_many({"_id": {"$in": ids}}).deleted_count
+
+    # ==================== BACKGROUND DELETION ====================
+
+    def _start_deleter(self):
+        if self._deleter is not None:
+            return
+        self._deleter = threading.Thread(target=self._deletion_loop, name="deletion-jobs", daemon=True)
+        self._deleter.start()
+
+    def _deletion_loop(self):
+        """Run claimable deletion jobs one at a time until close()"""
+        config = self.deletion_config
+        while not self._stopping.is_set():
+            self._deleter_wakeup.clear()
+            try:
+                now = utc_now()
+                job = self.deletion_jobs.find_one_and_update(
+                    claim_filter(now), lease_update(config, now),
+                    sort=CLAIM_SORT, return_document=ReturnDocument.AFTER
+                )
+            except Exception as e:
+                print(f"Error claiming deletion job: {e}")
+                job = None
+            if job is None:
+                self._deleter_wakeup.wait(config.poll_seconds)
+                continue
+            try:
+                self._run_deletion_job(job)
+            except Exception as e:
+                print(f"Deletion job {job['_id']} failed: {e}")
+                try:
+                    self.deletion_jobs.update_one({"_id": job["_id"]}, failed_update(config, job, e))
+                except Exception as update_error:
+                    print(f"Error recording deletion job failure: {update_error}")
+
+    def _run_deletion_job(self, job):
+        """Delete the job's messages in bounded batches, pausing between batches.
+
+        Restart-safe: every batch re-queries what is left.
+        """
+        config = self.deletion_config
+        while not self._stopping.is_set():
+            started = time.perf_counter()
+            deleted = self._delete_message_batch(job, config.batch_size)
+            if deleted is None:
+                break
+            DELETION_BATCH_SECONDS.observe(time.perf_counter() - started)
+            DELETED_MESSAGES.labels(job["kind"]).inc(deleted)
+            self.deletion_jobs.update_one({"_id": job["_id"]}, progress_update(config, deleted))
+            self._stopping.wait(config.pause_seconds)
+        if self.archive is not None and not self._stopping.is_set():
+            # After the stored messages, so a concurrent archive batch has finished appending
+            with self.archive.lock(job["user_id"]):
+                dropped = self.archive.drop_through(job["user_id"], deletion_bound(job))
+            if dropped:
+                DELETED_MESSAGES.labels(job["kind"]).inc(dropped)
+                self.deletion_jobs.update_one({"_id": job["_id"]}, progress_update(config, dropped))
+        if self._stopping.is_set():
+            # Shutting down: hand the job back so the next worker resumes it
+            self.deletion_jobs.update_one({"_id": job["_id"]}, released_update())
+            return
+        self.deletion_jobs.update_one({"_id": job["_id"]}, finished_update())
+        # Keep the tombstone if a newer job for this user replaced it
+        self.history_tombstones.delete_one({"_id": job["user_id"], "job_id": job["_id"]})
+
+    # ==================== ARCHIVAL ====================
+
+    def _start_archiver(self):
+        if self.archive is None or not self.archive.job_enabled or self._archiver is not None:
+            return
+        self._archiver = threading.Thread(target=self._archive_loop, name="message-archiver", daemon=True)
+        self._archiver.start()
+
+    def _archive_loop(self):
+        """Run an archival pass every archive.interval_seconds until close()"""
+        while not self._stopping.is_set():
+            try:
+                self.archive_old_messages()
+            except Exception as e:
+                print(f"Error archiving messages: {e}")
+            self._stopping.wait(self.archive.interval_seconds)
+
+    def archive_old_messages(self, cutoff=None):
+        """Move every user's messages older than cutoff (default: the archive's
+        retention age) into the archive. Returns how many were moved."""
+        self._ensure_connected()
+        cutoff = cutoff or self.archive.cutoff()
+        started = time.perf_counter()
+        users = archived = 0
+        with closing(self.users.find({}, {"_id": 1}).batch_size(1000)) as cursor:
+            for user in cursor:
+                if self._stopping.is_set():
+                    break
+                moved = self.archive_user(str(user["_id"]), cutoff)
+                users += bool(moved)
+                archived += moved
+        self.archive.last_pass = {
+            "cutoff": cutoff.isoformat(),
+            "users": users,
+            "messages": archived,
+            "seconds": round(time.perf_counter() - started, 3),
+        }
+        if archived:
+            print(f"✓ Archived {archived} messages of {users} users older than {cutoff.isoformat()}")
+        return archived
+
+    def archive_user(self, user_id, cutoff):
+        """Move one user's messages older than cutoff into the archive, in throttled batches"""
+        oldest = self._oldest_message_timestamp(user_id)
+        if oldest is None or oldest >= cutoff:
+            return 0
+        archived = 0
+        while not self._stopping.is_set():
+            with self.archive.lock(user_id):
+                moved = self._archive_batch(user_id, cutoff, self.archive.batch_size)
+            if not moved:
+                break
+            archived += moved
+            self._stopping.wait(self.archive.pause_seconds)
+        return archived
+
+    def _archive_batch(self, user_id, cutoff, batch_size):
+        """Append up to batch_size of the user's oldest messages to the archive, then remove them.
+
+        Messages a pending deletion hides are left to the deletion job.
+        Returns how many messages left the database.
+        """
+        docs = []
+        stored = self._iter_message_docs(user_id, self._hidden_before(user_id), None, batch_size)
+        with closing(stored):
+            for doc in stored:
+                if doc["timestamp"] >= cutoff or len(docs) >= batch_size:
+                    break
+                docs.append(doc)
+        if not docs:
+            return 0
+        last = self.archive.last_key(user_id)
+        older = [doc for doc in docs if last is not None and (doc["timestamp"], doc["_id"]) <= last]
+        if older:
+            # Archived before a crash kept them from being removed; anything
+            # else that old stays stored, as the archive only grows forwards
+            archived = self.archive.archived_ids(user_id, (older[0]["timestamp"], older[0]["_id"]))
+            older = [doc for doc in older if doc["_id"] in archived]
+        newer = [doc for doc in docs if last is None or (doc["timestamp"], doc["_id"]) > last]
+        self.archive.append(user_id, newer)
+        self._remove_messages(older + newer)
+        return len(older) + len(newer)
+
+    def _newest_message_key(self, user_id):
+        """(timestamp, _id) of the user's newest stored or archived message, or None"""
+        keys = [self._newest_stored_key(user_id)]
+        if self.archive is not None:
+            keys.append(self.archive.last_key(user_id))
+        keys = [key for key in keys if key is not None]
+        return max(keys) if keys else None
+
+    def _start_deletion(self, user_id, kind):
+        """Tombstone the user's current messages and queue a job to delete them"""
+        total = seeded_count(self.message_counters.find_one({"_id": user_id}))
+        job = plan_deletion(user_id, kind, total, self._newest_message_key(user_id))
+        self.deletion_jobs.insert_one(job)
+        if job["status"] == "done":
+            return job
+        if job["cutoff"] is not None:
+            self.history_tombstones.update_one({"_id": user_id}, tombstone_update(job), upsert=True)
+        self._deleter_wakeup.set()
+        return job
+
+    def _hidden_before(self, user_id):
+        """Tombstone (timestamp, _id) key for the user's messages, or None"""
+        return cutoff_key(self.history_tombstones.find_one({"_id": user_id}, {"cutoff": 1, "cutoff_id": 1}))
+
+    def get_deletion_job(self, user_id, job_id):
+        """Progress of one of the user's deletion jobs, or None"""
+        self._ensure_connected()
+        job = self.deletion_jobs.find_one({"_id": job_id, "user_id": user_id})
+        return serialize_job(job) if job is not None else None
     
     # ==================== USER AUTHENTICATION ====================
     
@@ -62,33 +795,20 @@ class MongoDatabase:
         """Create a new user account"""
         self._ensure_connected()
         try:
-            # Hash password
-            hashed_password = bcrypt.hashpw(password.encode('utf-8'), bcrypt.gensalt())
-            
-            user_data = {
-                "email": email.lower(),
-                "password": hashed_password,
-                "name": name,
-                "created_at": datetime.utcnow(),
-                "last_login": None
-            }
+            # Hash password on the bcrypt process pool
+            hashed_password = self.hasher.hash(password)
             
-            result = self.users.insert_one(user_data)
+            result = self.users.insert_one(new_user_document(email, hashed_password, name))
+            self.message_counters.insert_one(new_counter_document(str(result.inserted_id)))
             return {
                 "success": True,
                 "user_id": str(result.inserted_id),
                 "message": "User created successfully"
             }
+        except HasherBusyError:
+            raise
         except Exception as e:
-            if "duplicate key error" in str(e):
-                return {
-                    "success": False,
-                    "message": "Email already exists"
-                }
-            return {
-                "success": False,
-                "message": str(e)
-            }
+            return signup_failure(e)
     
     def login_user(self, email, password):
         """Authenticate user login"""
@@ -97,141 +817,186 @@ class MongoDatabase:
             user = self.users.find_one({"email": email.lower()})
             
             if not user:
-                return {
-                    "success": False,
-                    "message": "Invalid email or password"
-                }
+                return failure("Invalid email or password")
             
-            # Verify password
-            if bcrypt.checkpw(password.encode('utf-8'), user['password']):
+            # Verify password on the bcrypt process pool
+            if self.hasher.verify(password, user['password']):
+                update = {"last_login": datetime.utcnow()}
+                if self.hasher.needs_rehash(user['password']):
+                    # Stored cost differs from the calibrated one: upgrade transparently
+                    try:
+                        update["password"] = self.hasher.hash(password)
+                        self.hasher.rehashed += 1
+                    except HasherBusyError:
+                        pass  # Try again on a later login
+                
                 # Update last login
                 self.users.update_one(
                     {"_id": user['_id']},
-                    {"$set": {"last_login": datetime.utcnow()}}
+                    {"$set": update}
                 )
                 
-                return {
-                    "success": True,
-                    "user_id": str(user['_id']),
-                    "name": user['name'],
-                    "email": user['email'],
-                    "message": "Login successful"
-                }
+                return login_success(user)
             else:
-                return {
-                    "success": False,
-                    "message": "Invalid email or password"
-                }
+                return failure("Invalid email or password")
+        except HasherBusyError:
+            raise
         except Exception as e:
-            return {
-                "success": False,
-                "message": str(e)
-            }
+            return failure(e)
     
     def get_user_by_id(self, user_id):
         """Get user information by ID"""
+        self._ensure_connected()
         try:
             user = self.users.find_one({"_id": ObjectId(user_id)})
-            if user:
-                return {
-                    "user_id": str(user['_id']),
-                    "name": user['name'],
-                    "email": user['email'],
-                    "created_at": user['created_at']
-                }
-            return None
+            return public_user(user) if user else None
         except:
             return None
     
     # ==================== CHAT MESSAGES ====================
     
-    def save_message(self, user_id, message_type, content, latitude=None, longitude=None):
+    def save_message(self, user_id, message_type, content, latitude=None, longitude=None, district=None):
         """Save a chat message"""
+        self._ensure_connected()
         try:
-            message_data = {
-                "user_id": user_id,
-                "message_type": message_type,
-                "content": content,
-                "latitude": latitude,
-                "longitude": longitude,
-                "timestamp": datetime.utcnow()
-            }
+            message_data = build_message_document(
+                user_id, message_type, content, latitude, longitude, district
+            )
+            message_data["_id"] = ObjectId()
             
-            result = self.messages.insert_one(message_data)
-            return str(result.inserted_id)
+            if self.write_buffer is not None:
+                # Queue for the background flusher; blocks while the queue is full
+                self.write_buffer.offer(message_data)
+                return str(message_data["_id"])
+            
+            self._insert_messages([message_data])
+            self._increment_counters([message_data])
+            return str(message_data["_id"])
+        except QueueFullError as e:
+            print(f"Dropped message for {user_id}: {e}")
+            return None
         except Exception as e:
             print(f"Error saving message: {e}")
             return None
     
-    def get_chat_history(self, user_id, limit=100):
-        """Get chat history for a specific user"""
+    def get_chat_history_page(self, user_id, limit=100, before=None, after=None, fields=None):
+        """Get one keyset page of a user's chat history.
+
+        Without a cursor the page holds the newest messages. Pass the returned
+        before_cursor as before to page backwards, or after_cursor as after to
+        fetch newer messages. Messages are always oldest first.
+        """
+        self._ensure_connected()
+        before = decode_cursor(before) if before else None
+        after = decode_cursor(after) if after else None
         try:
-            messages = self.messages.find(
-                {"user_id": user_id}
-            ).sort("timestamp", 1).limit(limit)
-            
-            chat_history = []
-            for msg in messages:
-                chat_history.append({
-                    "id": str(msg['_id']),
-                    "type": msg['message_type'],
-                    "text": msg['content'],
-                    "timestamp": msg['timestamp'].isoformat(),
-                    "latitude": msg.get('latitude'),
-                    "longitude": msg.get('longitude')
-                })
-            
-            return chat_history
+            hidden_before = self._hidden_before(user_id)
+            docs = self._find_history_docs(user_id, limit, before, after, hidden_before, fields)
+            if self.archive is not None:
+                docs = self.archive.merge_page(user_id, docs, limit, before, after, hidden_before)
+            # Read-your-writes: include messages still waiting in the queue
+            return build_history_page(docs, limit, before, after, self._pending(user_id), fields)
         except Exception as e:
             print(f"Error retrieving chat history: {e}")
-            return []
+            return build_history_page([], limit)
+    
+    def get_chat_history(self, user_id, limit=100):
+        """Get the most recent chat messages for a user, oldest first"""
+        return self.get_chat_history_page(user_id, limit)["messages"]
+
+    def iter_chat_history(self, user_id, fields=None, batch_size=None):
+        """Return an iterator over every message of a user, oldest first, for exports.
+
+        The connection check and the tombstone lookup run in this call, so
+        they fail before a response has started; only the cursor is read
+        lazily. It fetches batch_size documents per round trip and only the
+        requested fields, so memory stays flat however long the history is.
+        """
+        self._ensure_connected()
+        pending = self._pending(user_id)
+        hidden_before = self._hidden_before(user_id)
+        docs = self._iter_message_docs(user_id, hidden_before, fields, batch_size or export_batch_size())
+        if self.archive is not None:
+            docs = self.archive.merge_stored(user_id, docs, hidden_before)
+        return export_messages(docs, pending, fields)
     
     def clear_chat_history(self, user_id):
-        """Clear all chat history for a user"""
+        """Clear all chat history for a user.
+
+        Messages disappear from reads immediately; they are deleted by a
+        background job whose progress get_deletion_job reports.
+        """
+        self._ensure_connected()
         try:
-            result = self.messages.delete_many({"user_id": user_id})
-            return {
-                "success": True,
-                "deleted_count": result.deleted_count
-            }
+            if self.write_buffer is not None:
+                self.write_buffer.discard_user(user_id)
+            job = self._start_deletion(user_id, CLEAR_HISTORY)
+            self.message_counters.update_one({"_id": user_id}, CLEARED_COUNTER, upsert=True)
+            return deletion_started(job)
         except Exception as e:
-            return {
-                "success": False,
-                "message": str(e)
-            }
+            return failure(e)
     
+    def get_history_version(self, user_id):
+        """Current history version token (see history_version); one lookup by _id"""
+        self._ensure_connected()
+        counter = self.message_counters.find_one({"_id": user_id}, {"version": 1})
+        return history_version(counter, self._pending(user_id))
+
     def get_message_count(self, user_id):
-        """Get total message count for a user"""
-        return self.messages.count_documents({"user_id": user_id})
+        """Get total message count for a user.
+
+        Reads the per-user counter maintained by save/clear/delete. Users whose
+        counter predates this (not seeded) are counted once and seeded.
+        """
+        self._ensure_connected()
+        pending = self._pending(user_id)
+        count = seeded_count(self.message_counters.find_one({"_id": user_id}))
+        if count is not None:
+            return count + len(pending)
+        hidden_before = self._hidden_before(user_id)
+        stored = self._count_stored_messages(user_id, hidden_before, [doc["_id"] for doc in pending])
+        if self.archive is not None:
+            stored += self.archive.count(user_id, hidden_before)
+        try:
+            self.message_counters.update_one(*seed_counter(user_id, stored), upsert=True)
+        except DuplicateKeyError:
+            pass  # Seeded concurrently
+        return stored + len(pending)
     
     # ==================== USER MANAGEMENT ====================
     
     def update_user_profile(self, user_id, name=None):
         """Update user profile"""
+        self._ensure_connected()
         try:
-            update_data = {}
-            if name:
-                update_data["name"] = name
-            
+            update_data = profile_update(name)
             if update_data:
                 self.users.update_one(
                     {"_id": ObjectId(user_id)},
                     {"$set": update_data}
                 )
                 return {"success": True, "message": "Profile updated"}
-            return {"success": False, "message": "No data to update"}
+            return failure("No data to update")
         except Exception as e:
-            return {"success": False, "message": str(e)}
+            return failure(e)
     
     def delete_user_account(self, user_id):
-        """Delete user account and all their data"""
+        """Delete user account and all their data.
+
+        The account goes immediately; its messages are hidden at once and
+        removed by a background job.
+        """
+        self._ensure_connected()
         try:
             # Delete all messages
-            self.messages.delete_many({"user_id": user_id})
+            if self.write_buffer is not None:
+                self.write_buffer.discard_user(user_id)
+            job = self._start_deletion(user_id, DELETE_ACCOUNT)
+            self.message_counters.delete_one({"_id": user_id})
             
             # Delete user
             self.users.delete_one({"_id": ObjectId(user_id)})
             
-            return {"success": True, "message": "Account deleted"}
+            return {"success": True, "message": "Account deleted", "job_id": job["_id"]}
         except Exception as e:
-            return {"success": False, "message": str(e)}
+            return failure(e)
@@ -0,0 +1,162 @@
+import asyncio
+import math
+import multiprocessing
+import os
+import threading
+import time
+from concurrent.futures import ProcessPoolExecutor, wait
+
+from metrics import registry
+
+BCRYPT_SECONDS = registry.histogram(
+    "bcrypt_seconds", "Password hash/verify time including pool queueing", labels=("operation",)
+)
+BCRYPT_REJECTED = registry.counter(
+    "bcrypt_rejected_total", "Password operations rejected because the pool queue was full"
+)
+
+# bcrypt accepts cost factors 4..31; stay in a sane range for interactive logins
+MIN_ROUNDS = 10
+MAX_ROUNDS = 16
+
+
+class HasherBusyError(Exception):
+    """Raised when the hashing queue is full; the API answers 503"""
+
+
+# bcrypt is imported where it is used: in the pool's worker processes,
+# not in the API process at startup
+def _hash_password(password, rounds):
+    import bcrypt
+
+    return bcrypt.hashpw(password, bcrypt.gensalt(rounds))
+
+
+def _check_password(password, hashed):
+    import bcrypt
+
+    return bcrypt.checkpw(password, hashed)
+
+
+def hash_cost(hashed):
+    """Cost factor stored in a bcrypt hash ($2b$12$... -> 12)"""
+    try:
+        return int(hashed.split(b"$")[2])
+    except (IndexError, ValueError):
+        return None
+
+
+def calibrate_rounds(target_ms, min_rounds=MIN_ROUNDS, max_rounds=MAX_ROUNDS):
+    """Pick the bcrypt cost whose hash time is closest to target_ms.
+
+    Each extra round doubles the work, so one timed hash at min_rounds is
+    enough to extrapolate.
+    """
+    sample = b"calibration-password"
+    _hash_password(sample, min_rounds)  # warm up
+    started = time.perf_counter()
+    _hash_password(sample, min_rounds)
+    elapsed_ms = (time.perf_counter() - started) * 1000
+    rounds = min_rounds + round(math.log2(max(target_ms, 1) / max(elapsed_ms, 0.01)))
+    return min(max(rounds, min_rounds), max_rounds)
+
+
+class PasswordHasher:
+    """bcrypt hashing on a dedicated, bounded process pool.
+
+    At most workers hashes run at once and at most queue_limit more wait;
+    anything beyond that raises HasherBusyError instead of piling up behind
+    the pool and starving request workers.
+    """
+
+    def __init__(self, workers=None, queue_limit=None, rounds=None):
+        self.workers = workers or int(os.getenv("BCRYPT_WORKERS", str(min(os.cpu_count() or 2, 4))))
+        self.queue_limit = queue_limit if queue_limit is not None else int(
+            os.getenv("BCRYPT_QUEUE_LIMIT", "64")
+        )
+        self.rounds = rounds or int(os.getenv("BCRYPT_ROUNDS", "12"))
+        self._slots = threading.BoundedSemaphore(self.workers + self.queue_limit)
+        self._executor = None
+        self._executor_lock = threading.Lock()
+        self.completed = 0
+        self.rejected = 0
+        self.rehashed = 0
+
+    def _get_executor(self):
+        with self._executor_lock:
+            if self._executor is None:
+                # spawn: forking a process that runs event loops and flusher threads is unsafe
+                self._executor = ProcessPoolExecutor(
+                    max_workers=self.workers, mp_context=multiprocessing.get_context("spawn")
+                )
+            return self._executor
+
+    def _submit(self, operation, fn, *args):
+        if not self._slots.acquire(blocking=False):
+            self.rejected += 1
+            BCRYPT_REJECTED.inc()
+            raise HasherBusyError("Too many concurrent password operations, please retry")
+        started = time.perf_counter()
+        try:
+            future = self._get_executor().submit(fn, *args)
+        except Exception:
+            self._slots.release()
+            raise
+        future.add_done_callback(lambda done: self._release(operation, started))
+        return future
+
+    def _release(self, operation, started):
+        self._slots.release()
+        self.completed += 1
+        BCRYPT_SECONDS.labels(operation).observe(time.perf_counter() - started)
+
+    def warm_up(self):
+        """Start every pool worker and load bcrypt there, so the first login
+        does not pay for process start-up (blocking)"""
+        futures = [
+            self._get_executor().submit(_hash_password, b"warm-up", 4) for _ in range(self.workers)
+        ]
+        wait(futures)
+
+    def calibrate(self, target_ms):
+        """Set rounds so one hash takes about target_ms on this machine"""
+        self.rounds = calibrate_rounds(target_ms)
+        return self.rounds
+
+    def needs_rehash(self, hashed):
+        """True if a stored hash was made with a different cost than the current one"""
+        return hash_cost(hashed) != self.rounds
+
+    # ==================== BLOCKING API ====================
+
+    def hash(self, password):
+        return self._submit("hash", _hash_password, password.encode("utf-8"), self.rounds).result()
+
+    def verify(self, password, hashed):
+        return self._submit("verify", _check_password, password.encode("utf-8"), hashed).result()
+
+    # ==================== ASYNC API ====================
+
+    async def hash_async(self, password):
+        future = self._submit("hash", _hash_password, password.encode("utf-8"), self.rounds)
+        return await asyncio.wrap_future(future)
+
+    async def verify_async(self, password, hashed):
+        future = self._submit("verify", _check_password, password.encode("utf-8"), hashed)
+        return await asyncio.wrap_future(future)
+
+    def shutdown(self):
+        with self._executor_lock:
+            if self._executor is not None:
+                self._executor.shutdown(wait=False, cancel_futures=True)
+                self._executor = None
+
+    def stats(self):
+        return {
+            "workers": self.workers,
+            "queue_limit": self.queue_limit,
+            "rounds": self.rounds,
+            "completed": self.completed,
+            "rejected": self.rejected,
+            "rehashed": self.rehashed,
+        }
@@ -1,4 +1,71 @@
-def heritage_prompt(user_msg, location, language="en"):
+LANGUAGE_INSTRUCTIONS = {
+    "en": "Respond in English. Provide clear, professional information.",
+    "ta": "தமிழ் மொழியில் மட்டுமே பதிலளிக்கவும். ஆங்கிலம் சொற்களைப் பயன்படுத்தக்கூடாது.",
+    "hi": "हिंदी में ही जवाब दें। अंग्रेजी शब्दों का उपयोग न करें।"
+}
+
+DAY_PLAN_HEADERS = {
+    "en": "### 🗓️ Day-wise Heritage Route Plan",
+    "ta": "### 🗓️ நாள்வாரி பாரம்பரிய பயணத் திட்டம்",
+    "hi": "### 🗓️ दिन-दर-दिन धरोहर मार्ग योजना"
+}
+
+STAY_HEADERS = {
+    "en": "### 🏨 Family-Friendly Stay",
+    "ta": "### 🏨 குடும்பத்திற்கு ஏற்ற தங்கும் இடங்கள்",
+    "hi": "### 🏨 परिवार के अनुकूल ठहरने की जगह"
+}
+
+ESSENTIALS_HEADERS = {
+    "en": "### 🧳 Tourist Essentials",
+    "ta": "### 🧳 சுற்றுலாவுக்கு தேவையான விஷயங்கள்",
+    "hi": "### 🧳 पर्यटक आवश्यकताएं"
+}
+
+
+def localized(texts, language):
+    """Text for a language code, falling back to English"""
+    return texts.get(language, texts["en"])
+
+
+def format_nearby_sites(nearby_sites):
+    """Format routed nearby sites (see heritage_sites.plan_route) as prompt lines"""
+    lines = []
+    for number, site in enumerate(nearby_sites, start=1):
+        lines.append(
+            f"{number}. {site['name']} ({site['district']}) - {site['description']}. "
+            f"{site['distance_from_user_km']} km from user, "
+            f"{site['distance_from_previous_km']} km from previous stop. "
+            f"Map: {site['maps_link']}"
+        )
+    return "\n".join(lines)
+
+
+def format_conversation(conversation):
+    """Format the rolling summary and recent turns (see ConversationMemory.context)"""
+    lines = []
+    if conversation["summary"]:
+        lines.append("Earlier in this conversation:")
+        lines.extend(f"- {line}" for line in conversation["summary"])
+    if conversation["turns"]:
+        lines.append("Most recent messages:")
+        for role, text in conversation["turns"]:
+            lines.append(f"{'User' if role == 'user' else 'Assistant'}: {text}")
+    return "\n".join(lines)
+
+
+def format_location(latitude, longitude, place=None):
+    """Coordinates plus the district and nearest town (see ReverseGeocoder.locate)"""
+    location = f"Latitude: {latitude}, Longitude: {longitude}"
+    if place and place["district"]:
+        location += f" ({place['district']} district"
+        if place["town"]:
+            location += f", near {place['town']} ({place['town_km']} km)"
+        location += ")"
+    return location
+
+
+def heritage_prompt(user_msg, location, language="en", nearby_sites=None, conversation=None):
     """
     Generate heritage tourism assistant prompt in the specified language.
     
@@ -6,40 +73,34 @@ def heritage_prompt(user_msg, location, language="en"):
         user_msg: User's question
         location: User's location (lat, lon)
         language: Language code - 'en' (English), 'ta' (Tamil), 'hi' (Hindi)
+        nearby_sites: Optional verified sites near the user, in route order
+        conversation: Optional bounded conversation context for follow-ups
     """
     
-    language_instructions = {
-        "en": "Respond in English. Provide clear, professional information.",
-        "ta": "தமிழ் மொழியில் மட்டுமே பதிலளிக்கவும். ஆங்கிலம் சொற்களைப் பயன்படுத்தக்கூடாது.",
-        "hi": "हिंदी में ही जवाब दें। अंग्रेजी शब्दों का उपयोग न करें।"
-    }
-    
-    language_rule = language_instructions.get(language, language_instructions["en"])
-    
-    headers = {
-        "en": "### 🗓️ Day-wise Heritage Route Plan",
-        "ta": "### 🗓️ நாள்வாரி பாரம்பரிய பயணத் திட்டம்",
-        "hi": "### 🗓️ दिन-दर-दिन धरोहर मार्ग योजना"
-    }
-    
-    stay_header = {
-        "en": "### 🏨 Family-Friendly Stay",
-        "ta": "### 🏨 குடும்பத்திற்கு ஏற்ற下தங்கும் இடங்கள்",
-        "hi": "### 🏨 परिवार के अनुकूल ठहरने की जगह"
-    }
-    
-    essentials_header = {
-        "en": "### 🧳 Tourist Essentials",
-        "ta": "### 🧳 சுற்றுலாவுக்கு தேவையான விஷயங்கள்",
-        "hi": "### 🧳 पर्यटक आवश्यकताएं"
-    }
+    language_rule = localized(LANGUAGE_INSTRUCTIONS, language)
+
+    nearby_section = ""
+    if nearby_sites:
+        nearby_section = f"""
+Verified heritage sites near the user (already ordered as a route; use these
+names, distances and map links exactly instead of inventing them):
+{format_nearby_sites(nearby_sites)}
+"""
+
+    conversation_section = ""
+    if conversation:
+        conversation_section = f"""
+Conversation context (the user may refer back to it; apply requested changes
+to the earlier plan instead of starting over):
+{format_conversation(conversation)}
+"""
 
     return f"""
 You are an AI-powered heritage tourism assistant for Tamil Nadu, India.
 
 User current location:
 {location}
-
+{nearby_section}
 STRICT RULES (MANDATORY):
 - ALWAYS provide a Google Maps link for EACH heritage site mentioned.
 - Each heritage site MUST include distance from the previous site (in km).
@@ -49,7 +110,7 @@ STRICT RULES (MANDATORY):
 
 Response MUST follow this structure:
 
-{headers.get(language, headers["en"])}
+{localized(DAY_PLAN_HEADERS, language)}
 
 For EACH day:
 - Heritage Site Name
@@ -57,12 +118,12 @@ For EACH day:
 - Distance from previous site (km)
 - Google Maps location link (MANDATORY)
 
-{stay_header.get(language, stay_header["en"])}
+{localized(STAY_HEADERS, language)}
 - Recommend 3 hotels
 - Highlight ONE best hotel
 - Provide Google Maps link for EACH hotel
 
-{essentials_header.get(language, essentials_header["en"])}
+{localized(ESSENTIALS_HEADERS, language)}
 - Best time to visit
 - Dress code
 - Local food
@@ -71,7 +132,129 @@ For EACH day:
 
 LANGUAGE MODE:
 {language_rule}
+{conversation_section}
+User question:
+{user_msg}
+"""
+
 
+def format_site_choices(nearby_sites):
+    """Nearby sites as id lines for the compact output mode (no links; the server adds them)"""
+    return "\n".join(
+        f"- {site['id']}: {site['name']} ({site['district']}), {site['distance_from_user_km']} km away"
+        f" - {site['description']}"
+        for site in nearby_sites
+    )
+
+
+def structured_prompt(user_msg, location, language="en", nearby_sites=None, conversation=None):
+    """
+    Prompt for the compact structured output mode (see itinerary.py).
+
+    The model writes one short tagged line per item; headings, distances
+    and Google Maps links are added by the server while rendering, so the
+    model spends its tokens on content only. Takes the same arguments as
+    heritage_prompt.
+    """
+    nearby_section = ""
+    if nearby_sites:
+        nearby_section = f"""
+Verified heritage sites near the user, nearest-first route order (prefer
+these and refer to them by id):
+{format_site_choices(nearby_sites)}
+"""
+
+    conversation_section = ""
+    if conversation:
+        conversation_section = f"""
+Conversation context (the user may refer back to it; apply requested changes
+to the earlier plan instead of starting over):
+{format_conversation(conversation)}
+"""
+
+    return f"""
+You are an AI-powered heritage tourism assistant for Tamil Nadu, India.
+
+User current location:
+{location}
+{nearby_section}
+OUTPUT FORMAT (MANDATORY): only lines of the forms below, one item per line.
+No markdown, no headings, no links, no distances: the app adds headings,
+distances and Google Maps links itself.
+D|<day number>
+S|<site id from the list, or the site's name>|<one short sentence>
+H|<hotel name>|<town>|<one short sentence>
+H|<hotel name>|<town>|<one short sentence>|*   (the ONE best hotel)
+E|<time, dress, food, transport or duration>|<short answer>
+T|<one sentence, only for answers that are not a trip plan>
+
+For a trip plan: a D line per day followed by its S lines in visiting order,
+grouping nearby sites on the same day; then 3 H lines; then one E line for
+each of time, dress, food, transport and duration.
+
+LANGUAGE MODE:
+{localized(LANGUAGE_INSTRUCTIONS, language)}
+Keep the tags, ids and E keys exactly as written above; write the sentences
+and answers in that language.
+{conversation_section}
+User question:
+{user_msg}
+"""
+
+
+def smalltalk_prompt(user_msg, location=None, language="en", nearby_sites=None, conversation=None):
+    """Prompt for greetings, thanks and other small talk: a sentence or two, no plan"""
+    conversation_section = ""
+    if conversation:
+        conversation_section = f"""
+Conversation so far:
+{format_conversation(conversation)}
+"""
+
+    return f"""
+You are a friendly heritage tourism assistant for Tamil Nadu, India.
+Reply to the user's message in one or two short sentences. Do not plan a
+trip or list sites unless asked; you may offer to help plan a heritage trip.
+
+LANGUAGE MODE:
+{localized(LANGUAGE_INSTRUCTIONS, language)}
+{conversation_section}
+User message:
+{user_msg}
+"""
+
+
+def quick_fact_prompt(user_msg, location, language="en", nearby_sites=None, conversation=None):
+    """Prompt for one-line questions (timings, fees, history, distances): a short direct answer"""
+    nearby_section = ""
+    if nearby_sites:
+        nearby_section = f"""
+Verified heritage sites near the user (use these names, distances and map
+links exactly if you mention one):
+{format_nearby_sites(nearby_sites)}
+"""
+
+    conversation_section = ""
+    if conversation:
+        conversation_section = f"""
+Conversation context (the question may refer back to it):
+{format_conversation(conversation)}
+"""
+
+    return f"""
+You are a heritage tourism assistant for Tamil Nadu, India.
+
+User current location:
+{location}
+{nearby_section}
+Answer the question directly in at most 3 short sentences or bullet points.
+No itinerary, no hotel list, no headings. Add a Google Maps link only for
+the one site the answer is about. If timings or fees may have changed, say
+so briefly.
+
+LANGUAGE MODE:
+{localized(LANGUAGE_INSTRUCTIONS, language)}
+{conversation_section}
 User question:
 {user_msg}
 """
@@ -0,0 +1,164 @@
+import asyncio
+import os
+import secrets
+from collections import deque
+from contextlib import aclosing
+
+from cache import LRUTTLCache
+from sse import sse_event
+
+
+class StreamGoneError(Exception):
+    """Raised when the events a client asks for are no longer buffered"""
+
+
+def parse_last_event_id(value):
+    """Sequence number from a Last-Event-ID of the form "<generation>:<seq>" or "<seq>"."""
+    if not value:
+        return 0
+    try:
+        return int(value.rsplit(":", 1)[-1])
+    except ValueError:
+        raise ValueError("Invalid Last-Event-ID")
+
+
+class Generation:
+    """Numbered SSE events of one /chat generation, kept in a ring buffer.
+
+    Event n carries the id "<generation id>:<n>". Followers replay whatever
+    is buffered after the sequence number they already have and then wait
+    for live events, so any number of connections can attach or re-attach
+    while the generation runs and for a while after it finishes.
+    """
+
+    def __init__(self, generation_id, user_id, max_events):
+        self.id = generation_id
+        self.user_id = user_id
+        self.events = deque(maxlen=max_events)  # (seq, frame)
+        self.last_seq = 0
+        self.done = False
+        self.subscribers = 0
+        self.task = None
+        self._updated = asyncio.Event()
+
+    def _notify(self):
+        updated, self._updated = self._updated, asyncio.Event()
+        updated.set()
+
+    def append(self, payload):
+        self.last_seq += 1
+        self.events.append((self.last_seq, sse_event(payload, f"{self.id}:{self.last_seq}")))
+        self._notify()
+
+    def finish(self):
+        self.done = True
+        self._notify()
+
+    def first_buffered_seq(self):
+        return self.events[0][0] if self.events else self.last_seq + 1
+
+    def check_resumable(self, after_seq):
+        """Raise StreamGoneError if events after after_seq were already dropped"""
+        if after_seq + 1 < self.first_buffered_seq():
+            raise StreamGoneError("Missed events are no longer available, please ask again")
+
+    async def follow(self, after_seq=0, on_leave=None):
+        """Yield SSE frames with sequence numbers above after_seq, then live ones"""
+        self.subscribers += 1
+        position = after_seq
+        try:
+            while True:
+                if position < self.last_seq:
+                    first = self.first_buffered_seq()
+                    if position + 1 < first:
+                        # This client fell further behind than the ring holds
+                        return
+                    position += 1
+                    yield self.events[position - first][1]
+                    continue
+                if self.done:
+                    return
+                await self._updated.wait()
+        finally:
+            self.subscribers -= 1
+            if on_leave is not None:
+                on_leave(self)
+
+
+class ResumableStreams:
+    """Registry of recent /chat generations that clients can re-attach to.
+
+    Each generation runs in its own task, independent of the HTTP response
+    that started it, so a dropped connection does not cancel the LLM call.
+    A client resumes with the last event id it saw and gets the missed
+    events followed by the live stream, without a second generation. A
+    generation nobody is following is cancelled after grace_seconds;
+    finished ones stay resumable for ttl_seconds.
+    """
+
+    def __init__(self, max_generations=None, ttl_seconds=None, max_events=None, grace_seconds=None):
+        self.max_events = max_events or int(os.getenv("RESUME_BUFFER_EVENTS", "2048"))
+        self.grace_seconds = grace_seconds if grace_seconds is not None else float(
+            os.getenv("RESUME_GRACE_SECONDS", "30")
+        )
+        self._generations = LRUTTLCache(
+            max_entries=max_generations or int(os.getenv("RESUME_MAX_GENERATIONS", "10000")),
+            ttl_seconds=ttl_seconds or float(os.getenv("RESUME_TTL_SECONDS", "300")),
+        )
+        self.started = 0
+        self.resumed = 0
+        self.abandoned = 0
+
+    def start(self, user_id, events):
+        """Run an async iterator of event payloads as a resumable generation"""
+        generation = Generation(secrets.token_urlsafe(12), user_id, self.max_events)
+        generation.task = asyncio.get_running_loop().create_task(self._drive(generation, events))
+        self._generations.set(generation.id, generation)
+        self.started += 1
+        return generation
+
+    async def _drive(self, generation, events):
+        try:
+            async with aclosing(events):
+                async for payload in events:
+                    generation.append(payload)
+        except asyncio.CancelledError:
+            generation.append({"error": "Stream expired, please ask again"})
+            raise
+        except Exception as e:
+            print(f"Chat generation {generation.id} failed: {e}")
+            generation.append({"error": "Sorry, something went wrong generating this answer"})
+        finally:
+            generation.finish()
+
+    def get(self, generation_id, user_id):
+        """The user's generation with this id, or None if unknown or expired"""
+        generation = self._generations.get(generation_id)
+        if generation is None or generation.user_id != user_id:
+            return None
+        return generation
+
+    def follow(self, generation, after_seq=0):
+        if after_seq:
+            self.resumed += 1
+        return generation.follow(after_seq, on_leave=self._on_leave)
+
+    def _on_leave(self, generation):
+        if generation.subscribers == 0 and not generation.done:
+            asyncio.get_running_loop().call_later(self.grace_seconds, self._abandon, generation)
+
+    def _abandon(self, generation):
+        # Still nobody listening: stop paying for the generation
+        if generation.subscribers == 0 and not generation.done and generation.task is not None:
+            generation.task.cancel()
+            self.abandoned += 1
+
+    def stats(self):
+        stats = self._generations.stats()
+        stats.update({
+            "started": self.started,
+            "resumed": self.resumed,
+            "abandoned": self.abandoned,
+            "grace_seconds": self.grace_seconds,
+        })
+        return stats
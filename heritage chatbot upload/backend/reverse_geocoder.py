@@ -0,0 +1,191 @@
+import json
+import os
+
+from cache import LRUTTLCache
+from heritage_sites import HeritageSiteIndex
+from metrics import registry
+
+DATA_DIR = os.path.join(os.path.dirname(__file__), "data")
+DEFAULT_DISTRICTS_PATH = os.path.join(DATA_DIR, "tn_districts.geojson")
+DEFAULT_TOWNS_PATH = os.path.join(DATA_DIR, "tn_towns.json")
+
+GEOCODE_LOOKUPS = registry.counter(
+    "geocode_lookups_total", "Reverse geocoding lookups of request coordinates", labels=("outcome",)
+)
+
+
+def load_towns(path=DEFAULT_TOWNS_PATH):
+    """Load the town gazetteer: id, name, district, latitude, longitude"""
+    with open(path, encoding="utf-8") as f:
+        return json.load(f)
+
+
+def load_district_polygons(path=DEFAULT_DISTRICTS_PATH):
+    """(district, rings) for every polygon of a GeoJSON FeatureCollection.
+
+    rings are lists of (longitude, latitude) points, the outer ring first
+    and holes after it; a MultiPolygon contributes one entry per polygon.
+    """
+    with open(path, encoding="utf-8") as f:
+        collection = json.load(f)
+    polygons = []
+    for feature in collection["features"]:
+        geometry = feature["geometry"]
+        parts = [geometry["coordinates"]] if geometry["type"] == "Polygon" else geometry["coordinates"]
+        for part in parts:
+            polygons.append((feature["properties"]["district"], [[tuple(p[:2]) for p in ring] for ring in part]))
+    return polygons
+
+
+def bounding_box(ring):
+    xs = [x for x, _ in ring]
+    ys = [y for _, y in ring]
+    return min(xs), min(ys), max(xs), max(ys)
+
+
+def point_in_ring(x, y, ring):
+    """Even-odd ray casting; the ring may or may not repeat its first point"""
+    inside = False
+    x1, y1 = ring[-1]
+    for x2, y2 in ring:
+        if (y1 > y) != (y2 > y) and x < x1 + (y - y1) * (x2 - x1) / (y2 - y1):
+            inside = not inside
+        x1, y1 = x2, y2
+    return inside
+
+
+def point_in_polygon(x, y, rings):
+    """Inside the outer ring and outside every hole"""
+    if not point_in_ring(x, y, rings[0]):
+        return False
+    return not any(point_in_ring(x, y, hole) for hole in rings[1:])
+
+
+class BoundingBoxTree:
+    """Static R-tree over bounding boxes, bulk-loaded with Sort-Tile-Recursive.
+
+    items are (bbox, value) pairs with bbox = (min_x, min_y, max_x, max_y).
+    Each node holds up to node_capacity children; a point query descends
+    only into nodes whose box contains the point.
+    """
+
+    def __init__(self, items, node_capacity=8):
+        self.node_capacity = node_capacity
+        self.size = len(items)
+        level = [(bbox, value, True) for bbox, value in items]
+        self.height = 1
+        while len(level) > node_capacity:
+            level = self._pack(level)
+            self.height += 1
+        self.root = (self._union(level), level, False) if level else None
+
+    def _pack(self, nodes):
+        """Group nodes into parents: vertical slices by x centre, then runs by y centre"""
+        capacity = self.node_capacity
+        parents_needed = -(-len(nodes) // capacity)
+        slices = int(parents_needed ** 0.5 + 0.999999) or 1
+        slice_size = capacity * -(-parents_needed // slices)
+        nodes = sorted(nodes, key=lambda node: node[0][0] + node[0][2])
+        parents = []
+        for start in range(0, len(nodes), slice_size):
+            column = sorted(nodes[start:start + slice_size], key=lambda node: node[0][1] + node[0][3])
+            for run in range(0, len(column), capacity):
+                children = column[run:run + capacity]
+                parents.append((self._union(children), children, False))
+        return parents
+
+    @staticmethod
+    def _union(nodes):
+        return (
+            min(node[0][0] for node in nodes), min(node[0][1] for node in nodes),
+            max(node[0][2] for node in nodes), max(node[0][3] for node in nodes),
+        )
+
+    def query(self, x, y):
+        """Values whose bounding box contains the point"""
+        if self.root is None:
+            return
+        stack = [self.root]
+        while stack:
+            bbox, payload, leaf = stack.pop()
+            if not (bbox[0] <= x <= bbox[2] and bbox[1] <= y <= bbox[3]):
+                continue
+            if leaf:
+                yield payload
+            else:
+                stack.extend(payload)
+
+
+class ReverseGeocoder:
+    """Resolves coordinates to a district and the nearest town, offline.
+
+    District polygons are prefiltered by an R-tree over their bounding
+    boxes, so a lookup runs exact point-in-polygon tests only on the few
+    polygons whose box holds the point. The nearest town comes from the
+    gazetteer through the same grid index used for heritage sites. Results
+    are cached by coordinates rounded to precision decimals (3: ~110 m),
+    and computed for the rounded point, so a cached answer never depends
+    on which nearby point was looked up first.
+    """
+
+    def __init__(self, polygons, towns, precision=None, cache_entries=None, max_town_km=None):
+        self.precision = precision if precision is not None else int(os.getenv("GEOCODE_CACHE_PRECISION", "3"))
+        self.max_town_km = max_town_km or float(os.getenv("GEOCODE_MAX_TOWN_KM", "50"))
+        self.polygons = polygons
+        self.districts = sorted({district for district, _ in polygons})
+        self.tree = BoundingBoxTree([(bounding_box(rings[0]), i) for i, (_, rings) in enumerate(polygons)])
+        self.towns = HeritageSiteIndex(towns)
+        self._cache = LRUTTLCache(
+            max_entries=cache_entries or int(os.getenv("GEOCODE_CACHE_MAX_ENTRIES", "50000")),
+            ttl_seconds=24 * 3600
+        )
+        self.lookups = 0
+        self.polygon_tests = 0
+
+    @classmethod
+    def from_files(cls, districts_path=DEFAULT_DISTRICTS_PATH, towns_path=DEFAULT_TOWNS_PATH, **kwargs):
+        return cls(load_district_polygons(districts_path), load_towns(towns_path), **kwargs)
+
+    def locate(self, latitude, longitude):
+        """{"district", "town", "town_km"} for a coordinate; district is None
+        outside every polygon and town is None beyond max_town_km"""
+        key = (round(latitude, self.precision), round(longitude, self.precision))
+        place = self._cache.get(key)
+        if place is not None:
+            GEOCODE_LOOKUPS.labels("cached").inc()
+            return place
+        place = self.resolve(*key)
+        self._cache.set(key, place)
+        GEOCODE_LOOKUPS.labels("resolved" if place["district"] else "outside").inc()
+        return place
+
+    def resolve(self, latitude, longitude):
+        """locate() without the cache"""
+        self.lookups += 1
+        nearest = self.towns.nearest(latitude, longitude, k=1, max_distance_km=self.max_town_km)
+        town_km, town = nearest[0] if nearest else (None, None)
+        return {
+            "district": self.district(latitude, longitude),
+            "town": town["name"] if town else None,
+            "town_km": round(town_km, 1) if town else None,
+        }
+
+    def district(self, latitude, longitude):
+        """District whose polygon contains the point, or None"""
+        for i in self.tree.query(longitude, latitude):
+            self.polygon_tests += 1
+            district, rings = self.polygons[i]
+            if point_in_polygon(longitude, latitude, rings):
+                return district
+        return None
+
+    def stats(self):
+        return {
+            "districts": len(self.districts),
+            "polygons": len(self.polygons),
+            "towns": len(self.towns),
+            "precision": self.precision,
+            "resolved": self.lookups,
+            "polygon_tests_per_lookup": round(self.polygon_tests / self.lookups, 2) if self.lookups else 0.0,
+            "cache": self._cache.stats(),
+        }
@@ -0,0 +1,61 @@
+import base64
+import hashlib
+import hmac
+import json
+import os
+import secrets
+import time
+
+
+class InvalidTokenError(Exception):
+    """Raised for tokens that are malformed, tampered with or expired"""
+
+
+def _b64encode(raw):
+    return base64.urlsafe_b64encode(raw).decode().rstrip("=")
+
+
+def _b64decode(text):
+    return base64.urlsafe_b64decode(text + "=" * (-len(text) % 4))
+
+
+class SessionTokenSigner:
+    """Stateless HMAC-SHA256 signed session tokens.
+
+    A token is base64url(payload) + "." + base64url(signature), where the
+    payload holds the user id and an expiry timestamp. Verification is a
+    single HMAC in-process, with no database round trip.
+    """
+
+    def __init__(self, secret=None, ttl_seconds=None):
+        secret = secret or os.getenv("SESSION_SECRET")
+        if not secret:
+            print("⚠️  SESSION_SECRET not set; using a random secret. "
+                  "Sessions will not survive restarts or work across replicas.")
+            secret = secrets.token_hex(32)
+        self._key = secret.encode("utf-8") if isinstance(secret, str) else secret
+        self.ttl_seconds = ttl_seconds or int(os.getenv("SESSION_TTL_SECONDS", str(7 * 24 * 3600)))
+
+    def _sign(self, payload):
+        return hmac.new(self._key, payload.encode("ascii"), hashlib.sha256).digest()
+
+    def issue(self, user_id):
+        """Create a token for user_id that expires after ttl_seconds"""
+        body = json.dumps({"sub": user_id, "exp": int(time.time()) + self.ttl_seconds}, separators=(",", ":"))
+        payload = _b64encode(body.encode("utf-8"))
+        return f"{payload}.{_b64encode(self._sign(payload))}"
+
+    def verify(self, token):
+        """Return the user id in a valid token, else raise InvalidTokenError"""
+        try:
+            payload, signature = token.split(".")
+            if not hmac.compare_digest(_b64decode(signature), self._sign(payload)):
+                raise InvalidTokenError("Invalid session token")
+            claims = json.loads(_b64decode(payload))
+        except InvalidTokenError:
+            raise
+        except Exception:
+            raise InvalidTokenError("Malformed session token")
+        if claims.get("exp", 0) < time.time():
+            raise InvalidTokenError("Session expired, please login again")
+        return claims["sub"]
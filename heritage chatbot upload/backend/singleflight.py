@@ -0,0 +1,130 @@
+import asyncio
+import hashlib
+
+
+class Flight:
+    """One upstream generation shared by every identical in-flight request.
+
+    Chunks are appended to a shared list and each subscriber keeps its own
+    read position, so a slow or late subscriber replays everything produced
+    so far and then follows live chunks without holding back the others.
+    """
+
+    def __init__(self, key):
+        self.key = key
+        self.chunks = []
+        self.done = False
+        self.error = None
+        self.subscribers = 0
+        self.task = None
+        self._updated = asyncio.Event()
+
+    def _notify(self):
+        # Wake current waiters and arm a fresh event for the next update
+        updated, self._updated = self._updated, asyncio.Event()
+        updated.set()
+
+    def append(self, chunk):
+        self.chunks.append(chunk)
+        self._notify()
+
+    def finish(self, error=None):
+        self.done = True
+        self.error = error
+        self._notify()
+
+    async def subscribe(self, on_leave=None):
+        """Yield every chunk of the generation from the beginning"""
+        self.subscribers += 1
+        position = 0
+        try:
+            while True:
+                if position < len(self.chunks):
+                    chunk = self.chunks[position]
+                    position += 1
+                    yield chunk
+                    continue
+                if self.done:
+                    if self.error is not None:
+                        raise self.error
+                    return
+                await self._updated.wait()
+        finally:
+            self.subscribers -= 1
+            if on_leave is not None:
+                on_leave(self)
+
+
+class StreamCoalescer:
+    """Single-flight coalescing of identical streaming generations.
+
+    The first request for a key starts the upstream stream in a background
+    task; identical requests that arrive while it runs subscribe to the same
+    Flight instead of opening another upstream stream. The upstream keeps
+    running while at least one subscriber is attached and is cancelled when
+    the last one disconnects.
+    """
+
+    def __init__(self):
+        self._flights = {}
+        self.leaders = 0
+        self.followers = 0
+        self.cancelled = 0
+
+    @staticmethod
+    def make_key(prompt, **params):
+        """Key on the exact prompt plus any generation parameters"""
+        digest = hashlib.sha256(prompt.encode("utf-8"))
+        for name in sorted(params):
+            digest.update(f"\0{name}={params[name]}".encode("utf-8"))
+        return digest.hexdigest()
+
+    def join(self, key, start_stream, on_complete=None):
+        """Return an async iterator of chunks for key.
+
+        start_stream() must return an async iterator of chunks; it is only
+        called when no identical generation is in flight. on_complete(chunks)
+        runs once if the upstream finishes successfully.
+        """
+        flight = self._flights.get(key)
+        if flight is None or flight.done:
+            flight = Flight(key)
+            self._flights[key] = flight
+            flight.task = asyncio.get_running_loop().create_task(
+                self._drive(flight, start_stream(), on_complete)
+            )
+            self.leaders += 1
+        else:
+            self.followers += 1
+        return flight.subscribe(on_leave=self._on_leave)
+
+    async def _drive(self, flight, stream, on_complete):
+        try:
+            async for chunk in stream:
+                flight.append(chunk)
+        except asyncio.CancelledError:
+            flight.finish(ConnectionAbortedError("Generation cancelled"))
+            raise
+        except Exception as e:
+            flight.finish(e)
+        else:
+            flight.finish()
+            if on_complete is not None:
+                on_complete(flight.chunks)
+        finally:
+            if self._flights.get(flight.key) is flight:
+                del self._flights[flight.key]
+
+    def _on_leave(self, flight):
+        # Nobody is listening any more: stop paying for the upstream stream
+        if flight.subscribers == 0 and not flight.done and flight.task is not None:
+            flight.task.cancel()
+            self.cancelled += 1
+
+    def stats(self):
+        return {
+            "in_flight": len(self._flights),
+            "leaders": self.leaders,
+            "coalesced": self.followers,
+            "cancelled": self.cancelled,
+        }
@@ -0,0 +1,111 @@
+import asyncio
+import json
+import os
+
+
+def sse_event(payload, event_id=None):
+    """One SSE frame for a JSON payload, with an id line if event_id is given"""
+    data = f"data: {json.dumps(payload)}\n\n"
+    return f"id: {event_id}\n{data}" if event_id is not None else data
+
+
+class ChunkCoalescer:
+    """Merge small LLM deltas into fewer, larger SSE frames.
+
+    The first delta is sent on its own so time to first token is unchanged.
+    After that, deltas are buffered until max_bytes have accumulated or the
+    oldest buffered delta is flush_interval seconds old, whichever comes
+    first; the timer also fires while the upstream is stalled. A
+    flush_interval of 0 sends every delta as its own frame.
+    """
+
+    def __init__(self, flush_interval=None, max_bytes=None):
+        self.flush_interval = flush_interval if flush_interval is not None else (
+            float(os.getenv("SSE_FLUSH_INTERVAL_MS", "50")) / 1000
+        )
+        self.max_bytes = max_bytes or int(os.getenv("SSE_FLUSH_BYTES", "512"))
+
+    def batches(self, chunks):
+        """Coalesce chunks that are all available up front (cache replays)"""
+        if self.flush_interval <= 0:
+            yield from chunks
+            return
+        pending = []
+        size = 0
+        for i, text in enumerate(chunks):
+            if i == 0:
+                yield text
+                continue
+            pending.append(text)
+            size += len(text.encode("utf-8"))
+            if size >= self.max_bytes:
+                yield "".join(pending)
+                pending = []
+                size = 0
+        if pending:
+            yield "".join(pending)
+
+    async def coalesce(self, stream):
+        """Yield joined text from an async iterator of deltas"""
+        if self.flush_interval <= 0:
+            async for text in stream:
+                yield text
+            return
+
+        iterator = stream.__aiter__()
+        # First token goes straight through
+        try:
+            yield await iterator.__anext__()
+        except StopAsyncIteration:
+            return
+
+        # A pump task drains the upstream into a buffer; this generator only
+        # wakes once per frame, not once per delta
+        pending = []
+        state = {"size": 0, "finished": False, "error": None}
+        wakeup = asyncio.Event()
+
+        async def pump():
+            try:
+                async for text in iterator:
+                    pending.append(text)
+                    state["size"] += len(text.encode("utf-8"))
+                    if len(pending) == 1 or state["size"] >= self.max_bytes:
+                        wakeup.set()
+            except Exception as e:
+                state["error"] = e
+            finally:
+                state["finished"] = True
+                wakeup.set()
+
+        loop = asyncio.get_running_loop()
+        task = loop.create_task(pump())
+        try:
+            while True:
+                if not pending and not state["finished"]:
+                    wakeup.clear()
+                    await wakeup.wait()
+                if pending and not state["finished"] and state["size"] < self.max_bytes:
+                    # Give more deltas until the interval elapses or the frame fills up
+                    wakeup.clear()
+                    try:
+                        async with asyncio.timeout(self.flush_interval):
+                            while not state["finished"] and state["size"] < self.max_bytes:
+                                await wakeup.wait()
+                                wakeup.clear()
+                    except TimeoutError:
+                        pass
+                if pending:
+                    text = "".join(pending)
+                    pending.clear()
+                    state["size"] = 0
+                    yield text
+                elif state["finished"]:
+                    break
+            if state["error"] is not None:
+                raise state["error"]
+        finally:
+            if not task.done():
+                # Consumer went away: stop reading so the upstream can be released
+                task.cancel()
+                await asyncio.gather(task, return_exceptions=True)
@@ -0,0 +1,94 @@
+import asyncio
+import os
+import random
+import time
+
+from metrics import registry
+
+DB_CONNECT_ATTEMPTS = registry.counter(
+    "db_connect_attempts_total", "Background MongoDB connection attempts", labels=("outcome",)
+)
+
+
+class DatabaseConnector:
+    """Connects the database in the background so the server starts at once.
+
+    connect and ensure_indexes are coroutine functions (wrap blocking ones
+    with run_in_threadpool). connect() is retried with jittered exponential
+    backoff, from retry_initial up to retry_max seconds between attempts,
+    until it returns True; ensure_indexes() then runs once, retried the same
+    way if it raises. Requests that reach the database before it is
+    connected get a 503 and the readiness probe reports not ready.
+    """
+
+    def __init__(self, connect, ensure_indexes, retry_initial=None, retry_max=None):
+        self.connect = connect
+        self.ensure_indexes = ensure_indexes
+        self.retry_initial = retry_initial or float(os.getenv("DB_CONNECT_RETRY_INITIAL", "0.5"))
+        self.retry_max = retry_max or float(os.getenv("DB_CONNECT_RETRY_MAX", "30"))
+        self.connected = False
+        self.indexes_ready = False
+        self.attempts = 0
+        self.last_error = None
+        self.connect_seconds = None
+        self._started = None
+        self._task = None
+
+    def start(self):
+        """Start the background loop (needs a running event loop)"""
+        if self._task is None:
+            self._started = time.perf_counter()
+            self._task = asyncio.create_task(self._run())
+
+    async def stop(self):
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+
+    def _backoff(self, failures):
+        delay = min(self.retry_max, self.retry_initial * 2 ** (failures - 1))
+        return delay * random.uniform(0.5, 1.0)
+
+    async def _run(self):
+        failures = 0
+        while not self.connected:
+            self.attempts += 1
+            try:
+                self.connected = bool(await self.connect())
+                if not self.connected:
+                    self.last_error = "connect() returned False"
+            except Exception as e:
+                self.last_error = str(e)
+            DB_CONNECT_ATTEMPTS.labels("success" if self.connected else "failure").inc()
+            if not self.connected:
+                failures += 1
+                delay = self._backoff(failures)
+                print(f"   MongoDB not reachable (attempt {self.attempts}), retrying in {delay:.1f}s")
+                await asyncio.sleep(delay)
+        self.connect_seconds = time.perf_counter() - self._started
+        self.last_error = None
+
+        failures = 0
+        while not self.indexes_ready:
+            try:
+                await self.ensure_indexes()
+                self.indexes_ready = True
+            except Exception as e:
+                failures += 1
+                self.last_error = f"ensure_indexes: {e}"
+                print(f"✗ MongoDB index creation failed: {e}")
+                await asyncio.sleep(self._backoff(failures))
+        self.last_error = None
+
+    def stats(self):
+        return {
+            "connected": self.connected,
+            "indexes_ready": self.indexes_ready,
+            "attempts": self.attempts,
+            "last_error": self.last_error,
+            "connect_seconds": round(self.connect_seconds, 3) if self.connect_seconds is not None else None,
+        }
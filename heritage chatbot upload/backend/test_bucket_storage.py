@@ -0,0 +1,159 @@
+"""
+Bucketed message storage against one document per message, on mongomock.
+
+Covers keyset cursors in both layouts, saves that raced a bucket
+rollover, deletion batches trimming a bucket that straddles the bound,
+completed deletions leaving no empty buckets, tombstones hiding cleared messages, the write-behind flush and the
+migration tool.
+
+Usage:
+    python -m pytest test_bucket_storage.py
+"""
+from datetime import datetime, timedelta
+from types import SimpleNamespace
+
+import pytest
+from bson import ObjectId
+
+pytest.importorskip("mongomock")
+
+import migrate_messages_to_buckets
+from bucket_storage import BucketedMongoDatabase, compact_message, new_bucket
+from conftest import USER, exported, history, oldest_first, open_database, store, texts, walk_back, walk_forward
+from deletion_jobs import CLEAR_HISTORY, new_deletion_job
+from mongo_database import MongoDatabase, build_message_document, encode_cursor
+from write_behind import WriteBehindBuffer
+
+
+@pytest.mark.parametrize("limit", [1, 6, 10, 100])
+def test_keyset_cursors_match_across_storage_modes(limit):
+    docs = history(60)
+    documents, buckets = open_database(MongoDatabase), open_database(BucketedMongoDatabase)
+    store(documents, docs)
+    store(buckets, docs)
+
+    pages = walk_back(buckets, limit)
+    assert pages == walk_back(documents, limit)
+    assert oldest_first(pages) == [doc["content"] for doc in docs]
+
+    after = encode_cursor(docs[12])
+    forward = walk_forward(buckets, after, limit)
+    assert forward == walk_forward(documents, after, limit)
+    assert [text for page in forward for text in page] == [doc["content"] for doc in docs[13:]]
+
+    fields = ["id", "text", "latitude"]
+    assert list(buckets.iter_chat_history(USER, fields=fields)) == list(documents.iter_chat_history(USER, fields=fields))
+
+
+def test_buckets_hold_one_day_up_to_bucket_size():
+    database = open_database(BucketedMongoDatabase, bucket_size=7)
+    store(database, history(60))
+    for bucket in database.buckets.find():
+        assert bucket["count"] == len(bucket["messages"]) <= 7
+        assert bucket["start"].date() == bucket["end"].date()
+
+
+def test_retried_append_skips_stored_messages():
+    database = open_database(BucketedMongoDatabase)
+    docs = history(10)
+    store(database, docs)
+    database._insert_messages([dict(docs[5]), dict(docs[6])], retry=True)
+    assert database._count_stored_messages(USER, None, []) == 10
+
+
+def test_pages_absorb_buckets_that_raced_a_rollover():
+    # Two saves found the open bucket full at the same time: both started a
+    # bucket, so the day's last two buckets overlap in time
+    database = open_database(BucketedMongoDatabase, bucket_size=4)
+    docs = history(12, step=timedelta(seconds=1), start=datetime(2024, 1, 2, 9))
+    compact = [compact_message(doc) for doc in docs]
+    database.buckets.insert_many([
+        new_bucket(USER, compact[0:4]),
+        new_bucket(USER, compact[4:12:2]),
+        new_bucket(USER, compact[5:12:2]),
+    ])
+
+    expected = [doc["content"] for doc in docs]
+    for limit in (1, 3, 5):
+        assert oldest_first(walk_back(database, limit)) == expected
+    assert exported(database) == expected
+    assert database._newest_stored_key(USER) == (docs[-1]["timestamp"], docs[-1]["_id"])
+
+
+def test_deletion_trims_the_bucket_straddling_the_bound(database):
+    docs = history(30)
+    # Three messages in one millisecond, the bound in the middle of them
+    same_ms = docs[20]["timestamp"]
+    for doc in docs[21:23]:
+        doc["timestamp"] = same_ms
+    store(database, docs)
+    job = new_deletion_job(USER, CLEAR_HISTORY, through=(same_ms, docs[21]["_id"]))
+
+    deleted = 0
+    while (batch := database._delete_message_batch(job, 10)) is not None:
+        deleted += batch
+    assert deleted == 22
+    assert exported(database) == [doc["content"] for doc in docs[22:]]
+
+
+def test_completed_deletion_leaves_no_buckets():
+    # The bound is the newest message, so the last bucket is trimmed to nothing
+    database = open_database(BucketedMongoDatabase, bucket_size=7)
+    store(database, history(30))
+    result = database.clear_chat_history(USER)
+    database._run_deletion_job(database.deletion_jobs.find_one({"_id": result["job_id"]}))
+    assert database.get_deletion_job(USER, result["job_id"])["status"] == "done"
+    assert database.buckets.count_documents({}) == 0
+
+
+def test_tombstone_hides_cleared_messages_until_deleted(database):
+    docs = history(20)
+    store(database, docs)
+    result = database.clear_chat_history(USER)
+    assert result["success"]
+    assert texts(database.get_chat_history_page(USER)) == []
+
+    later = build_message_document(USER, "user", "after the clear")
+    later["_id"] = ObjectId()
+    database._insert_messages([later])
+    assert texts(database.get_chat_history_page(USER)) == ["after the clear"]
+    assert database._count_stored_messages(USER, database._hidden_before(USER), []) == 1
+
+    job = database.deletion_jobs.find_one({"_id": result["job_id"]})
+    database._run_deletion_job(job)
+    assert database.get_deletion_job(USER, result["job_id"])["status"] == "done"
+    assert database._hidden_before(USER) is None
+    assert exported(database) == ["after the clear"]
+
+
+def test_write_behind_flush(database):
+    database.write_buffer = WriteBehindBuffer(batch_size=100, flush_interval=60)
+    for i in range(5):
+        database.save_message(USER, "user", f"queued {i}")
+    # Read-your-writes before anything is stored
+    assert texts(database.get_chat_history_page(USER)) == [f"queued {i}" for i in range(5)]
+    assert database._count_stored_messages(USER, None, []) == 0
+
+    database._write_batch(database.write_buffer.take_batch(force=True))
+    assert database.write_buffer.pending_for(USER) == []
+    assert exported(database) == [f"queued {i}" for i in range(5)]
+
+    # Cleared while a batch was in flight: the batch is removed once written
+    database.save_message(USER, "user", "in flight")
+    batch = database.write_buffer.take_batch(force=True)
+    database.write_buffer.discard_user(USER)
+    database._write_batch(batch)
+    assert database._count_stored_messages(USER, None, []) == 5
+
+
+def test_migration_copies_every_message_into_buckets():
+    docs = history(60)
+    source = open_database(MongoDatabase)
+    store(source, docs)
+    target = open_database(BucketedMongoDatabase, bucket_size=7)
+    target.messages = source.messages
+    args = SimpleNamespace(batch_size=9, insert_buckets=2, dry_run=False)
+
+    migrate_messages_to_buckets.migrate_user(target, USER, args)
+    assert migrate_messages_to_buckets.verify_user(target, USER, len(docs))
+    assert walk_back(target, 10) == walk_back(source, 10)
@@ -0,0 +1,169 @@
+"""
+Message archive with MongoDB storage, on mongomock and a temporary directory.
+
+Covers pages and exports merging stored and archived messages, a batch
+archived but not removed before a crash, torn index records, tombstones
+hiding archived messages, drops that leave no stale segments and reads
+racing a drop.
+
+Usage:
+    python -m pytest test_message_archive.py
+"""
+import os
+from datetime import datetime, timedelta
+
+import pytest
+from bson import ObjectId
+
+pytest.importorskip("mongomock")
+
+from conftest import USER, exported, history, oldest_first, open_database, store, texts, walk_back, walk_forward
+from message_archive import INDEX_FILE, INDEX_RECORD, MessageArchive
+from mongo_database import build_message_document, encode_cursor
+
+START = datetime(2024, 1, 1, 8)
+
+
+@pytest.fixture
+def database(database_class, tmp_path):
+    """40 messages an hour apart"""
+    archive = MessageArchive(directory=str(tmp_path), block_messages=4, segment_max_bytes=512, pause_ms=0)
+    database = open_database(database_class, bucket_size=5, archive=archive)
+    store(database, history(40, step=timedelta(hours=1), start=START))
+    return database
+
+
+def cutoff(index):
+    """Archive everything before the index-th message"""
+    return START + timedelta(hours=index)
+
+
+def read_back(database, limit):
+    return oldest_first(walk_back(database, limit))
+
+
+def all_texts(count=40):
+    return [f"m{i}" for i in range(count)]
+
+
+def user_files(archive):
+    path = archive._user_dir(USER)
+    return sorted(os.listdir(path)) if os.path.isdir(path) else []
+
+
+@pytest.mark.parametrize("limit", [1, 3, 10, 100])
+def test_pages_and_exports_merge_stored_and_archived(database, limit):
+    assert database.archive_user(USER, cutoff(25)) == 25
+    assert database._count_stored_messages(USER, None, []) == 15
+    assert database.archive.count(USER) == 25
+
+    assert read_back(database, limit) == all_texts()
+    after = encode_cursor(list(database.archive.iter_messages(USER))[5])
+    assert [text for page in walk_forward(database, after, limit) for text in page] == all_texts()[6:]
+    assert exported(database) == all_texts()
+
+
+def test_archive_grows_forwards_across_passes(database):
+    database.archive_user(USER, cutoff(10))
+    database.archive_user(USER, cutoff(30))
+    assert database.archive.count(USER) == 30
+    assert len(database.archive.blocks(USER)) > 1
+    assert exported(database) == all_texts()
+
+
+def test_batch_archived_before_a_crash_is_not_duplicated(database):
+    # The archive append succeeded but the process died before the stored
+    # copies were removed: the next pass only removes them
+    stored = list(database._iter_message_docs(USER, None, None, 100))
+    with database.archive.lock(USER):
+        database.archive.append(USER, stored[:12])
+    assert exported(database) == all_texts()
+    assert read_back(database, 7) == all_texts()
+
+    assert database.archive_user(USER, cutoff(20)) == 20
+    assert database.archive.count(USER) == 20
+    assert database._count_stored_messages(USER, None, []) == 20
+    assert exported(database) == all_texts()
+
+
+def test_torn_index_record_is_ignored_and_truncated(database):
+    database.archive_user(USER, cutoff(10))
+    index_path = os.path.join(database.archive._user_dir(USER), INDEX_FILE)
+    with open(index_path, "ab") as index:
+        index.write(b"torn")
+    assert exported(database) == all_texts()
+
+    database.archive_user(USER, cutoff(20))
+    assert os.path.getsize(index_path) % INDEX_RECORD.size == 0
+    assert database.archive.count(USER) == 20
+    assert exported(database) == all_texts()
+
+
+def test_tombstone_hides_archived_messages_until_dropped(database):
+    database.archive_user(USER, cutoff(30))
+    result = database.clear_chat_history(USER)
+    assert read_back(database, 10) == []
+    assert exported(database) == []
+
+    later = build_message_document(USER, "user", "after the clear")
+    later["_id"] = ObjectId()
+    database._insert_messages([later])
+    assert read_back(database, 10) == ["after the clear"]
+
+    database._run_deletion_job(database.deletion_jobs.find_one({"_id": result["job_id"]}))
+    assert database.get_deletion_job(USER, result["job_id"])["status"] == "done"
+    assert database.archive.count(USER) == 0
+    assert user_files(database.archive) == []
+    assert exported(database) == ["after the clear"]
+
+
+def test_drop_through_keeps_newer_messages_and_no_stale_segments(database):
+    database.archive_user(USER, cutoff(30))
+    # Segments left by a drop that crashed before it removed them
+    stale = os.path.join(database.archive._user_dir(USER), "999999.seg")
+    with open(stale, "wb") as f:
+        f.write(b"partial")
+    docs = list(database.archive.iter_messages(USER))
+    through = (docs[17]["timestamp"], docs[17]["_id"])
+
+    with database.archive.lock(USER):
+        assert database.archive.drop_through(USER, through) == 18
+    assert [doc["content"] for doc in database.archive.iter_messages(USER)] == all_texts(30)[18:]
+    referenced = {f"{block.segment:06d}.seg" for block in database.archive.blocks(USER)}
+    assert set(user_files(database.archive)) == referenced | {INDEX_FILE}
+
+    with database.archive.lock(USER):
+        assert database.archive.drop_through(USER, through) == 0
+        assert database.archive.drop_through(USER) == 12
+    assert user_files(database.archive) == []
+
+
+def drop_during_read(archive, through, on_call):
+    """Commit drop_through(through) just before the on_call-th block read"""
+    read_block = archive.read_block
+    calls = []
+
+    def racing_read(user_id, block):
+        calls.append(block)
+        if len(calls) == on_call:
+            archive.read_block = read_block
+            with archive.lock(USER):
+                archive.drop_through(USER, through)
+        return read_block(user_id, block)
+
+    archive.read_block = racing_read
+
+
+def test_reads_racing_a_drop_continue_from_the_new_index(database):
+    database.archive_user(USER, cutoff(30))
+    docs = list(database.archive.iter_messages(USER))
+    through = (docs[17]["timestamp"], docs[17]["_id"])
+
+    # The page had listed blocks whose segment the drop then removed
+    drop_during_read(database.archive, through, on_call=1)
+    assert texts(database.get_chat_history_page(USER, limit=100)) == all_texts()[18:]
+
+    # Four messages were exported before the drop: the export goes on after them
+    database.archive_user(USER, cutoff(35))
+    drop_during_read(database.archive, (docs[25]["timestamp"], docs[25]["_id"]), on_call=2)
+    assert exported(database) == all_texts()[18:22] + all_texts()[26:]
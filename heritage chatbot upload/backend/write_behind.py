@@ -0,0 +1,201 @@
+import os
+import threading
+import time
+from collections import deque, OrderedDict
+
+
+class QueueFullError(Exception):
+    """Raised when the write-behind queue stays full past the put timeout"""
+
+
+class WriteBehindBuffer:
+    """Bounded in-process queue of message documents awaiting insert_many.
+
+    Documents stay visible through pending_for() from the moment they are
+    queued until their batch has been written, so readers can merge them
+    with database results (read-your-writes). A flusher takes batches either
+    when batch_size documents are queued or when the oldest queued document
+    has waited flush_interval seconds.
+    """
+
+    def __init__(self, max_size=None, batch_size=None, flush_interval=None, put_timeout=None):
+        self.max_size = max_size or int(os.getenv("WRITE_BEHIND_QUEUE_SIZE", "10000"))
+        self.batch_size = batch_size or int(os.getenv("WRITE_BEHIND_BATCH_SIZE", "200"))
+        self.flush_interval = flush_interval or float(os.getenv("WRITE_BEHIND_FLUSH_INTERVAL", "0.5"))
+        self.put_timeout = put_timeout if put_timeout is not None else float(
+            os.getenv("WRITE_BEHIND_PUT_TIMEOUT", "2.0")
+        )
+        self._queue = deque()  # (queued_at, doc)
+        self._pending = {}  # user_id -> OrderedDict(_id -> doc), queued or in flight
+        self._discarded = set()  # _ids of in-flight docs whose user cleared history
+        self._cond = threading.Condition()
+        self._closing = False
+        self.queued = 0
+        self.flushed = 0
+        self.dropped = 0
+        self.failed_batches = 0
+        self.batches = 0
+
+    # ==================== PRODUCERS ====================
+
+    def try_offer(self, doc):
+        """Queue a document without blocking. Returns False if the queue is full."""
+        with self._cond:
+            if len(self._queue) >= self.max_size:
+                return False
+            self._enqueue(doc)
+            return True
+
+    def offer(self, doc, timeout=None):
+        """Queue a document, blocking while the queue is full (back-pressure).
+
+        Raises QueueFullError once timeout seconds pass without room.
+        """
+        timeout = self.put_timeout if timeout is None else timeout
+        deadline = time.monotonic() + timeout
+        with self._cond:
+            while len(self._queue) >= self.max_size:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    self.dropped += 1
+                    raise QueueFullError("Message write queue is full")
+                self._cond.wait(remaining)
+            self._enqueue(doc)
+
+    def record_drop(self):
+        with self._cond:
+            self.dropped += 1
+
+    def _enqueue(self, doc):
+        self._queue.append((time.monotonic(), doc))
+        self._pending.setdefault(doc["user_id"], OrderedDict())[doc["_id"]] = doc
+        self.queued += 1
+        if len(self._queue) >= self.batch_size:
+            self._cond.notify_all()
+
+    # ==================== FLUSHER ====================
+
+    def _ready(self):
+        if not self._queue:
+            return False
+        if self._closing or len(self._queue) >= self.batch_size:
+            return True
+        return time.monotonic() - self._queue[0][0] >= self.flush_interval
+
+    def _pop_batch(self):
+        batch = []
+        while self._queue and len(batch) < self.batch_size:
+            batch.append(self._queue.popleft()[1])
+        # Wake producers blocked on a full queue
+        self._cond.notify_all()
+        return batch
+
+    def take_batch(self, force=False):
+        """Return the next batch if a size/time trigger fired (or force), else []"""
+        with self._cond:
+            if force or self._ready():
+                return self._pop_batch()
+            return []
+
+    def wait_batch(self):
+        """Block until a batch is ready or the buffer is closed and empty"""
+        with self._cond:
+            while not self._ready():
+                if self._closing:
+                    return []
+                if self._queue:
+                    age = time.monotonic() - self._queue[0][0]
+                    self._cond.wait(max(self.flush_interval - age, 0.001))
+                else:
+                    self._cond.wait(self.flush_interval)
+            return self._pop_batch()
+
+    def next_flush_in(self):
+        """Seconds until the time trigger fires for the oldest queued document"""
+        with self._cond:
+            if not self._queue:
+                return self.flush_interval
+            age = time.monotonic() - self._queue[0][0]
+            return max(self.flush_interval - age, 0.0)
+
+    def mark_flushed(self, batch):
+        """Forget a written batch. Returns _ids that were cleared while in flight."""
+        with self._cond:
+            discarded = []
+            for doc in batch:
+                user_docs = self._pending.get(doc["user_id"])
+                if user_docs is not None:
+                    user_docs.pop(doc["_id"], None)
+                    if not user_docs:
+                        del self._pending[doc["user_id"]]
+                if doc["_id"] in self._discarded:
+                    self._discarded.discard(doc["_id"])
+                    discarded.append(doc["_id"])
+            self.flushed += len(batch)
+            self.batches += 1
+            return discarded
+
+    def mark_failed(self, batch):
+        """Drop a batch that could not be written"""
+        with self._cond:
+            for doc in batch:
+                user_docs = self._pending.get(doc["user_id"])
+                if user_docs is not None:
+                    user_docs.pop(doc["_id"], None)
+                    if not user_docs:
+                        del self._pending[doc["user_id"]]
+                self._discarded.discard(doc["_id"])
+            self.dropped += len(batch)
+            self.failed_batches += 1
+
+    def close(self):
+        """Stop accepting waits; flushers drain what is left and exit"""
+        with self._cond:
+            self._closing = True
+            self._cond.notify_all()
+
+    @property
+    def closed(self):
+        return self._closing
+
+    # ==================== READERS ====================
+
+    def pending_for(self, user_id):
+        """Unflushed documents for a user, oldest first"""
+        with self._cond:
+            return list(self._pending.get(user_id, {}).values())
+
+    def discard_user(self, user_id):
+        """Drop a user's queued documents; in-flight ones are deleted after insert"""
+        with self._cond:
+            user_docs = self._pending.pop(user_id, None)
+            if not user_docs:
+                return 0
+            queued_ids = set()
+            remaining = deque()
+            for queued_at, doc in self._queue:
+                if doc["user_id"] == user_id:
+                    queued_ids.add(doc["_id"])
+                else:
+                    remaining.append((queued_at, doc))
+            self._queue = remaining
+            self._discarded.update(_id for _id in user_docs if _id not in queued_ids)
+            self._cond.notify_all()
+            return len(user_docs)
+
+    def __len__(self):
+        return len(self._queue)
+
+    def stats(self):
+        with self._cond:
+            return {
+                "queue_depth": len(self._queue),
+                "max_size": self.max_size,
+                "batch_size": self.batch_size,
+                "flush_interval": self.flush_interval,
+                "queued": self.queued,
+                "flushed": self.flushed,
+                "dropped": self.dropped,
+                "batches": self.batches,
+                "failed_batches": self.failed_batches,
+            }
@@ -9,6 +9,7 @@ function App() {
   const [query, setQuery] = useState("");
   const [messages, setMessages] = useState([]);
   const [isLoading, setIsLoading] = useState(false);
+  const [queuePosition, setQueuePosition] = useState(null);
   const [location, setLocation] = useState({});
   const [chats, setChats] = useState([]);
   const [currentChatIndex, setCurrentChatIndex] = useState(0);
@@ -125,6 +126,7 @@ function App() {
 
   const logout = () => {
     localStorage.removeItem("heritage_user_id");
+    localStorage.removeItem("heritage_session_token");
     localStorage.removeItem("heritage_user_name");
     localStorage.removeItem("heritage_user_email");
     setUser(null);
@@ -165,6 +167,7 @@ function App() {
         longitude: location.longitude,
         language: language
       }, (chunk) => {
+        setQueuePosition(null);
         // Update the specific assistant message by ID
         setMessages(prev => {
           return prev.map(msg => 
@@ -173,6 +176,9 @@ function App() {
               : msg
           );
         });
+      }, (position) => {
+        // Busy server: show where the question stands until it is answered
+        setQueuePosition(position);
       });
 
       // Speak the full response
@@ -187,6 +193,7 @@ function App() {
       setMessages(prev => [...prev, errorMessage]);
     } finally {
       setIsLoading(false);
+      setQueuePosition(null);
     }
   };
 
@@ -279,6 +286,13 @@ function App() {
                   <span></span>
                   <span></span>
                 </div>
+                {queuePosition !== null && (
+                  <div className="queue-position">
+                    {queuePosition === 1
+                      ? "You're next in line..."
+                      : `Waiting in line (position ${queuePosition})...`}
+                  </div>
+                )}
               </div>
             </div>
           )}
@@ -38,6 +38,7 @@ function Auth({ onLogin }) {
 
       // Save user info and login
       localStorage.setItem("heritage_user_id", data.user_id);
+      localStorage.setItem("heritage_session_token", data.token);
       localStorage.setItem("heritage_user_name", data.name);
       localStorage.setItem("heritage_user_email", data.email || formData.email);
 
@@ -7,8 +7,20 @@ const getUserId = () => {
   return localStorage.getItem("heritage_user_id");
 };
 
+// Get signed session token from localStorage
+const getSessionToken = () => {
+  return localStorage.getItem("heritage_session_token");
+};
+
 // Get headers with user authentication
 const getHeaders = () => {
+  const token = getSessionToken();
+  if (token) {
+    return {
+      "Content-Type": "application/json",
+      "Authorization": `Bearer ${token}`
+    };
+  }
   const userId = getUserId();
   return {
     "Content-Type": "application/json",
@@ -16,15 +28,47 @@ const getHeaders = () => {
   };
 };
 
-export const askAI = async ({ message, latitude, longitude, language = "en" }, onStreamChunk) => {
+const MAX_RESUME_ATTEMPTS = 3;
+
+// Read SSE events from a response body, calling onEvent(id, data) for each.
+// Stops early and returns the value if onEvent returns something truthy.
+const readEvents = async (body, onEvent) => {
+  const reader = body.getReader();
+  const decoder = new TextDecoder();
+  let buffer = "";
+  let eventId = "";
+
+  while (true) {
+    const { done, value } = await reader.read();
+    if (done) return null;
+
+    buffer += decoder.decode(value, { stream: true });
+    const lines = buffer.split("\n");
+    // Keep a trailing partial line for the next read
+    buffer = lines.pop();
+
+    for (const line of lines) {
+      if (line.startsWith("id: ")) {
+        eventId = line.slice(4);
+      } else if (line.startsWith("data: ")) {
+        try {
+          const result = onEvent(eventId, JSON.parse(line.slice(6)));
+          if (result) return result;
+        } catch (e) {
+          // Ignore parse errors
+        }
+      }
+    }
+  }
+};
+
+// onQueuePosition(position) is called while the request waits for a
+// generation slot on a busy server (position 1 is next in line)
+export const askAI = async ({ message, latitude, longitude, language = "en" }, onStreamChunk, onQueuePosition) => {
   try {
-    const userId = getUserId();
     const response = await fetch(`${API_BASE_URL}/chat`, {
       method: "POST",
-      headers: {
-        "Content-Type": "application/json",
-        "user-id": userId || ""
-      },
+      headers: getHeaders(),
       body: JSON.stringify({
         message,
         latitude,
@@ -37,36 +81,53 @@ export const askAI = async ({ message, latitude, longitude, language = "en" }, o
       if (response.status === 401) {
         return "Please login to use the chat feature.";
       }
+      if (response.status === 429) {
+        return "The assistant is busy right now. Please try again in a few seconds.";
+      }
       return "Sorry, I couldn't connect to the server. Please make sure the backend is running.";
     }
 
-    // Handle streaming response
-    const reader = response.body.getReader();
-    const decoder = new TextDecoder();
+    // Handle streaming response; if the connection drops mid-answer,
+    // resume the same generation from the last event instead of asking again
+    const generationId = response.headers.get("X-Generation-Id");
+    let lastEventId = "";
     let fullText = "";
+    let body = response.body;
 
-    while (true) {
-      const { done, value } = await reader.read();
-      if (done) break;
-
-      const chunk = decoder.decode(value, { stream: true });
-      const lines = chunk.split("\n");
-
-      for (const line of lines) {
-        if (line.startsWith("data: ")) {
-          try {
-            const data = JSON.parse(line.slice(6));
-            if (data.text) {
-              fullText += data.text;
-              // Call callback with streamed chunk
-              if (onStreamChunk) {
-                onStreamChunk(data.text);
-              }
+    for (let attempt = 0; ; attempt++) {
+      try {
+        const result = await readEvents(body, (eventId, data) => {
+          if (eventId) {
+            lastEventId = eventId;
+          }
+          if (data.queue_position !== undefined && onQueuePosition) {
+            onQueuePosition(data.queue_position);
+          }
+          if (data.text) {
+            fullText += data.text;
+            // Call callback with streamed chunk
+            if (onStreamChunk) {
+              onStreamChunk(data.text);
             }
-          } catch (e) {
-            // Ignore parse errors
           }
+          return data.error;
+        });
+        if (result) {
+          return result;
+        }
+        break;
+      } catch (streamError) {
+        if (!generationId || attempt >= MAX_RESUME_ATTEMPTS) {
+          throw streamError;
+        }
+        await new Promise((resolve) => setTimeout(resolve, 1000 * (attempt + 1)));
+        const resumed = await fetch(`${API_BASE_URL}/chat/resume/${generationId}`, {
+          headers: { ...getHeaders(), "Last-Event-ID": lastEventId }
+        });
+        if (!resumed.ok) {
+          throw streamError;
         }
+        body = resumed.body;
       }
     }
 